@@ -12,6 +12,7 @@ const {
 const { uploadBuffer, getPublicUrl } = require("../utils/gcs");
 const path = require("path");
 const axios = require("axios");
+const { mlRequestOptions } = require("../utils/mlRequest");
 const crypto = require("crypto");
 
 function makeKey(filename) {
@@ -182,7 +183,7 @@ router.post("/:id/images", upload.array("images", 6), async (req, res) => {
           top_k_per_image: 3,
           device: process.env.ML_PREFERRED_DEVICE || "cpu",
         },
-        { timeout: 300000 }
+        mlRequestOptions(300000)
       );
 
       if (colorResp && colorResp.data && Array.isArray(colorResp.data.colors)) {
@@ -201,7 +202,7 @@ router.post("/:id/images", upload.array("images", 6), async (req, res) => {
             top_k_per_attr: 3,
             device: process.env.ML_PREFERRED_DEVICE || "cpu",
           },
-          { timeout: 300000 }
+          mlRequestOptions(300000)
         );
 
         // tagResp.data.tags expected shape: [ { image: "...", materials: [...], styles: [...], clip_colors: [...], merged_colors: [...], occasions: [...] }, ... ]
@@ -7,6 +7,7 @@ const axios = require("axios");
 const mongoose = require("mongoose");
 const path = require("path");
 const { deleteObject } = require("../utils/gcs");
+const { mlRequestOptions } = require("../utils/mlRequest");
 
 const ML = process.env.ML_SERVICE_URL;
 
@@ -218,7 +219,7 @@ router.get("/search", async (req, res) => {
     const mlResp = await axios.post(
       `${ML}/generate_search_results`,
       { query: searchQuery, k: 50 },
-      { timeout: 20000 }
+      mlRequestOptions(20000)
     );
     const mlResults = (mlResp.data && mlResp.data.results) || [];
 
@@ -296,7 +297,7 @@ router.get("/recommend", async (req, res) => {
     const mlResp = await axios.post(
       `${ML}/generate_search_results`,
       { query: searchQuery, k: 6 },
-      { timeout: 20000 }
+      mlRequestOptions(20000)
     );
     const mlResults = (mlResp.data && mlResp.data.results) || [];
 
@@ -354,29 +355,32 @@ router.get("/recommend", async (req, res) => {
   }
 });
 
+// Features for /gen_desc come as ?features[]=a&features[]=b, ?features=a,b or ?features=json-string
+function parseGenDescFeatures(raw) {
+  let features = raw || [];
+  if (typeof features === "string") {
+    // Try to parse JSON list: '["a","b"]'
+    try {
+      const parsed = JSON.parse(features);
+      if (Array.isArray(parsed)) return parsed.map(String);
+    } catch (_) {
+      // fallback: comma separated
+    }
+    return features
+      .split(",")
+      .map((s) => s.trim())
+      .filter(Boolean);
+  }
+  if (Array.isArray(features)) return features.map(String);
+  return [];
+}
+
 router.get("/gen_desc", async (req, res) => {
   try {
     // Frontend sends title/features as query params (axios.get(..., { params: {...} }))
     const title = (req.query.title || "").toString().trim();
     // features may come as ?features[]=a&features[]=b or ?features=a,b or ?features=json-string
-    let features = req.query.features || [];
-    if (typeof features === "string") {
-      // Try to parse JSON list: '["a","b"]'
-      try {
-        const parsed = JSON.parse(features);
-        if (Array.isArray(parsed)) features = parsed;
-      } catch (_) {
-        // fallback: comma separated
-        features = features
-          .split(",")
-          .map((s) => s.trim())
-          .filter(Boolean);
-      }
-    } else if (Array.isArray(features)) {
-      features = features.map(String);
-    } else {
-      features = [];
-    }
+    const features = parseGenDescFeatures(req.query.features);
 
     if (!title) {
       return res
@@ -396,11 +400,12 @@ router.get("/gen_desc", async (req, res) => {
     }
 
     // Call ML service which returns { description: "..." }
-    const payload = { title, features };
+    // fresh=true asks for a new description instead of a cached one
+    const payload = { title, features, fresh: req.query.fresh === "true" };
     const mlResp = await axios.post(
       `${ML.replace(/\/$/, "")}/generate_description`,
       payload,
-      { timeout: 20000 }
+      mlRequestOptions(20000)
     );
 
     const description =
@@ -424,6 +429,85 @@ router.get("/gen_desc", async (req, res) => {
   }
 });
 
+// Streaming variant: forwards the ML service's server-sent events
+// (`token` events while decoding, a closing `done` event with the description,
+// or an `error` event when the ML service rejects or fails the request).
+router.get("/gen_desc/stream", async (req, res) => {
+  const title = (req.query.title || "").toString().trim();
+  const features = parseGenDescFeatures(req.query.features);
+  if (!title) {
+    return res
+      .status(400)
+      .json({ error: "missing_parameters", message: "title is required" });
+  }
+  if (!ML) {
+    console.error(
+      "ML_SERVICE_URL is not configured. Set process.env.ML_SERVICE_URL"
+    );
+    return res.status(500).json({
+      error: "ml_service_unavailable",
+      message: "ML service URL not configured",
+    });
+  }
+
+  try {
+    const mlResp = await axios.post(
+      `${ML.replace(/\/$/, "")}/generate_description/stream`,
+      { title, features, fresh: req.query.fresh === "true" },
+      // resolve on every status so errors can be turned into SSE events below
+      mlRequestOptions(120000, { responseType: "stream", validateStatus: () => true })
+    );
+    res.setHeader("Content-Type", "text/event-stream");
+    res.setHeader("Cache-Control", "no-cache");
+    res.setHeader("Connection", "keep-alive");
+    res.setHeader("X-Accel-Buffering", "no");
+    res.flushHeaders();
+
+    const contentType = String(mlResp.headers["content-type"] || "");
+    if (mlResp.status >= 400 || !contentType.startsWith("text/event-stream")) {
+      // 429/503 (shed, disabled) and other errors come back as JSON: relay them as an
+      // `error` event instead of writing a JSON body into the event stream
+      let body = "";
+      for await (const chunk of mlResp.data) body += chunk;
+      let detail;
+      try {
+        detail = JSON.parse(body);
+      } catch (_) {
+        detail = { error: "ml_service_error", detail: body.slice(0, 500) };
+      }
+      res.write(
+        `event: error\ndata: ${JSON.stringify({
+          ...detail,
+          status: mlResp.status,
+          retryAfter: mlResp.headers["retry-after"] || null,
+        })}\n\n`
+      );
+      return res.end();
+    }
+
+    mlResp.data.pipe(res);
+    // drop the upstream connection when the artisan navigates away
+    req.on("close", () => mlResp.data.destroy());
+  } catch (err) {
+    console.error(
+      "generate_description stream proxy error",
+      err?.message || err
+    );
+    const fallback = `${title}. Features: ${features.join(", ")}`;
+    if (!res.headersSent) {
+      res.setHeader("Content-Type", "text/event-stream");
+    }
+    res.write(
+      `event: done\ndata: ${JSON.stringify({
+        description: fallback,
+        error: "generation_proxy_failed",
+        detail: err?.message,
+      })}\n\n`
+    );
+    res.end();
+  }
+});
+
 // Get a single listing by ID (must be after /retrieve and /search to avoid conflicts)
 router.get("/:id", async (req, res) => {
   try {
@@ -0,0 +1,24 @@
+// backend/utils/mlRequest.js
+
+/**
+ * axios options for calls to the ML service.
+ *
+ * Besides the client timeout, the remaining time budget is sent as
+ * X-Request-Timeout-Ms (relative, so clock skew between hosts does not matter).
+ * The ML service drops queued work once that budget is spent instead of
+ * finishing answers nobody waits for. X-Request-Priority lets bulk callers
+ * ("batch") yield to interactive requests.
+ */
+function mlRequestOptions(timeoutMs, { priority = "interactive", ...rest } = {}) {
+  return {
+    ...rest,
+    timeout: timeoutMs,
+    headers: {
+      ...(rest.headers || {}),
+      "X-Request-Timeout-Ms": String(timeoutMs),
+      "X-Request-Priority": priority,
+    },
+  };
+}
+
+module.exports = { mlRequestOptions };
@@ -1,26 +1,41 @@
 # ml/app.py
+import time
+_IMPORT_T0 = time.perf_counter()
+
 from dotenv import load_dotenv
+import importlib
 import os
+import sys
+import json
 import logging
-from contextlib import asynccontextmanager
-from typing import Optional, List
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from functools import partial
+from typing import TYPE_CHECKING, Dict, Optional, List
 
+import io
 import numpy as np
-from fastapi import FastAPI
+from PIL import Image
+from fastapi import FastAPI, File, Form, Request, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from huggingface_hub import snapshot_download
-from sentence_transformers import SentenceTransformer
-
-from faiss_index import FaissTextIndexer
 
-# Import the generator implemented above
-from generate_description import generate_description as generate_desc_fn
+# torch, sentence_transformers, faiss, open_clip and transformers are imported by the
+# subsystem that needs them (see load_models), so importing this module stays cheap.
+# import our detector (sklearn and rembg are imported on first use)
+from color_detector import aggregate_images as detect_colors_aggregate, COLOR_METHODS
 
-# import our detector
-from color_detector import aggregate_images as detect_colors_aggregate
+from color_index import color_to_lab, COLOR_MAX_DELTA_E, COLOR_MAX_DELTA_E_LIMIT
+from metrics import REGISTRY
+from executors import apply_torch_threads, get_executor, executor_stats, Rejected, WORKLOADS
 
-from clip_tagging import ClipTagger
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+    from faiss_index import FaissTextIndexer
+    from clip_tagging import ClipTagger
 
 import psutil
 SYSTEM_RAM = int((psutil.virtual_memory().total)/(1024**3))
@@ -36,28 +51,96 @@ MONGO_URI = os.environ.get("MONGO_URI")
 ML_DB = os.environ.get("ML_DB")
 ML_COLLECTION = os.environ.get("ML_COLLECTION")
 DEFAULT_K = int(os.environ.get("DEFAULT_K", 10))
+# load + warm the description model at startup (0 = lazily on the first request, not required by /ready)
+GEN_DESC_EAGER = os.environ.get("GEN_DESC_EAGER", "1") == "1"
+# seconds between checks for a newer published index snapshot (0 = never reload)
+INDEX_RELOAD_INTERVAL = float(os.environ.get("INDEX_RELOAD_INTERVAL", "10"))
+# subsystems this process serves, e.g. ML_SUBSYSTEMS=search for a search-only pod; a disabled
+# subsystem loads no models and its endpoints answer 503 "subsystem_disabled"
+#   search: text model + FAISS index    clip: CLIP tagger + image search
+#   generation: description model       colors: color detection
+SUBSYSTEMS = ("search", "clip", "generation", "colors")
+ML_SUBSYSTEMS = {s.strip() for s in os.environ.get("ML_SUBSYSTEMS", ",".join(SUBSYSTEMS)).split(",") if s.strip()}
 
 # ---------------------------
 # Logging
 # ---------------------------
 logging.basicConfig(level=logging.INFO, format="[%(asctime)s] %(levelname)s: %(message)s")
 LOG = logging.getLogger("ml_service")
+for _name in sorted(ML_SUBSYSTEMS - set(SUBSYSTEMS)):
+    LOG.warning("Ignoring unknown subsystem %r in ML_SUBSYSTEMS (known: %s)", _name, ", ".join(SUBSYSTEMS))
 
 # ---------------------------
 # Globals (initialized in lifespan)
 # ---------------------------
-text_model: Optional[SentenceTransformer] = None
-indexer: Optional[FaissTextIndexer] = None
+text_model: Optional["SentenceTransformer"] = None
+indexer: Optional["FaissTextIndexer"] = None
 index_ntotal: int = 0
 index_dim: Optional[int] = None
-clip_tagger: Optional[ClipTagger] = None
-clip_tagger_model_name: Optional[str] = "ViT-H-14" if SYSTEM_RAM > 17 else "ViT-B-32"
+clip_tagger: Optional["ClipTagger"] = None
+# fast tier serves every request; the large tier is only loaded when RAM allows and used on escalation
+clip_tagger_model_name: Optional[str] = os.environ.get("CLIP_FAST_MODEL", "ViT-B-32")
+clip_escalation_model_name: Optional[str] = os.environ.get("CLIP_LARGE_MODEL", "ViT-H-14" if SYSTEM_RAM > 17 else "") or None
+# model -> "loading" | "ready" | "failed" | "disabled"; /ready is true once nothing is loading or failed
+readiness: dict = {
+    "text_model": "loading" if "search" in ML_SUBSYSTEMS else "disabled",
+    "clip": "loading" if "clip" in ML_SUBSYSTEMS else "disabled",
+    "generator": "loading" if GEN_DESC_EAGER and "generation" in ML_SUBSYSTEMS else "disabled",
+}
+
+# ---------------------------
+# Startup phases
+# ---------------------------
+# phase -> seconds, logged once the service is up and exported as startup_seconds{phase}
+# gauges on /stats; "<subsystem>.import" is the time spent importing that subsystem's modules
+# (when loaders run in parallel, a shared module such as torch is charged to whichever imports it first)
+startup_phases: Dict[str, float] = {}
+
+@contextmanager
+def _phase(name: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        startup_phases[name] = round(time.perf_counter() - t0, 3)
+        REGISTRY.set_gauge("startup_seconds", startup_phases[name], phase=name)
+
+startup_phases["import"] = round(time.perf_counter() - _IMPORT_T0, 3)
+REGISTRY.set_gauge("startup_seconds", startup_phases["import"], phase="import")
 
 # ---------------------------
 # FastAPI app with lifespan
 # ---------------------------
 app = FastAPI(title="Embedding & FAISS Service")
 
+class RequestMetricsMiddleware:
+    """
+    http_request_seconds{endpoint,method,status} histogram, timed until the response is fully
+    sent (for streams, the whole stream). endpoint is the route template, so it stays low-cardinality.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        t0 = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            REGISTRY.observe("http_request_seconds", time.perf_counter() - t0,
+                             endpoint=getattr(route, "path", "unmatched"), method=scope["method"], status=status)
+
+app.add_middleware(RequestMetricsMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=[
@@ -69,50 +152,178 @@ app.add_middleware(
     allow_credentials=True,
 )
 
+def _warm_text_model() -> bool:
+    if text_model is None:
+        return False
+    text_model.encode(["warm up"], convert_to_numpy=True)
+    return True
+
+def _warm_clip() -> bool:
+    if clip_tagger is None:
+        return False
+    clip_tagger.warmup()
+    return True
+
+def _warm_generator() -> bool:
+    from generate_description import warmup
+    return warmup()
+
+_WARMUPS = {"text_model": _warm_text_model, "clip": _warm_clip, "generator": _warm_generator}
+
+def _warm_models(names: List[str]):
+    """Warm-up pass run in the background after startup; flips the readiness flags one by one."""
+    for name in names:
+        if readiness[name] == "disabled":
+            continue
+        t0 = time.perf_counter()
+        with _phase(f"warmup.{name}"):
+            try:
+                readiness[name] = "ready" if _WARMUPS[name]() else "failed"
+            except Exception as e:
+                LOG.exception("Warm-up of %s failed: %s", name, e)
+                readiness[name] = "failed"
+        LOG.info("Warm-up %s: %s (%.1fs)", name, readiness[name], time.perf_counter() - t0)
+
+def _load_search():
+    global text_model, indexer, index_ntotal, index_dim
+    with _phase("search.import"):
+        from huggingface_hub import snapshot_download
+        from sentence_transformers import SentenceTransformer
+        from faiss_index import FaissTextIndexer
+
+    with _phase("search.text_model"):
+        try:
+            LOG.info("Checking for text model: %s", TEXT_EMBED_MODEL)
+            # If TEXT_EMBED_MODEL is a repo ID, this ensures it's cached locally
+            # If it's a local path that doesn't exist, this will try to fetch it from HF
+            model_path = os.environ.get('HF_HOME', './model_cache')
+            if not os.path.exists(model_path):
+                LOG.info("Model not found locally. Downloading from Hugging Face...")
+                model_path = snapshot_download(repo_id=TEXT_EMBED_MODEL, library_name="sentence-transformers")
+            
+            text_model = SentenceTransformer("sentence-transformers/" + TEXT_EMBED_MODEL, cache_folder=model_path)
+            LOG.info("Text model loaded from: %s", model_path)
+        except Exception as e:
+            LOG.exception("Failed to load/download text model: %s", e)
+            text_model = None
+
+    with _phase("search.index"):
+        try:
+            LOG.info("Initializing FaissTextIndexer (mongo=%s db=%s coll=%s)", MONGO_URI, ML_DB, ML_COLLECTION)
+            # the indexer embeds incremental updates with the same (already loaded) text model
+            indexer = FaissTextIndexer(db_name=ML_DB, collection_name=ML_COLLECTION, data_dir=DATA_DIR, mongo_uri=MONGO_URI,
+                                       text_model=text_model)
+            try:
+                index_ntotal = int(getattr(indexer.index, "ntotal", 0))
+            except Exception:
+                index_ntotal = 0
+            index_dim = getattr(indexer, "dim", None)
+            LOG.info("Indexer ready. ntotal=%s dim=%s", index_ntotal, index_dim)
+        except Exception as e:
+            LOG.exception("Failed to initialize indexer: %s", e)
+            indexer = None
+            index_ntotal = 0
+            index_dim = None
+
+def _load_clip():
+    global clip_tagger, clip_tagger_model_name
+    with _phase("clip.import"):
+        from clip_tagging import ClipTagger
+
+    with _phase("clip.models"):
+        try:
+            LOG.info("Initializing ClipTagger (fast=%s, escalation=%s).", clip_tagger_model_name, clip_escalation_model_name)
+            clip_tagger = ClipTagger(model_preference=clip_tagger_model_name, escalation_model=clip_escalation_model_name)
+            clip_tagger_model_name = clip_tagger.model_name
+            LOG.info("ClipTagger initialized with models: %s", clip_tagger.model_names)
+        except Exception as e:
+            LOG.exception("ClipTagger init failed: %s", e)
+            LOG.info("tags: [], error: clip_init_failed, detail: %s", str(e))
+            clip_tagger = None
+            clip_tagger_model_name = None
+
+def _load_generator():
+    with _phase("generation.import"):
+        import generate_description
+    with _phase("generation.model"):
+        generate_description.load_model()
+
+def _import_torch():
+    """torch is shared by every model loader; import it once up front instead of from concurrent loader threads."""
+    if "torch" in sys.modules or not ML_SUBSYSTEMS & {"search", "clip", "generation"}:
+        return
+    with _phase("torch.import"):
+        importlib.import_module("torch")
+
+_loaded: set = set()
+
+def load_models(clip: bool = True, generator: bool = False):
+    """
+    Load the models of the enabled subsystems into the module globals: the text model and
+    FAISS index, the CLIP tagger and optionally the description model, each in its own thread.
+    Parts loaded by an earlier call are skipped; failures are logged, not raised. serve.py calls this in the parent process
+    before forking workers, so the weights are shared copy-on-write.
+    """
+    loaders = [("search", _load_search)]
+    if clip:
+        loaders.append(("clip", _load_clip))
+    if generator:
+        loaders.append(("generation", _load_generator))
+    loaders = [(name, fn) for name, fn in loaders if name in ML_SUBSYSTEMS and name not in _loaded]
+
+    if loaders:
+        _import_torch()
+        with _phase("models"), ThreadPoolExecutor(max_workers=len(loaders), thread_name_prefix="load") as pool:
+            futures = [(name, pool.submit(fn)) for name, fn in loaders]
+        # a part that failed (e.g. its import raised) is logged and retried by the next call
+        for name, future in futures:
+            try:
+                future.result()
+                _loaded.add(name)
+            except Exception as e:
+                LOG.exception("Loading %s failed: %s", name, e)
+
+    if indexer is not None and clip_tagger is not None and indexer.image_embedder is not clip_tagger:
+        # the image index shares the indexer's ids/metadata and reuses embeddings computed by tagging
+        indexer.attach_image_embedder(clip_tagger)
+
+def _watch_index():
+    """Pick up index snapshots published by other workers or by a CLI rebuild."""
+    global index_ntotal
+    while True:
+        time.sleep(INDEX_RELOAD_INTERVAL)
+        if indexer is None:
+            continue
+        try:
+            if indexer.reload_if_changed():
+                index_ntotal = int(getattr(indexer.index, "ntotal", 0))
+        except Exception as e:
+            LOG.exception("Index reload failed: %s", e)
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global text_model, indexer, index_ntotal, index_dim, clip_tagger, clip_tagger_model_name
     # startup
-    try:
-        LOG.info("Checking for text model: %s", TEXT_EMBED_MODEL)
-        # If TEXT_EMBED_MODEL is a repo ID, this ensures it's cached locally
-        # If it's a local path that doesn't exist, this will try to fetch it from HF
-        model_path = os.environ.get('HF_HOME', './model_cache')
-        if not os.path.exists(model_path):
-            LOG.info("Model not found locally. Downloading from Hugging Face...")
-            model_path = snapshot_download(repo_id=TEXT_EMBED_MODEL, library_name="sentence-transformers")
-        
-        text_model = SentenceTransformer("sentence-transformers/" + TEXT_EMBED_MODEL, cache_folder=model_path)
-        LOG.info("Text model loaded from: %s", model_path)
-    except Exception as e:
-        LOG.exception("Failed to load/download text model: %s", e)
-        text_model = None
+    # request executors claim their share of the CPU budget before any lazily created pool does
+    for workload in WORKLOADS:
+        get_executor(workload)
 
-    try:
-        LOG.info("Initializing FaissTextIndexer (mongo=%s db=%s coll=%s)", MONGO_URI, ML_DB, ML_COLLECTION)
-        indexer = FaissTextIndexer(db_name=ML_DB, collection_name=ML_COLLECTION, data_dir=DATA_DIR, mongo_uri=MONGO_URI)
-        try:
-            index_ntotal = int(getattr(indexer.index, "ntotal", 0))
-        except Exception:
-            index_ntotal = 0
-        index_dim = getattr(indexer, "dim", None)
-        LOG.info("Indexer ready. ntotal=%s dim=%s", index_ntotal, index_dim)
-    except Exception as e:
-        LOG.exception("Failed to initialize indexer: %s", e)
-        indexer = None
-        index_ntotal = 0
-        index_dim = None
+    # the description model is not needed to serve, so it loads (and warms) in the background
+    # alongside the other models; /ready reports progress
+    _import_torch()
+    if "torch" in sys.modules:
+        LOG.info("torch intra-op threads: %d", apply_torch_threads())
+    threading.Thread(target=_warm_models, args=(["generator"],), name="warmup-generator", daemon=True).start()
+    load_models()
+    if INDEX_RELOAD_INTERVAL > 0:
+        threading.Thread(target=_watch_index, name="index-reload", daemon=True).start()
+    # under serve.py, publish this worker's metrics for scrapes answered by the other workers
+    REGISTRY.start_flushing(refresh=_update_resource_gauges)
+    threading.Thread(target=_warm_models, args=(["text_model", "clip"],), name="warmup", daemon=True).start()
 
-    try:
-        LOG.info("Initializing ClipTagger with default model.")
-        clip_tagger = ClipTagger(model_preference=clip_tagger_model_name)
-        clip_tagger_model_name = clip_tagger.model_name
-        LOG.info("ClipTagger initialized with model: %s", clip_tagger_model_name)
-    except Exception as e:
-        LOG.exception("ClipTagger init failed: %s", e)
-        LOG.info("tags: [], error: clip_init_failed, detail: %s", str(e))
-        clip_tagger = None
-        clip_tagger_model_name = None
+    startup_phases["total"] = round(time.perf_counter() - _IMPORT_T0, 3)
+    REGISTRY.set_gauge("startup_seconds", startup_phases["total"], phase="total")
+    LOG.info("Started (subsystems: %s). Startup phases: %s", ",".join(sorted(ML_SUBSYSTEMS)),
+             " ".join(f"{k}={v:.2f}s" for k, v in startup_phases.items()))
 
     yield
 
@@ -134,17 +345,32 @@ class GenDescReq(BaseModel):
     features: Optional[list] = None
     category: Optional[str] = "Handmade"
     tone: str = "friendly and concise"
+    fresh: bool = False     # skip the description cache and generate a new candidate
 
 class DetectColorsReq(BaseModel):
     images: List[str]
     top_k_per_image: int = 3
     device: str = "cpu"
+    method: Optional[str] = None
 
 class ZeroShotTagReq(BaseModel):
     images: List[str]
     top_k_per_attr: int = 3
     device: str = "cpu"
     model_name: Optional[str] = None
+    crop_policy: Optional[str] = None
+    escalate: Optional[bool] = None
+
+class ImageTextSearchReq(BaseModel):
+    query: str
+    k: int = DEFAULT_K
+
+class ColorSearchReq(BaseModel):
+    colors: List[str]               # hex ("#b3212a") or color names ("maroon")
+    query: Optional[str] = None     # optional text query; its results are re-ranked by color
+    k: int = DEFAULT_K
+    max_delta_e: float = COLOR_MAX_DELTA_E
+    text_weight: float = 0.5        # share of the text score in the combined ranking
 
 class SuggestLabelsReq(BaseModel):
     texts: List[str]
@@ -152,9 +378,59 @@ class SuggestLabelsReq(BaseModel):
     ngram_min: int = 1
     ngram_max: int = 2
 
+class BackfillReq(BaseModel):
+    limit: Optional[int] = None
+    min_chars: Optional[int] = None
+    dry_run: bool = False
+    reset: bool = False     # ignore the checkpoint and start over
+
+class CatalogLabelsReq(BaseModel):
+    top_k: int = 200
+    ngram_min: int = 1
+    ngram_max: int = 2
+    fields: List[str] = ["title", "description"]
+    chunk_size: int = 1000
+
+# ---------------------------
+# Admission control
+# ---------------------------
+# Callers send their remaining time budget (relative, so clock skew does not matter) and
+# optionally a priority; work still queued when the budget runs out is dropped unrun.
+DEADLINE_HEADER = "x-request-timeout-ms"
+PRIORITY_HEADER = "x-request-priority"
+
+def _request_deadline(request: Request) -> Optional[float]:
+    raw = request.headers.get(DEADLINE_HEADER)
+    try:
+        return time.monotonic() + float(raw) / 1000.0 if raw else None
+    except ValueError:
+        return None
+
+def _request_priority(request: Request) -> str:
+    return (request.headers.get(PRIORITY_HEADER) or "interactive").lower()
+
+async def _admitted(workload: str, request: Request, fn, *args):
+    """Run fn on the workload's executor, or answer 429/503 right away if it cannot be admitted."""
+    try:
+        return await get_executor(workload).run(fn, *args, deadline=_request_deadline(request), priority=_request_priority(request))
+    except Rejected as e:
+        return JSONResponse({"error": e.reason, "workload": workload}, status_code=e.status, headers={"Retry-After": "1"})
+
+def _disabled(*subsystems: str) -> Optional[JSONResponse]:
+    """503 response when one of the subsystems an endpoint needs is turned off by ML_SUBSYSTEMS."""
+    off = [name for name in subsystems if name not in ML_SUBSYSTEMS]
+    if not off:
+        return None
+    return JSONResponse({"error": "subsystem_disabled", "subsystems": off}, status_code=503)
+
 # ---------------------------
 # Endpoints
 # ---------------------------
+def _gen_desc_backend() -> Optional[str]:
+    # reported without importing the generator (and torch) just for /health
+    module = sys.modules.get("generate_description")
+    return module.loaded_backend() if module is not None else None
+
 @app.get("/health")
 def health():
     return {
@@ -162,11 +438,78 @@ def health():
         "text_model_loaded": text_model is not None,
         "index_loaded": indexer is not None,
         "index_ntotal": index_ntotal,
-        "index_dim": index_dim
+        "index_dim": index_dim,
+        "clip_models": clip_tagger.model_names if clip_tagger is not None else [],
+        "image_index_ntotal": int(getattr(getattr(indexer, "image_index", None), "ntotal", 0) or 0),
+        # snapshot served by this worker; all workers converge within INDEX_RELOAD_INTERVAL
+        "index_version": getattr(indexer, "version", None),
+        "pid": os.getpid(),
+        "gen_desc_backend": _gen_desc_backend(),
+        "subsystems": sorted(ML_SUBSYSTEMS),
     }
 
+@app.get("/ready")
+def ready():
+    """Readiness probe: 200 once every configured model is loaded and warm, 503 before (or if one failed)."""
+    ok = all(state in ("ready", "disabled") for state in readiness.values())
+    return JSONResponse({"ready": ok, "models": dict(readiness)}, status_code=200 if ok else 503)
+
+@app.get("/stats")
+def stats():
+    out = REGISTRY.snapshot()
+    out["executors"] = executor_stats()
+    if clip_tagger is not None:
+        out["clip"] = clip_tagger.tier_stats()
+    return out
+
+_module_bytes_cache: Dict[int, int] = {}
+
+def _module_bytes(model) -> Optional[int]:
+    """Parameter + buffer bytes of a torch module (cached per model); None for non-torch backends."""
+    if model is None or not hasattr(model, "parameters"):
+        return None
+    key = id(model)
+    if key not in _module_bytes_cache:
+        try:
+            tensors = list(model.parameters()) + list(model.buffers())
+            _module_bytes_cache[key] = sum(t.numel() * t.element_size() for t in tensors)
+        except Exception:
+            return None
+    return _module_bytes_cache[key]
+
+def _update_resource_gauges():
+    """Memory gauges computed at scrape time: process RSS, model weights and FAISS vectors."""
+    REGISTRY.set_gauge("process_resident_memory_bytes", psutil.Process().memory_info().rss)
+    models = {"text": text_model}
+    if clip_tagger is not None:
+        models.update({f"clip:{name}": tier.model for name, tier in clip_tagger.tiers.items()})
+    gen = sys.modules.get("generate_description")
+    if gen is not None:
+        models["generator"] = gen.loaded_model()
+    for name, model in models.items():
+        size = _module_bytes(model)
+        if size is not None:
+            REGISTRY.set_gauge("model_memory_bytes", size, model=name)
+    for name, index in (("text", getattr(indexer, "index", None)), ("image", getattr(indexer, "image_index", None))):
+        if index is not None:
+            REGISTRY.set_gauge("index_vectors", index.ntotal, index=name)
+            REGISTRY.set_gauge("index_memory_bytes", index.ntotal * index.d * 4, index=name)
+
+@app.get("/metrics")
+def metrics():
+    """
+    Prometheus scrape endpoint: request and per-stage latency histograms, batch sizes, cache hit
+    counters/rates, queue depths and memory. Under serve.py any worker answers with the merged
+    metrics of all workers (see metrics.enable_multiprocess); gauges carry a `worker` label.
+    """
+    _update_resource_gauges()
+    return PlainTextResponse(REGISTRY.prometheus(), media_type="text/plain; version=0.0.4")
+
 @app.post("/generate_search_results")
-def generate_search_results(req: GenerateSearchReq):
+async def generate_search_results(request: Request, req: GenerateSearchReq):
+    return _disabled("search") or await _admitted("search", request, _generate_search_results, req)
+
+def _generate_search_results(req: GenerateSearchReq):
     q = (req.query or "").strip()
     k = max(1, min(int(req.k or DEFAULT_K), 100))
     if not q:
@@ -180,7 +523,8 @@ def generate_search_results(req: GenerateSearchReq):
         return {"results": [], "error": "index_not_initialized"}
 
     try:
-        qvec = text_model.encode([q], convert_to_numpy=True)
+        with REGISTRY.timer("stage_seconds", stage="text_model.encode"):
+            qvec = text_model.encode([q], convert_to_numpy=True)
         if qvec is None or len(qvec) == 0:
             LOG.error("Empty encoding for query.")
             return {"results": []}
@@ -191,28 +535,156 @@ def generate_search_results(req: GenerateSearchReq):
 
     try:
         results = indexer.search(query_vector, k=k)
-        out = []
-        seen = set()
-        for r in results:
-            lid = r.get("listing_id") or r.get("_id") or r.get("faiss_id") or None
-            if lid is None:
-                lid = str(r.get("id", r.get("faiss_id", "")))
-            if lid in seen:
-                continue
-            seen.add(lid)
-            out.append(r)
-            if len(out) >= k:
-                break
-        return {"results": out}
+        return {"results": _dedupe_results(results, k)}
     except Exception as e:
         LOG.exception("Search failed: %s", e)
         return {"results": [], "error": "search_failed", "detail": str(e)}
 
+def _dedupe_results(results: list, k: int) -> list:
+    out = []
+    seen = set()
+    for r in results:
+        lid = r.get("listing_id") or r.get("_id") or r.get("faiss_id") or None
+        if lid is None:
+            lid = str(r.get("id", r.get("faiss_id", "")))
+        if lid in seen:
+            continue
+        seen.add(lid)
+        out.append(r)
+        if len(out) >= k:
+            break
+    return out
+
+def _image_search(query_vector: np.ndarray, k: int) -> dict:
+    try:
+        return {"results": _dedupe_results(indexer.search_images(query_vector, k=k), k)}
+    except Exception as e:
+        LOG.exception("Image search failed: %s", e)
+        return {"results": [], "error": "search_failed", "detail": str(e)}
+
+@app.post("/search_by_image")
+async def search_by_image(request: Request, file: Optional[UploadFile] = File(None), image_url: Optional[str] = Form(None), k: int = Form(DEFAULT_K)):
+    return _disabled("clip", "search") or await _admitted("tagging", request, _search_by_image, file, image_url, k)
+
+def _search_by_image(file: Optional[UploadFile], image_url: Optional[str], k: int):
+    """
+    Multipart form: either an uploaded `file` or an `image_url` (http(s), data: URI), plus optional `k`.
+    Returns listings whose CLIP image embedding is closest to the query image.
+    """
+    k = max(1, min(int(k or DEFAULT_K), 100))
+    if clip_tagger is None:
+        return {"results": [], "error": "clip_not_loaded"}
+    if indexer is None:
+        return {"results": [], "error": "index_not_initialized"}
+    try:
+        if file is not None:
+            image = Image.open(io.BytesIO(file.file.read())).convert("RGB")
+        elif image_url:
+            image = clip_tagger._fetch_image(image_url.strip())
+        else:
+            return {"results": [], "error": "missing_image"}
+        query_vector = clip_tagger.embed_image(image)
+    except Exception as e:
+        LOG.exception("Image encoding failed: %s", e)
+        return {"results": [], "error": "encode_failed", "detail": str(e)}
+    return _image_search(query_vector, k)
+
+@app.post("/search_images_by_text")
+async def search_images_by_text(request: Request, req: ImageTextSearchReq):
+    return _disabled("clip", "search") or await _admitted("search", request, _search_images_by_text, req)
+
+def _search_images_by_text(req: ImageTextSearchReq):
+    """Text -> image search: the query is embedded with the CLIP text tower and matched against listing images."""
+    q = (req.query or "").strip()
+    k = max(1, min(int(req.k or DEFAULT_K), 100))
+    if not q:
+        return {"results": []}
+    if clip_tagger is None:
+        return {"results": [], "error": "clip_not_loaded"}
+    if indexer is None:
+        return {"results": [], "error": "index_not_initialized"}
+    try:
+        query_vector = clip_tagger.embed_text(q)
+    except Exception as e:
+        LOG.exception("Encoding failed: %s", e)
+        return {"results": [], "error": "encode_failed", "detail": str(e)}
+    return _image_search(query_vector, k)
+
+# text hits fetched per requested result when a color search also has a text query
+COLOR_TEXT_CANDIDATES = int(os.environ.get("COLOR_TEXT_CANDIDATES", "5"))
+
+@app.post("/search_by_color")
+async def search_by_color(request: Request, req: ColorSearchReq):
+    return _disabled("search") or await _admitted("search", request, _search_by_color, req)
+
+def _search_by_color(req: ColorSearchReq):
+    """Shop by color: listings whose stored palette is close (CIE76) to the requested colors."""
+    k = max(1, min(int(req.k or DEFAULT_K), 100))
+    if indexer is None:
+        return {"results": [], "error": "index_not_initialized"}
+    labs, unknown = [], []
+    for c in req.colors or []:
+        lab = color_to_lab(c)
+        if lab is None:
+            unknown.append(c)
+        else:
+            labs.append(lab)
+    if unknown:
+        return {"results": [], "error": "unknown_color", "detail": unknown}
+    if not labs:
+        return {"results": []}
+    max_de = min(max(1.0, float(req.max_delta_e)), COLOR_MAX_DELTA_E_LIMIT)
+    q = (req.query or "").strip()
+
+    try:
+        if not q:
+            return {"results": _dedupe_results(indexer.search_by_color(np.array(labs), k=k, max_delta_e=max_de), k)}
+
+        if text_model is None:
+            return {"results": [], "error": "text_model_not_loaded"}
+        with REGISTRY.timer("stage_seconds", stage="text_model.encode"):
+            query_vector = np.asarray(text_model.encode([q], convert_to_numpy=True)[0], dtype="float32")
+        text_hits = indexer.search(query_vector, k=k * COLOR_TEXT_CANDIDATES)
+        text_scores = {int(r["faiss_vector_id"]): r["score"] for r in text_hits}
+        results = indexer.search_by_color(np.array(labs), max_delta_e=max_de, candidate_ids=list(text_scores))
+        w = min(max(float(req.text_weight), 0.0), 1.0)
+        for r in results:
+            r["score"] = text_scores[int(r["faiss_vector_id"])]
+            r["combined_score"] = w * r["score"] + (1.0 - w) * r["color_score"]
+        results.sort(key=lambda r: -r["combined_score"])
+        return {"results": _dedupe_results(results, k)}
+    except Exception as e:
+        LOG.exception("Color search failed: %s", e)
+        return {"results": [], "error": "search_failed", "detail": str(e)}
+
 @app.post("/generate_description")
-def generate_description_endpoint(req: GenDescReq):
+async def generate_description_endpoint(request: Request, req: GenDescReq):
+    disabled = _disabled("generation")
+    if disabled is not None:
+        return disabled
+    # cache hits are answered right here instead of queueing behind generations (or being shed)
+    cached = await run_in_threadpool(_cached_description, req)
+    if cached:
+        return {"description": cached}
+    return await _admitted("generation", request, _generate_description_endpoint, req)
+
+def _cached_description(req: GenDescReq) -> Optional[str]:
+    title = (req.title or "").strip()
+    if not title or req.fresh:
+        return None
+    try:
+        from generate_description import cached_description
+        return cached_description(title=title, features=req.features or [], category=req.category or None,
+                                  tone=req.tone or None, max_lines=int(os.getenv("GEN_DESC_MAX_LINES", "10")))
+    except Exception as e:
+        LOG.warning("Description cache lookup failed: %s", e)
+        return None
+
+def _generate_description_endpoint(req: GenDescReq):
     """
     Use the generate_description function from generate_description.py
     This will try the local Transformers model (google/flan-t5-large) and revert to safe fallback if needed.
+    The cache was already checked before admission, so this always generates.
     """
     title = (req.title or "").strip()
     features = req.features or []
@@ -223,7 +695,8 @@ def generate_description_endpoint(req: GenDescReq):
         return {"description": ""}
 
     try:
-        desc = generate_desc_fn(title=title, features=features, category=category, tone=tone, max_lines=int(os.getenv("GEN_DESC_MAX_LINES", "10")))
+        from generate_description import generate_description as generate_desc_fn
+        desc = generate_desc_fn(title=title, features=features, category=category, tone=tone, max_lines=int(os.getenv("GEN_DESC_MAX_LINES", "10")), fresh=True)
         return {"description": desc}
     except Exception as e:
         LOG.exception("Description generation endpoint failed: %s", e)
@@ -231,12 +704,71 @@ def generate_description_endpoint(req: GenDescReq):
         fallback = f"{title}. Features: {', '.join(features or [])}."
         return {"description": fallback, "error": "generation_failed", "detail": str(e)}
 
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/generate_description/stream")
+def generate_description_stream(request: Request, req: GenDescReq):
+    """
+    Server-sent events version of /generate_description: `token` events carry text of the
+    leading candidate as it is decoded, a closing `done` event carries {description, ttft_ms}.
+    The decode runs on the generation executor under the request's deadline and priority; the
+    response only relays its tokens and stops the decode when the client disconnects.
+    """
+    disabled = _disabled("generation")
+    if disabled is not None:
+        return disabled
+    title = (req.title or "").strip()
+    features = req.features or []
+    category = req.category or None
+    tone = req.tone or None
+    max_lines = int(os.getenv("GEN_DESC_MAX_LINES", "10"))
+    cancel = threading.Event()
+
+    if not title:
+        stream = iter([("done", {"description": ""})])
+    else:
+        from generate_description import stream_description
+        try:
+            stream = stream_description(title=title, features=features, category=category, tone=tone, max_lines=max_lines,
+                                        fresh=bool(req.fresh), cancel=cancel,
+                                        submit=partial(get_executor("generation").submit, deadline=_request_deadline(request),
+                                                       priority=_request_priority(request)))
+        except Rejected as e:
+            return JSONResponse({"error": e.reason, "workload": "generation"}, status_code=e.status, headers={"Retry-After": "1"})
+        except Exception as e:
+            LOG.exception("Description streaming failed: %s", e)
+            fallback = f"{title}. Features: {', '.join(features or [])}."
+            stream = iter([("done", {"description": fallback, "error": "generation_failed", "detail": str(e)})])
+
+    def events():
+        try:
+            for event, data in stream:
+                yield _sse(event, data)
+        except Rejected as e:
+            yield _sse("error", {"error": e.reason, "workload": "generation"})
+        except Exception as e:
+            LOG.exception("Description streaming failed: %s", e)
+            fallback = f"{title}. Features: {', '.join(features or [])}."
+            yield _sse("done", {"description": fallback, "error": "generation_failed", "detail": str(e)})
+        finally:
+            # runs on completion and when the client disconnects (the generator is closed)
+            cancel.set()
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @app.post("/detect_colors")
-def detect_colors_endpoint(req: DetectColorsReq):
-    """POST with json: { images: [url1, url2, ...], top_k_per_image: 3 }"""
+async def detect_colors_endpoint(request: Request, req: DetectColorsReq):
+    return _disabled("colors") or await _admitted("colors", request, _detect_colors_endpoint, req)
+
+def _detect_colors_endpoint(req: DetectColorsReq):
+    """POST with json: { images: [url1, url2, ...], top_k_per_image: 3, method: "histogram" }"""
     imgs = [i for i in (req.images or []) if isinstance(i, str) and i]
     if not imgs:
         return {"colors": []}
+    if req.method and req.method not in COLOR_METHODS:
+        return {"colors": [], "error": f"unknown color method '{req.method}', expected one of {list(COLOR_METHODS)}"}
     # choose device if cuda available
     device = req.device
     try:
@@ -247,7 +779,7 @@ def detect_colors_endpoint(req: DetectColorsReq):
         device = "cpu"
 
     try:
-        colors = detect_colors_aggregate(imgs, top_k_per_image=int(req.top_k_per_image or 3), device=device)
+        colors = detect_colors_aggregate(imgs, top_k_per_image=int(req.top_k_per_image or 3), device=device, method=req.method)
         # return top 6 overall
         return {"colors": colors[:6]}
     except Exception as e:
@@ -255,10 +787,15 @@ def detect_colors_endpoint(req: DetectColorsReq):
         return {"colors": [], "error": str(e)}
 
 @app.post("/zero_shot_tags")
-def zero_shot_tags(req: ZeroShotTagReq):
+async def zero_shot_tags(request: Request, req: ZeroShotTagReq):
+    return _disabled("clip") or await _admitted("tagging", request, _zero_shot_tags, req)
+
+def _zero_shot_tags(req: ZeroShotTagReq):
     """
     POST JSON:
-      { "images": ["url1","url2"], "top_k_per_attr": 3, "device": "cuda", "model_name": "ViT-H-14" }
+      { "images": ["url1","url2"], "top_k_per_attr": 3, "device": "cuda", "model_name": "ViT-H-14", "crop_policy": "center_full", "escalate": null }
+    model_name pins one loaded CLIP model; otherwise the fast model runs and escalates to the
+    large one when unsure (escalate=true forces the large model, false disables escalation).
     Workflow:
       1) Use detect_colors_aggregate for exact colors
       2) Use CLIP zero-shot tagging (multi-crop) for materials/styles/colors/occasions
@@ -267,19 +804,29 @@ def zero_shot_tags(req: ZeroShotTagReq):
     imgs = [i for i in (req.images or []) if isinstance(i, str) and i]
     if not imgs:
         return {"tags": []}
+    if clip_tagger is None:
+        return {"tags": [], "error": "clip_not_loaded"}
+    from clip_tagging import ClipTagger, CROP_POLICIES
+    if req.crop_policy and req.crop_policy not in CROP_POLICIES:
+        return {"tags": [], "error": "unknown_crop_policy", "detail": f"expected one of {list(CROP_POLICIES)}"}
+    if req.model_name and req.model_name not in clip_tagger.model_names:
+        return {"tags": [], "error": "unknown_model", "detail": f"loaded models: {clip_tagger.model_names}"}
     device = req.device
 
-    # 1) exact colors from your existing color detector
-    try:
-        exact_colors_resp = detect_colors_aggregate(imgs, top_k_per_image=3, device=device)
-        # detect_colors_aggregate returns list-structured results per image; normalize to list of color names
-    except Exception as e:
-        LOG.exception("detect_colors_aggregate failed: %s", e)
-        exact_colors_resp = [ [] for _ in imgs ]
+    # 1) exact colors from your existing color detector (skipped when ML_SUBSYSTEMS turns colors
+    #    off; merged_colors then come from CLIP alone)
+    exact_colors_resp = [ [] for _ in imgs ]
+    if "colors" in ML_SUBSYSTEMS:
+        try:
+            exact_colors_resp = detect_colors_aggregate(imgs, top_k_per_image=3, device=device)
+            # detect_colors_aggregate returns list-structured results per image; normalize to list of color names
+        except Exception as e:
+            LOG.exception("detect_colors_aggregate failed: %s", e)
 
     # 2) CLIP zero-shot tagging (multi-crop)
     try:
-        clip_results = clip_tagger.zero_shot_batch(imgs, top_k_per_attr=int(req.top_k_per_attr or 3), multi_crop=True)
+        clip_results = clip_tagger.zero_shot_batch(imgs, top_k_per_attr=int(req.top_k_per_attr or 3), multi_crop=True, crop_policy=req.crop_policy,
+                                                   model_name=req.model_name, escalate=req.escalate)
     except Exception as e:
         LOG.exception("CLIP tagging failed: %s", e)
         return {"tags": [], "error": "clip_tagging_failed", "detail": str(e)}
@@ -316,7 +863,9 @@ def zero_shot_tags(req: ZeroShotTagReq):
             # expose both raw clip color preds and merged canonical colors
             "clip_colors": clip_color_preds,
             "merged_colors": merged_colors,
-            "occasions": clip_r.get("occasions", [])
+            "occasions": clip_r.get("occasions", []),
+            "model": clip_r.get("model"),
+            "escalated": clip_r.get("escalated", False)
         }
         out.append(final)
 
@@ -328,6 +877,7 @@ def suggest_labels(req: SuggestLabelsReq):
     if not texts:
         return {"suggestions": []}
     try:
+        from clip_tagging import ClipTagger
         pairs = ClipTagger.suggest_labels_from_texts(texts, top_k=int(req.top_k), ngram_range=(int(req.ngram_min), int(req.ngram_max)))
         # return as list of objects
         out = [{"phrase": p[0], "count": int(p[1])} for p in pairs]
@@ -336,25 +886,160 @@ def suggest_labels(req: SuggestLabelsReq):
         LOG.exception("Label suggestion failed: %s", e)
         return {"suggestions": [], "error": str(e)}
 
+# ---------------------------
+# Background jobs
+# ---------------------------
+# Maintenance work that takes minutes runs on a daemon thread; the endpoint returns right
+# away and GET /jobs/{name} reports progress. The state lives in <ML_DATA_DIR>/jobs/<name>.json,
+# so any serve.py worker can answer, and a job runs at most once at a time.
+JOBS_DIR = os.path.join(DATA_DIR or ".", "jobs")
+
+def _job_path(name: str) -> str:
+    return os.path.join(JOBS_DIR, f"{name}.json")
+
+def _read_job(name: str) -> Optional[dict]:
+    try:
+        with open(_job_path(name), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _write_job(name: str, state: dict) -> None:
+    os.makedirs(JOBS_DIR, exist_ok=True)
+    tmp = f"{_job_path(name)}.tmp{os.getpid()}"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, default=str)
+    os.replace(tmp, _job_path(name))
+
+def _job_running(state: Optional[dict]) -> bool:
+    if not state or state.get("status") != "running":
+        return False
+    try:
+        os.kill(int(state["pid"]), 0)
+    except ProcessLookupError:
+        return False    # the worker running it died
+    except OSError:
+        pass
+    return True
+
+def _start_job(name: str, fn, *args, **kwargs):
+    if _job_running(_read_job(name)):
+        return JSONResponse({"error": "job_running", "job": name}, status_code=409)
+    state = {"job": name, "status": "running", "pid": os.getpid(), "started": time.time()}
+    _write_job(name, state)
+
+    def run():
+        try:
+            state.update(status="done", result=fn(*args, **kwargs))
+        except Exception as e:
+            LOG.exception("Job %s failed: %s", name, e)
+            state.update(status="failed", error=str(e))
+        state["finished"] = time.time()
+        _write_job(name, state)
+
+    threading.Thread(target=run, name=f"job-{name}", daemon=True).start()
+    return {"status": "started", "job": name}
+
+@app.get("/jobs/{name}")
+def job_status(name: str):
+    state = _read_job(name)
+    if state is None:
+        return JSONResponse({"error": "unknown_job", "job": name}, status_code=404)
+    if state.get("status") == "running" and not _job_running(state):
+        state["status"] = "interrupted"
+    return state
+
+def _backfill_job(req: BackfillReq):
+    from pymongo import MongoClient
+    from generate_description import BACKFILL_CHECKPOINT, MIN_CHARS, backfill_descriptions
+    if req.reset and os.path.exists(BACKFILL_CHECKPOINT):
+        os.remove(BACKFILL_CHECKPOINT)
+    collection = MongoClient(MONGO_URI)[ML_DB][ML_COLLECTION]
+    # batch priority: every generate batch queues behind interactive requests and is shed first
+    submit = partial(get_executor("generation").submit, priority="batch")
+    return backfill_descriptions(collection, min_chars=req.min_chars or MIN_CHARS, limit=req.limit,
+                                 dry_run=bool(req.dry_run), submit=submit)
+
+@app.post("/backfill_descriptions")
+def backfill_descriptions_endpoint(req: BackfillReq):
+    """Start the description backfill (see generate_description.backfill_descriptions) in the background."""
+    disabled = _disabled("generation")
+    if disabled is not None:
+        return disabled
+    if not MONGO_URI:
+        return {"error": "mongo_not_configured"}
+    return _start_job("backfill_descriptions", _backfill_job, req)
+
+def _rebuild_index_job():
+    global index_ntotal
+    LOG.info("Starting FAISS rebuild...")
+    indexer.rebuild_index(batch_size=64)
+    index_ntotal = int(getattr(indexer.index, "ntotal", 0) or 0)
+    LOG.info("Rebuild finished. ntotal=%s version=%s", index_ntotal, indexer.version)
+    return {"ntotal": index_ntotal, "index_version": indexer.version}
+
 @app.post("/rebuild_index")
 def rebuild_index():
+    """
+    Start a full rebuild in the background (downloading and CLIP-encoding every listing image
+    takes minutes on a real catalog). Poll GET /jobs/rebuild_index; other workers pick up the
+    new snapshot through the index watcher.
+    """
     if indexer is None:
         return {"error": "index_not_initialized"}
-    try:
-        if hasattr(indexer, "rebuild_index"):
-            LOG.info("Starting FAISS rebuild...")
-            indexer.rebuild_index(batch_size=64)
-            try:
-                global index_ntotal
-                index_ntotal = int(getattr(indexer.index, "ntotal", 0))
-            except Exception:
-                index_ntotal = 0
-            LOG.info("Rebuild finished. ntotal=%s", index_ntotal)
-            return {"status": "ok", "ntotal": index_ntotal}
+    if not hasattr(indexer, "rebuild_index"):
         return {"error": "rebuild_not_supported"}
-    except Exception as e:
-        LOG.exception("Rebuild failed: %s", e)
-        return {"error": "rebuild_failed", "detail": str(e)}
+    return _start_job("rebuild_index", _rebuild_index_job)
+
+# ---------------------------
+# Catalog label mining (background job, result persisted on disk)
+# ---------------------------
+LABELS_CACHE_PATH = os.path.join(DATA_DIR or ".", "label_suggestions.json")
+
+def _load_cached_labels() -> Optional[dict]:
+    try:
+        with open(LABELS_CACHE_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return None
+
+def _catalog_labels_job(req: CatalogLabelsReq):
+    t0 = time.time()
+    from clip_tagging import ClipTagger
+    chunks = indexer.iter_texts(fields=tuple(req.fields), chunk_size=max(1, int(req.chunk_size)))
+    pairs = ClipTagger.suggest_labels_from_stream(chunks, top_k=int(req.top_k), ngram_range=(int(req.ngram_min), int(req.ngram_max)))
+    result = {
+        "suggestions": [{"phrase": p[0], "count": int(p[1])} for p in pairs],
+        "params": req.dict(),
+        "computed_at": time.time(),
+        "duration_s": round(time.time() - t0, 2),
+    }
+    # the job file only keeps a summary; the suggestions outlive the next run's start
+    tmp = f"{LABELS_CACHE_PATH}.tmp{os.getpid()}"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False)
+    os.replace(tmp, LABELS_CACHE_PATH)
+    LOG.info("Catalog label mining finished in %.1fs (%d suggestions)", result["duration_s"], len(pairs))
+    return {"suggestions": len(pairs), "duration_s": result["duration_s"]}
+
+@app.post("/suggest_labels/catalog")
+def start_catalog_labels(req: CatalogLabelsReq):
+    """Start mining label candidates from every listing in Mongo. Poll GET /suggest_labels/catalog for the result."""
+    if indexer is None:
+        return {"error": "index_not_initialized"}
+    return _start_job("catalog_labels", _catalog_labels_job, req)
+
+@app.get("/suggest_labels/catalog")
+def get_catalog_labels():
+    """Last persisted catalog suggestions plus the job status (same as GET /jobs/catalog_labels)."""
+    job = _read_job("catalog_labels")
+    if job is not None and job.get("status") == "running" and not _job_running(job):
+        job["status"] = "interrupted"
+    out = {"job": job or {"status": "idle"}, "suggestions": []}
+    result = _load_cached_labels()
+    if result:
+        out.update(result)
+    return out
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,164 @@
+# ml/clip_onnx.py
+"""
+ONNX export and onnxruntime inference for the CLIP image and text towers.
+
+The towers of an open_clip model are exported once and cached under
+  HF_HOME/onnx/clip/<model>-<pretrained>[-int8]/{image,text}.onnx
+optionally with dynamic int8 weight quantization. ClipTagger uses them when
+CLIP_BACKEND=onnx and falls back to the torch model if anything fails.
+
+Environment variables (optional):
+- CLIP_BACKEND (default: "torch"; "onnx" to run the towers through onnxruntime)
+- CLIP_ONNX_QUANTIZE (default: 0; 1 for dynamic int8 weights)
+- CLIP_ORT_THREADS (default: 0 = onnxruntime default) intra-op threads per session
+"""
+import os
+import logging
+import shutil
+import tempfile
+from typing import Callable, Dict
+
+import numpy as np
+
+try:
+    import onnxruntime as ort
+    ORT_AVAILABLE = True
+except Exception:
+    ort = None
+    ORT_AVAILABLE = False
+
+LOG = logging.getLogger("clip_onnx")
+
+CLIP_BACKEND = os.environ.get("CLIP_BACKEND", "torch").lower()
+ONNX_QUANTIZE = os.environ.get("CLIP_ONNX_QUANTIZE", "0") == "1"
+ORT_THREADS = int(os.environ.get("CLIP_ORT_THREADS", "0"))
+ONNX_OPSET = 17
+
+
+def export_dir(cache_dir: str, model_name: str, pretrained: str, quantize: bool = False) -> str:
+    name = f"{model_name}-{pretrained}" + ("-int8" if quantize else "")
+    return os.path.join(cache_dir, "onnx", "clip", name)
+
+
+def _image_size(model) -> int:
+    size = getattr(getattr(model, "visual", None), "image_size", 224)
+    if isinstance(size, (tuple, list)):
+        return int(size[0])
+    return int(size)
+
+
+def _write_once(path: str, write: Callable[[str], None]) -> None:
+    """
+    write(tmp_path) into a private temp dir next to path, then move the file into place.
+    Forked workers may export at the same time on a cold cache; if another one published
+    the file first, that copy is kept.
+    """
+    tmp_dir = tempfile.mkdtemp(prefix=".tmp", dir=os.path.dirname(path))
+    try:
+        tmp = os.path.join(tmp_dir, os.path.basename(path))
+        write(tmp)
+        if os.path.exists(path):
+            LOG.info("%s already exported by another process; keeping it", path)
+        else:
+            os.replace(tmp, path)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def export_clip_onnx(model, model_name: str, pretrained: str, cache_dir: str, quantize: bool = False) -> Dict[str, str]:
+    """
+    Export the image and text towers of a loaded open_clip model. Returns {"image": path, "text": path}.
+    Files are written to a private temp dir and renamed, so a crashed or concurrent export never
+    leaves a half file behind.
+    """
+    import torch
+
+    out_dir = export_dir(cache_dir, model_name, pretrained, quantize)
+    paths = {"image": os.path.join(out_dir, "image.onnx"), "text": os.path.join(out_dir, "text.onnx")}
+    if all(os.path.exists(p) for p in paths.values()):
+        return paths
+
+    if quantize:
+        # quantize from the fp32 export (exported on demand) rather than from torch directly
+        fp32 = export_clip_onnx(model, model_name, pretrained, cache_dir, quantize=False)
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        os.makedirs(out_dir, exist_ok=True)
+        for tower, path in paths.items():
+            if os.path.exists(path):
+                continue
+            LOG.info("Quantizing CLIP %s tower to int8: %s", tower, path)
+            _write_once(path, lambda tmp, src=fp32[tower]: quantize_dynamic(src, tmp, weight_type=QuantType.QInt8))
+        return paths
+
+    class _ImageTower(torch.nn.Module):
+        def __init__(self, m):
+            super().__init__()
+            self.m = m
+
+        def forward(self, pixel_values):
+            return self.m.encode_image(pixel_values)
+
+    class _TextTower(torch.nn.Module):
+        def __init__(self, m):
+            super().__init__()
+            self.m = m
+
+        def forward(self, input_ids):
+            return self.m.encode_text(input_ids)
+
+    os.makedirs(out_dir, exist_ok=True)
+    model = model.to("cpu").eval()
+    size = _image_size(model)
+    context_length = int(getattr(model, "context_length", 77))
+    exports = [
+        ("image", _ImageTower(model), torch.randn(1, 3, size, size), "pixel_values", "image_embeds"),
+        ("text", _TextTower(model), torch.zeros((1, context_length), dtype=torch.long), "input_ids", "text_embeds"),
+    ]
+    for tower, module, dummy, in_name, out_name in exports:
+        if os.path.exists(paths[tower]):
+            continue
+        LOG.info("Exporting CLIP %s tower of %s to ONNX: %s", tower, model_name, paths[tower])
+
+        def _export(tmp, module=module, dummy=dummy, in_name=in_name, out_name=out_name):
+            with torch.no_grad():
+                torch.onnx.export(
+                    module, (dummy,), tmp,
+                    input_names=[in_name], output_names=[out_name],
+                    dynamic_axes={in_name: {0: "batch"}, out_name: {0: "batch"}},
+                    opset_version=ONNX_OPSET,
+                )
+
+        _write_once(paths[tower], _export)
+    return paths
+
+
+class OnnxClipEncoder:
+    """onnxruntime sessions for the exported towers; inputs/outputs are numpy arrays."""
+
+    def __init__(self, paths: Dict[str, str], threads: int = ORT_THREADS):
+        if not ORT_AVAILABLE:
+            raise RuntimeError("onnxruntime is not installed")
+        opts = ort.SessionOptions()
+        if threads > 0:
+            opts.intra_op_num_threads = threads
+        opts.inter_op_num_threads = 1
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        providers = ["CPUExecutionProvider"]
+        self.image_session = ort.InferenceSession(paths["image"], sess_options=opts, providers=providers)
+        self.text_session = ort.InferenceSession(paths["text"], sess_options=opts, providers=providers)
+        self._image_input = self.image_session.get_inputs()[0].name
+        self._text_input = self.text_session.get_inputs()[0].name
+
+    def encode_image(self, pixel_values: np.ndarray) -> np.ndarray:
+        return self.image_session.run(None, {self._image_input: pixel_values.astype(np.float32)})[0]
+
+    def encode_text(self, input_ids: np.ndarray) -> np.ndarray:
+        return self.text_session.run(None, {self._text_input: input_ids.astype(np.int64)})[0]
+
+
+def load_or_export(model, model_name: str, pretrained: str, cache_dir: str,
+                   quantize: bool = ONNX_QUANTIZE, threads: int = ORT_THREADS) -> OnnxClipEncoder:
+    if not ORT_AVAILABLE:
+        raise RuntimeError("onnxruntime is not installed")
+    paths = export_clip_onnx(model, model_name, pretrained, cache_dir, quantize=quantize)
+    return OnnxClipEncoder(paths, threads=threads)
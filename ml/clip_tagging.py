@@ -1,22 +1,34 @@
 # ml/clip_tagging.py
 """
 CLIP zero-shot tagger with:
- - robust model loading (ViT-H-14 preferred, fallback to ViT-B-32)
+ - tiered model loading: fast ViT-B-32 by default, escalating to a large model (e.g. ViT-H-14)
+   when the fast model's top-1 vs top-2 label margin is low
  - image fetching (http(s), data: URIs, local files) with browser-like headers
- - multi-crop support to handle multi-object images
- - text-label suggestion utility (domain tuning) using CountVectorizer
+ - optional onnxruntime backend for the image/text towers (see clip_onnx.py)
+ - multi-crop support to handle multi-object images (none / center_full / five_crop / saliency policies)
+ - text-label suggestion utility (domain tuning) using CountVectorizer, with a streaming
+   variant for mining the whole catalog
  - merging helpers for color signals (to be combined with your detect_colors_aggregate)
 """
 
-from typing import List, Dict, Optional, Tuple
+from typing import List, Dict, Iterable, Optional, Tuple
 from PIL import Image
 import io, base64, re, time, math
 import os
+import logging
+import threading
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import requests
 import numpy as np
 import torch
 import open_clip
-from sklearn.feature_extraction.text import CountVectorizer
+
+from color_detector import mask_with_rembg, naive_mask
+from metrics import REGISTRY, SIZE_BUCKETS
+from clip_onnx import CLIP_BACKEND, load_or_export
+
+LOG = logging.getLogger("clip_tagging")
 
 # Default candidate label lists (you will extend these via the suggest_labels endpoint)
 DEFAULT_MATERIALS = [
@@ -36,55 +48,211 @@ DEFAULT_COLORS = [
     "beige", "maroon", "gold", "silver", "purple", "pastel", "muted", "vibrant"
 ]
 
+# Crop policies for multi-crop tagging. Each crop is one extra encoder pass.
+CROP_POLICIES = ("none", "center_full", "five_crop", "saliency")
+DEFAULT_CROP_POLICY = os.environ.get("CLIP_CROP_POLICY", "center_full")
+CROP_FRACTION = 0.7
+# saliency crops: padding around the foreground box, and the coverage above which the box adds nothing
+SALIENCY_PAD = 0.08
+SALIENCY_MAX_COVERAGE = 0.85
+
 def _is_url(uri: str) -> bool:
     return uri.startswith("http://") or uri.startswith("https://")
 
+def _foreground_box(img: Image.Image) -> Optional[Tuple[int, int, int, int]]:
+    """
+    Bounding box (left, upper, right, lower) of the foreground, using the same rembg / naive
+    mask as color_detector. Returns None when there is no usable foreground or it already
+    covers most of the image (the crop would duplicate the full view).
+    """
+    rgba = img.convert("RGBA")
+    mask = mask_with_rembg(rgba)
+    if mask is None:
+        mask = naive_mask(rgba)
+    ys, xs = np.nonzero(mask)
+    if len(xs) == 0:
+        return None
+    w, h = img.size
+    left, right = int(xs.min()), int(xs.max()) + 1
+    upper, lower = int(ys.min()), int(ys.max()) + 1
+    if (right - left) * (lower - upper) > SALIENCY_MAX_COVERAGE * w * h:
+        return None
+    pad_x = int((right - left) * SALIENCY_PAD)
+    pad_y = int((lower - upper) * SALIENCY_PAD)
+    return (max(0, left - pad_x), max(0, upper - pad_y), min(w, right + pad_x), min(h, lower + pad_y))
+
 CACHE_DIR = os.environ.get("HF_HOME", "./model_cache")
 os.makedirs(CACHE_DIR, exist_ok=True)
 # 2. Tell open_clip where to look
 os.environ["OPEN_CLIP_CACHE"] = CACHE_DIR
 
+# laion checkpoints per architecture (quality); unknown names use the ViT-B-32 tag
+PRETRAINED_TAGS = {
+    "ViT-B-32": "laion2b_s34b_b79k",
+    "ViT-L-14": "laion2b_s32b_b82k",
+    "ViT-H-14": "laion2b_s32b_b79k",
+}
+
+# Tiered tagging: run the fast model and re-run on the large one when the top-1 vs top-2
+# probability margin (softmax over labels, CLIP's logit scale) of any of these attributes is low.
+ESCALATION_MARGIN = float(os.environ.get("CLIP_ESCALATION_MARGIN", "0.1"))
+ESCALATION_ATTRS = tuple(a.strip() for a in os.environ.get("CLIP_ESCALATION_ATTRS", "materials,styles").split(",") if a.strip())
+_LOGIT_SCALE = 100.0
+
+REGISTRY.set_buckets("clip_encode_batch_size", SIZE_BUCKETS)
+
+# image embeddings kept after tagging so the image index can reuse them
+EMBED_CACHE_SIZE = int(os.environ.get("CLIP_EMBED_CACHE_SIZE", "4096"))
+# image embedding for the index: concurrent downloads, crops encoded this many at a time
+CLIP_FETCH_WORKERS = int(os.environ.get("CLIP_FETCH_WORKERS", "8"))
+CLIP_EMBED_BATCH_SIZE = int(os.environ.get("CLIP_EMBED_BATCH_SIZE", "32"))
+# catalog label mining keeps the top LABEL_STREAM_KEEP * top_k n-grams between chunks
+LABEL_STREAM_KEEP = int(os.environ.get("LABEL_STREAM_KEEP", "20"))
+
+
+def _pretrained_tag(model_name: str) -> str:
+    return PRETRAINED_TAGS.get(model_name, "laion2b_s32b_b79k" if "H-14" in model_name else "laion2b_s34b_b79k")
+
+
+class _ClipTier:
+    """One loaded open_clip model with its preprocess, tokenizer and label-embedding cache."""
+
+    def __init__(self, model_name: str, device, backend: str = CLIP_BACKEND):
+        self.name = model_name
+        self.device = device
+        pretrained = _pretrained_tag(model_name)
+        # open_clip will now automatically use CACHE_DIR
+        self.model, _, self.preprocess = open_clip.create_model_and_transforms(
+            model_name,
+            pretrained=pretrained,
+            cache_dir=CACHE_DIR  # Explicitly passing it here as well
+        )
+        # tokenizer helper
+        self.tokenizer = open_clip.get_tokenizer(model_name)
+        self.model.to(device)
+        self.model.eval()
+        # label lists are constant between requests, so their text embeddings are cached per tier
+        self._label_cache: Dict[Tuple[str, ...], torch.Tensor] = {}
+        self._label_lock = threading.Lock()
+
+        # onnxruntime towers; the torch model above stays loaded as the fallback
+        self.onnx = None
+        self.backend = "torch"
+        if backend == "onnx":
+            if str(device) != "cpu":
+                LOG.warning("CLIP_BACKEND=onnx is CPU-only; %s stays on torch (%s)", model_name, device)
+            else:
+                try:
+                    self.onnx = load_or_export(self.model, model_name, pretrained, CACHE_DIR)
+                    self.backend = "onnx"
+                except Exception as e:
+                    LOG.warning("ONNX backend unavailable for %s, using torch: %s", model_name, e)
+
+    def _onnx_failed(self, e: Exception) -> None:
+        LOG.warning("onnxruntime inference failed for %s, falling back to torch: %s", self.name, e)
+        REGISTRY.incr("clip_onnx_fallbacks_total", model=self.name)
+
+    def encode_images(self, images: List[Image.Image]) -> torch.Tensor:
+        with REGISTRY.timer("stage_seconds", stage="clip_preprocess"):
+            inp = torch.stack([self.preprocess(img) for img in images])
+        if self.onnx is not None:
+            try:
+                return torch.from_numpy(self.onnx.encode_image(inp.numpy()))
+            except Exception as e:
+                self._onnx_failed(e)
+        with torch.no_grad():
+            return self.model.encode_image(inp.to(self.device)).detach().cpu()  # (C, D)
+
+    def encode_texts(self, texts: List[str]) -> torch.Tensor:
+        tokens = self.tokenizer(texts)
+        txt_emb = None
+        if self.onnx is not None:
+            try:
+                txt_emb = torch.from_numpy(self.onnx.encode_text(tokens.numpy()))
+            except Exception as e:
+                self._onnx_failed(e)
+        if txt_emb is None:
+            with torch.no_grad():
+                txt_emb = self.model.encode_text(tokens.to(self.device))
+            txt_emb = txt_emb.detach().cpu()
+        txt_emb = txt_emb / txt_emb.norm(dim=-1, keepdim=True)
+        return txt_emb  # (N, D) on CPU
+
+    def label_embeddings(self, labels: List[str]) -> torch.Tensor:
+        key = tuple(labels)
+        emb = self._label_cache.get(key)
+        REGISTRY.incr("clip_label_cache_total", result="miss" if emb is None else "hit")
+        if emb is None:
+            emb = self.encode_texts(list(labels))
+            with self._label_lock:
+                self._label_cache[key] = emb
+        return emb
+
+
 class ClipTagger:
-    def __init__(self, model_preference: Optional[str] = None, device: Optional[str] = None):
+    def __init__(
+        self,
+        model_preference: Optional[str] = None,
+        device: Optional[str] = None,
+        crop_policy: Optional[str] = None,
+        escalation_model: Optional[str] = None,
+        escalation_margin: Optional[float] = None,
+        backend: Optional[str] = None,
+    ):
         """
-        model_preference: "ViT-H-14" or "ViT-B-32" or None
+        model_preference: fast/default model, e.g. "ViT-B-32" (None -> ViT-B-32)
         device: "cuda" or "cpu" or None (auto)
+        crop_policy: default multi-crop policy (one of CROP_POLICIES); None uses CLIP_CROP_POLICY
+        escalation_model: optional large model (e.g. "ViT-H-14") used when the fast model is unsure
+        escalation_margin: top-1 vs top-2 probability margin below which to escalate (None -> CLIP_ESCALATION_MARGIN)
+        backend: "torch" or "onnx" (None -> CLIP_BACKEND); onnx falls back to torch per model on failure
         """
+        self.crop_policy = crop_policy or DEFAULT_CROP_POLICY
+        if self.crop_policy not in CROP_POLICIES:
+            raise ValueError(f"Unknown crop policy '{self.crop_policy}'. Expected one of {CROP_POLICIES}")
         if device:
             self.device = torch.device(device)
         else:
             self.device = "cpu"
+        self.escalation_margin = ESCALATION_MARGIN if escalation_margin is None else float(escalation_margin)
+        backend = (backend or CLIP_BACKEND).lower()
 
-        # Try to load requested high-quality model, fallback to ViT-L-14 if necessary.
-        # Use laion checkpoints for quality.
-        candidates = []
-        if model_preference:
-            candidates.append((model_preference, "laion2b_s32b_b79k" if "H-14" in model_preference else "laion2b_s34b_b79k"))
+        # loaded models by name; the first one is the fast tier every request starts on
+        self.tiers: Dict[str, _ClipTier] = {}
+        primary = model_preference or "ViT-B-32"
+        try:
+            self.tiers[primary] = _ClipTier(primary, self.device, backend=backend)
+        except Exception as e:
+            raise RuntimeError(f"Failed to load any CLIP model. Attempts: {[(primary, str(e))]}")
 
-        last_errs = []
-        for candidate_name, pretrained_tag in candidates:
+        self.escalation_model = None
+        if escalation_model and escalation_model != primary:
             try:
-                # open_clip will now automatically use CACHE_DIR
-                self.model, _, self.preprocess = open_clip.create_model_and_transforms(
-                    candidate_name, 
-                    pretrained=pretrained_tag,
-                    cache_dir=CACHE_DIR  # Explicitly passing it here as well
-                )
-                # tokenizer helper
-                self.tokenizer = open_clip.get_tokenizer(candidate_name)
-                self.model.to(self.device)
-                self.model.eval()
-                self.model_name = candidate_name
-                break
+                self.tiers[escalation_model] = _ClipTier(escalation_model, self.device, backend=backend)
+                self.escalation_model = escalation_model
             except Exception as e:
-                last_errs.append((candidate_name, str(e)))
-                continue
-        if not hasattr(self, "model"):
-            raise RuntimeError(f"Failed to load any CLIP model. Attempts: {last_errs}")
+                # the fast tier alone is still a working tagger
+                LOG.warning("Escalation model %s failed to load, tagging with %s only: %s", escalation_model, primary, e)
+
+        # uri -> fast-tier image embedding, filled by tagging and reused by the image index
+        self._embed_cache: "OrderedDict[Tuple[str, str], np.ndarray]" = OrderedDict()
+        self._embed_lock = threading.Lock()
+
+        # primary tier attributes (kept for callers that use the single-model interface)
+        fast = self.tiers[primary]
+        self.model_name = fast.name
+        self.model = fast.model
+        self.preprocess = fast.preprocess
+        self.tokenizer = fast.tokenizer
+
+    @property
+    def model_names(self) -> List[str]:
+        return list(self.tiers)
 
     # -------------------------
     # Image loading utilities
     # -------------------------
+    @REGISTRY.timed("stage_seconds", stage="_fetch_image")
     def _fetch_image(self, uri: str) -> Image.Image:
         """
         Robust loader: supports http[s], data: URI, local file path.
@@ -131,16 +299,32 @@ class ClipTagger:
     # -------------------------
     # Multi-crop utilities
     # -------------------------
-    def _generate_crops(self, img: Image.Image, crop_size: Optional[int] = None) -> List[Image.Image]:
+    def _generate_crops(self, img: Image.Image, crop_size: Optional[int] = None, policy: Optional[str] = None) -> List[Image.Image]:
         """
-        Returns a list of crops: full image, center crop, 4 corner crops.
-        crop_size: if None, use min(width,height) * 0.7 then resize to model input via preprocess.
+        Returns the crops for the given policy (see CROP_POLICIES):
+          none        -> [full]
+          center_full -> [full, center]
+          five_crop   -> [full, center, 4 corners]
+          saliency    -> [full, foreground bounding box]
+        crop_size: side of the center/corner crops; if None, use min(width,height) * 0.7.
+        Every crop is resized to the model input by preprocess, so each one costs a full encoder pass.
         """
-        w, h = img.size
-        crops = [img.copy()]  # full image
+        policy = policy or self.crop_policy
+        if policy not in CROP_POLICIES:
+            raise ValueError(f"Unknown crop policy '{policy}'. Expected one of {CROP_POLICIES}")
+
+        crops = [img]  # full image
+        if policy == "none":
+            return crops
+        if policy == "saliency":
+            box = _foreground_box(img)
+            if box is not None:
+                crops.append(img.crop(box))
+            return crops
 
+        w, h = img.size
         # define base crop size
-        base = int(min(w, h) * 0.7)
+        base = int(min(w, h) * CROP_FRACTION)
         if crop_size:
             base = crop_size
         # helper to crop center and corners
@@ -153,51 +337,56 @@ class ClipTagger:
 
         # center
         crops.append(crop_at(w//2, h//2, base))
+        if policy == "center_full":
+            return crops
         # corners: top-left, top-right, bottom-left, bottom-right (use quarter offsets)
         offsets = [(base//2, base//2), (w - base//2, base//2), (base//2, h - base//2), (w - base//2, h - base//2)]
         for ox, oy in offsets:
             crops.append(crop_at(ox, oy, base))
-        # optionally add a few scaled down versions
-        # return unique crops (dedupe by size)
-        uniq = []
-        seen_sizes = set()
-        for c in crops:
-            s = c.size
-            if s not in seen_sizes:
-                uniq.append(c)
-                seen_sizes.add(s)
-        return uniq
+        return crops
 
     # -------------------------
     # Encoding helpers
     # -------------------------
-    def _encode_image_batch(self, images: List[Image.Image]) -> torch.Tensor:
+    @REGISTRY.timed("stage_seconds", stage="_encode_image_batch")
+    def _encode_image_batch(self, images: List[Image.Image], tier: Optional[_ClipTier] = None) -> torch.Tensor:
         """
         Accepts list of PIL images, returns l2-normalized embedding (cpu tensor) aggregated across crops.
-        Strategy: compute embedding for each crop on device, gather to CPU, l2-normalize mean embedding.
+        Strategy: preprocess all crops, run them through the encoder as one batch, l2-normalize mean embedding.
         """
-        embs = []
-        for img in images:
-            inp = self.preprocess(img).unsqueeze(0).to(self.device)
-            with torch.no_grad():
-                e = self.model.encode_image(inp)  # (1, D) on device
-                e = e.detach().cpu()
-                embs.append(e)
-        if not embs:
+        if not images:
             raise RuntimeError("No embeddings computed.")
-        embs = torch.cat(embs, dim=0)  # (C, D)
+        tier = tier or self.tiers[self.model_name]
+        REGISTRY.observe("clip_encode_batch_size", len(images), model=tier.name)
+        embs = tier.encode_images(images)  # (C, D)
         # aggregate — mean then normalize
         agg = embs.mean(dim=0, keepdim=True)
         agg = agg / agg.norm(dim=-1, keepdim=True)
         return agg  # CPU tensor shape (1, D)
 
-    def _encode_texts(self, texts: List[str]) -> torch.Tensor:
-        tokens = self.tokenizer(texts).to(self.device)
-        with torch.no_grad():
-            txt_emb = self.model.encode_text(tokens)
-        txt_emb = txt_emb.detach().cpu()
-        txt_emb = txt_emb / txt_emb.norm(dim=-1, keepdim=True)
-        return txt_emb  # (N, D) on CPU
+    def _encode_texts(self, texts: List[str], tier: Optional[_ClipTier] = None) -> torch.Tensor:
+        tier = tier or self.tiers[self.model_name]
+        return tier.encode_texts(texts)
+
+    def _tag_with_tier(self, tier: _ClipTier, crops: List[Image.Image], label_sets: Dict[str, List[str]], top_k_per_attr: int):
+        """
+        Score every attribute with one model. Returns (tags, margins) where margins[attr] is the
+        top-1 minus top-2 softmax probability, used to decide on escalation.
+        """
+        t0 = time.perf_counter()
+        img_emb = self._encode_image_batch(crops, tier=tier)  # (1, D) CPU tensor
+        tags, margins = {}, {}
+        for attr, labels in label_sets.items():
+            txt_emb = tier.label_embeddings(labels)  # (N, D)
+            sims = (img_emb @ txt_emb.T).squeeze(0)
+            probs = torch.softmax(_LOGIT_SCALE * sims, dim=-1)
+            top = torch.topk(probs, k=min(2, len(labels))).values.tolist()
+            margins[attr] = top[0] - top[1] if len(top) > 1 else 1.0
+            sims = sims.numpy().tolist()
+            pairs_sorted = sorted(zip(labels, sims), key=lambda x: x[1], reverse=True)[:top_k_per_attr]
+            tags[attr] = [{"label": p[0], "score": float(p[1])} for p in pairs_sorted]
+        REGISTRY.observe("clip_tag_seconds", time.perf_counter() - t0, model=tier.name)
+        return tags, margins, img_emb
 
     # -------------------------
     # Main zero-shot tagging method
@@ -211,36 +400,191 @@ class ClipTagger:
         color_labels: Optional[List[str]] = None,
         occasion_labels: Optional[List[str]] = None,
         multi_crop: bool = True,
+        crop_policy: Optional[str] = None,
+        image: Optional[Image.Image] = None,
+        model_name: Optional[str] = None,
+        escalate: Optional[bool] = None,
     ) -> Dict:
-        material_labels = material_labels or DEFAULT_MATERIALS
-        style_labels = style_labels or DEFAULT_STYLES
-        color_labels = color_labels or DEFAULT_COLORS
-        occasion_labels = occasion_labels or DEFAULT_OCCASIONS
-
-        image = self._fetch_image(uri)
-        crops = self._generate_crops(image) if multi_crop else [image]
-        img_emb = self._encode_image_batch(crops)  # (1, D) CPU tensor
-
-        def score_and_top(labels):
-            txt_emb = self._encode_texts(labels)  # (N, D)
-            sims = (img_emb @ txt_emb.T).squeeze(0).numpy().tolist()
-            pairs = list(zip(labels, sims))
-            pairs_sorted = sorted(pairs, key=lambda x: x[1], reverse=True)[:top_k_per_attr]
-            return [{"label": p[0], "score": float(p[1])} for p in pairs_sorted]
-
-        mats = score_and_top(material_labels)
-        stys = score_and_top(style_labels)
-        cols = score_and_top(color_labels)
-        occs = score_and_top(occasion_labels)
+        """
+        Tag one image. `image` may be passed when the caller already holds the decoded
+        image (benchmarks, batch jobs); otherwise it is fetched from `uri`.
+
+        Model choice:
+          model_name set   -> tag with exactly that loaded model, no escalation
+          escalate=True    -> go straight to the escalation (large) model
+          escalate=None    -> fast model, re-run on the large model when a margin in
+                              ESCALATION_ATTRS is below escalation_margin
+          escalate=False   -> fast model only
+        """
+        if model_name and model_name not in self.tiers:
+            raise ValueError(f"CLIP model '{model_name}' is not loaded. Available: {self.model_names}")
+        label_sets = {
+            "materials": material_labels or DEFAULT_MATERIALS,
+            "styles": style_labels or DEFAULT_STYLES,
+            "colors": color_labels or DEFAULT_COLORS,
+            "occasions": occasion_labels or DEFAULT_OCCASIONS,
+        }
+
+        if image is None:
+            image = self._fetch_image(uri)
+        crops = self._generate_crops(image, policy=crop_policy) if multi_crop else [image]
+        policy = (crop_policy or self.crop_policy) if multi_crop else "none"
+
+        escalated = False
+        if model_name:
+            tier = self.tiers[model_name]
+        elif escalate and self.escalation_model:
+            tier = self.tiers[self.escalation_model]
+            escalated = True
+        else:
+            tier = self.tiers[self.model_name]
+        tags, margins, img_emb = self._tag_with_tier(tier, crops, label_sets, top_k_per_attr)
+        if tier.name == self.model_name:
+            # keep the fast-tier embedding so indexing this image later costs nothing
+            self._cache_embedding((uri, policy), img_emb.squeeze(0).numpy().astype("float32"))
+
+        if not model_name and escalate is None and self.escalation_model:
+            REGISTRY.incr("clip_escalation_checks_total")
+            if any(margins.get(a, 1.0) < self.escalation_margin for a in ESCALATION_ATTRS):
+                REGISTRY.incr("clip_escalations_total")
+                tier = self.tiers[self.escalation_model]
+                tags, margins, _ = self._tag_with_tier(tier, crops, label_sets, top_k_per_attr)
+                escalated = True
 
         return {
             "image": uri,
-            "materials": mats,
-            "styles": stys,
-            "colors": cols,
-            "occasions": occs
+            "materials": tags["materials"],
+            "styles": tags["styles"],
+            "colors": tags["colors"],
+            "occasions": tags["occasions"],
+            "model": tier.name,
+            "escalated": escalated,
+        }
+
+    def warmup(self) -> None:
+        """Run every tier once and precompute the default label embeddings, so the first request is not the slow one."""
+        img = Image.new("RGB", (224, 224), (128, 128, 128))
+        for tier in self.tiers.values():
+            tier.encode_images([img])
+            for labels in (DEFAULT_MATERIALS, DEFAULT_STYLES, DEFAULT_OCCASIONS, DEFAULT_COLORS):
+                tier.label_embeddings(labels)
+
+    def tier_stats(self) -> Dict:
+        """Per-tier tagging latency and the auto-escalation rate."""
+        timers = REGISTRY.snapshot()["timers"]
+        checks = REGISTRY.counter("clip_escalation_checks_total")
+        escalations = REGISTRY.counter("clip_escalations_total")
+        return {
+            "tiers": {
+                name: dict(timers.get(f'clip_tag_seconds{{model="{name}"}}', {"count": 0}), backend=tier.backend)
+                for name, tier in self.tiers.items()
+            },
+            "escalation_model": self.escalation_model,
+            "escalation_margin": self.escalation_margin,
+            "escalation_checks": int(checks),
+            "escalations": int(escalations),
+            "escalation_rate": round(escalations / checks, 4) if checks else 0.0,
         }
 
+    # -------------------------
+    # Image / text embeddings (visual search)
+    # -------------------------
+    def _cache_embedding(self, key: Tuple[str, str], emb: np.ndarray) -> None:
+        if EMBED_CACHE_SIZE <= 0:
+            return
+        with self._embed_lock:
+            self._embed_cache[key] = emb
+            self._embed_cache.move_to_end(key)
+            while len(self._embed_cache) > EMBED_CACHE_SIZE:
+                self._embed_cache.popitem(last=False)
+
+    def embed_image(self, image: Image.Image, crop_policy: Optional[str] = None) -> np.ndarray:
+        """Fast-tier embedding of one image (mean over its crops), l2-normalized, shape (D,)."""
+        crops = self._generate_crops(image, policy=crop_policy)
+        return self._encode_image_batch(crops).squeeze(0).numpy().astype("float32")
+
+    def embed_image_uris(self, uris: List[str], crop_policy: Optional[str] = None) -> Optional[np.ndarray]:
+        """
+        Listing-level embedding: l2-normalized mean of the per-image embeddings.
+        Images already embedded by tagging are served from the cache; unreadable images are skipped.
+        Returns None when no image could be embedded.
+        """
+        return self.embed_image_uri_lists([uris], crop_policy=crop_policy)[0]
+
+    def embed_image_uri_lists(self, uri_lists: List[List[str]], crop_policy: Optional[str] = None) -> List[Optional[np.ndarray]]:
+        """
+        embed_image_uris for many listings at once: uncached images are downloaded on
+        CLIP_FETCH_WORKERS threads and their crops encoded CLIP_EMBED_BATCH_SIZE at a time.
+        """
+        policy = crop_policy or self.crop_policy
+        vectors: Dict[str, np.ndarray] = {}
+        missing = []
+        for uri in dict.fromkeys(u for uris in uri_lists for u in uris):
+            key = (uri, policy)
+            with self._embed_lock:
+                vec = self._embed_cache.get(key)
+                if vec is not None:
+                    self._embed_cache.move_to_end(key)
+            if vec is None:
+                REGISTRY.incr("clip_embed_cache_misses_total")
+                missing.append(uri)
+            else:
+                REGISTRY.incr("clip_embed_cache_hits_total")
+                vectors[uri] = vec
+        if missing:
+            vectors.update(self._embed_uncached(missing, policy))
+        out = []
+        for uris in uri_lists:
+            vecs = [vectors[u] for u in uris if u in vectors]
+            if not vecs:
+                out.append(None)
+                continue
+            mean = np.mean(np.stack(vecs), axis=0)
+            norm = float(np.linalg.norm(mean)) or 1.0
+            out.append((mean / norm).astype("float32"))
+        return out
+
+    def _embed_uncached(self, uris: List[str], policy: str) -> Dict[str, np.ndarray]:
+        def fetch(uri):
+            try:
+                return uri, self._fetch_image(uri)
+            except Exception as e:
+                LOG.warning("Skipping image %s: %s", uri, e)
+                return uri, None
+
+        out, pending = {}, []
+        with ThreadPoolExecutor(max_workers=max(1, min(CLIP_FETCH_WORKERS, len(uris))), thread_name_prefix="clip-fetch") as pool:
+            # results arrive in order; encoding a full batch overlaps with the remaining downloads
+            for uri, image in pool.map(fetch, uris):
+                if image is None:
+                    continue
+                pending.append((uri, self._generate_crops(image, policy=policy)))
+                if sum(len(crops) for _, crops in pending) >= CLIP_EMBED_BATCH_SIZE:
+                    out.update(self._encode_crop_groups(pending, policy))
+                    pending = []
+        if pending:
+            out.update(self._encode_crop_groups(pending, policy))
+        return out
+
+    def _encode_crop_groups(self, groups: List[Tuple[str, List[Image.Image]]], policy: str) -> Dict[str, np.ndarray]:
+        """One encoder call for the crops of several images; per image the same vector as embed_image."""
+        tier = self.tiers[self.model_name]
+        crops = [c for _, image_crops in groups for c in image_crops]
+        REGISTRY.observe("clip_encode_batch_size", len(crops), model=tier.name)
+        embs = tier.encode_images(crops)
+        out, start = {}, 0
+        for uri, image_crops in groups:
+            agg = embs[start:start + len(image_crops)].mean(dim=0)
+            start += len(image_crops)
+            vec = (agg / agg.norm()).numpy().astype("float32")
+            self._cache_embedding((uri, policy), vec)
+            out[uri] = vec
+        return out
+
+    def embed_text(self, text: str) -> np.ndarray:
+        """Fast-tier CLIP text embedding, comparable with embed_image / embed_image_uris."""
+        return self._encode_texts([text]).squeeze(0).numpy().astype("float32")
+
     def zero_shot_batch(self, uris: List[str], top_k_per_attr: int = 3, **kwargs) -> List[Dict]:
         out = []
         for u in uris:
@@ -253,6 +597,16 @@ class ClipTagger:
     # -------------------------
     # Domain tuning: label suggestion
     # -------------------------
+    @staticmethod
+    def _top_k_phrases(phrases, counts: np.ndarray, top_k: int) -> List[Tuple[str,int]]:
+        """Top-k (phrase, count) by count: argpartition then sort only the k winners."""
+        if len(counts) == 0 or top_k <= 0:
+            return []
+        k = min(top_k, len(counts))
+        idx = np.argpartition(-counts, k - 1)[:k]
+        idx = idx[np.argsort(-counts[idx], kind="stable")]
+        return [(phrases[i], int(counts[i])) for i in idx]
+
     @staticmethod
     def suggest_labels_from_texts(texts: List[str], top_k: int = 50, ngram_range: Tuple[int,int]=(1,2)) -> List[Tuple[str,int]]:
         """
@@ -261,15 +615,41 @@ class ClipTagger:
         """
         if not texts:
             return []
+        from sklearn.feature_extraction.text import CountVectorizer
+
         # basic cleaning: join, lower
         vectorizer = CountVectorizer(ngram_range=ngram_range, stop_words='english', max_features=10000)
         X = vectorizer.fit_transform(texts)
-        sums = X.sum(axis=0).A1  # counts per feature
+        sums = np.asarray(X.sum(axis=0)).ravel()  # counts per feature
         features = vectorizer.get_feature_names_out()
-        pairs = list(zip(features, sums))
-        # sort by count desc
-        pairs = sorted(pairs, key=lambda x: int(x[1]), reverse=True)
-        return [(p[0], int(p[1])) for p in pairs[:top_k]]
+        return ClipTagger._top_k_phrases(features, sums, top_k)
+
+    @staticmethod
+    def suggest_labels_from_stream(chunks: Iterable[List[str]], top_k: int = 50, ngram_range: Tuple[int,int]=(1,2)) -> List[Tuple[str,int]]:
+        """
+        Streaming variant for the whole catalog: `chunks` yields lists of texts (e.g. Mongo batches).
+        N-grams are produced by the same CountVectorizer analyzer (lowercase, English stop words) and
+        accumulated in one Counter, so no document-term matrix is ever built and only one chunk of
+        text is held at a time. After each chunk the Counter is pruned to the top
+        LABEL_STREAM_KEEP * top_k n-grams, which bounds memory on large catalogs; counts of phrases
+        that drop out and come back later are approximate, the frequent ones are exact.
+        """
+        from sklearn.feature_extraction.text import CountVectorizer
+
+        analyzer = CountVectorizer(ngram_range=ngram_range, stop_words='english').build_analyzer()
+        keep = max(1, LABEL_STREAM_KEEP * top_k)
+        counts = Counter()
+        for chunk in chunks:
+            for text in chunk:
+                if text:
+                    counts.update(analyzer(text))
+            if len(counts) > keep:
+                counts = Counter(dict(counts.most_common(keep)))
+        if not counts:
+            return []
+        phrases = list(counts.keys())
+        values = np.fromiter(counts.values(), dtype=np.int64, count=len(phrases))
+        return ClipTagger._top_k_phrases(phrases, values, top_k)
 
     # -------------------------
     # Color merging helper
@@ -3,34 +3,61 @@
 Robust color extraction pipeline.
 Tries rembg,
 and finally a naive no-mask approach.
+Pixels are clustered in CIELAB and named against a precomputed Lab palette.
 
 Returns: list of dicts: { hex: "#rrggbb", percentage: 0.35, name: "blue", source_image: "<url>" }
 """
 import io
 import os
-import math
+import threading
+import time
+import zlib
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 import requests
-from typing import List, Dict, Optional, Tuple
-from PIL import Image, ImageStat
+from typing import List, Dict, NamedTuple, Optional, Tuple
+from PIL import Image
 import numpy as np
-from sklearn.cluster import KMeans
 
-# Optional dependencies
-try:
-    import torch
-    TORCH_AVAILABLE = True
-except Exception:
-    TORCH_AVAILABLE = False
+from executors import claim_workers
+from metrics import REGISTRY, SIZE_BUCKETS
 
-# rembg fallback
-REMBG_AVAILABLE = False
-try:
-    from rembg import remove as rembg_remove
-    REMBG_AVAILABLE = True
-except Exception:
-    REMBG_AVAILABLE = False
+# sklearn, torch and rembg (onnxruntime + numba) are slow to import and not needed by the
+# palette helpers other modules use, so they are imported on first use.
+
+# one rembg (onnxruntime) session per process, created on first use
+REMBG_MODEL = os.environ.get("REMBG_MODEL", "u2net")
+# segmentation runs on a copy whose long edge is capped here; only the mask is upsampled
+REMBG_MAX_SIDE = int(os.environ.get("REMBG_MAX_SIDE", "640"))
+_rembg_module = None    # rembg module, or False once the import failed
+_rembg_session = None
+_rembg_session_lock = threading.Lock()
+
+def _rembg():
+    """The rembg module, imported on first use; None if it is not installed."""
+    global _rembg_module
+    if _rembg_module is None:
+        try:
+            import rembg
+            _rembg_module = rembg
+        except Exception:
+            _rembg_module = False
+    return _rembg_module or None
+
+def rembg_available() -> bool:
+    return _rembg() is not None
+
+def _get_rembg_session():
+    global _rembg_session
+    if _rembg_session is None:
+        with _rembg_session_lock:
+            if _rembg_session is None:
+                _rembg_session = _rembg().new_session(REMBG_MODEL)
+    return _rembg_session
 
 # Helper: download image bytes (timeout and safe)
+@REGISTRY.timed("stage_seconds", stage="download_image")
 def download_image(url: str, timeout: int = 10) -> Optional[bytes]:
     try:
         r = requests.get(url, timeout=timeout, headers={"User-Agent": "artisan-assistant/1.0"})
@@ -40,21 +67,43 @@ def download_image(url: str, timeout: int = 10) -> Optional[bytes]:
         return None
 
 # Helper: open image into RGBA PIL image
-def pil_from_bytes(b: bytes) -> Image.Image:
-    img = Image.open(io.BytesIO(b)).convert("RGBA")
-    return img
+# All per-image array work (mask, pixels) happens at a bounded working resolution: JPEGs are
+# DCT-downscaled while decoding (draft), everything is then thumbnailed to this long edge.
+COLOR_WORK_MAX_SIDE = int(os.environ.get("COLOR_WORK_MAX_SIDE", "768"))
+# pixels handed to clustering per image
+COLOR_SAMPLE_PIXELS = int(os.environ.get("COLOR_SAMPLE_PIXELS", "20000"))
+
+def pil_from_bytes(b: bytes, max_side: Optional[int] = None) -> Image.Image:
+    """Decode to RGBA with the long edge capped at max_side (None -> COLOR_WORK_MAX_SIDE, 0 -> full size)."""
+    max_side = COLOR_WORK_MAX_SIDE if max_side is None else max_side
+    img = Image.open(io.BytesIO(b))
+    if max_side:
+        img.draft("RGB", (max_side, max_side))  # JPEG only: decode at 1/2, 1/4 or 1/8 scale
+        img.thumbnail((max_side, max_side), Image.BILINEAR)
+    return img.convert("RGBA")
 
 # rembg based alpha mask
-def mask_with_rembg(pil_img: Image.Image) -> Optional[np.ndarray]:
-    if not REMBG_AVAILABLE:
+def mask_with_rembg(pil_img: Image.Image, max_side: Optional[int] = None) -> Optional[np.ndarray]:
+    """
+    Foreground mask (HxW uint8, 1 = foreground) at the size of `pil_img`.
+    Segmentation runs on a copy downscaled to `max_side` (None -> REMBG_MAX_SIDE, 0 -> full size)
+    with the shared session; arrays are passed directly, no PNG encode/decode.
+    """
+    rembg = _rembg()
+    if rembg is None:
         return None
     try:
-        # rembg returns RGBA bytes with transparent background where foreground remains
-        input_bytes = io.BytesIO()
-        pil_img.convert("RGBA").save(input_bytes, format="PNG")
-        out_bytes = rembg_remove(input_bytes.getvalue())
-        out_img = Image.open(io.BytesIO(out_bytes)).convert("RGBA")
-        alpha = np.array(out_img.split()[-1])  # alpha channel
+        max_side = REMBG_MAX_SIDE if max_side is None else max_side
+        w, h = pil_img.size
+        small = pil_img.convert("RGB")
+        if max_side and max(w, h) > max_side:
+            scale = max_side / float(max(w, h))
+            small = small.resize((max(1, round(w * scale)), max(1, round(h * scale))), Image.BILINEAR)
+        alpha = np.asarray(rembg.remove(np.asarray(small), session=_get_rembg_session(), only_mask=True))
+        if alpha.ndim == 3:
+            alpha = alpha[..., -1]
+        if alpha.shape != (h, w):
+            alpha = np.asarray(Image.fromarray(alpha).resize((w, h), Image.BILINEAR))
         # consider pixels with alpha > 10 as foreground
         return (alpha > 10).astype(np.uint8)
     except Exception:
@@ -70,32 +119,108 @@ def naive_mask(pil_img: Image.Image) -> np.ndarray:
     mask = (alpha > 30) & (luminance < 245)
     return mask.astype(np.uint8)
 
-# Convert rgb -> lab might help clustering; we use simple rgb clustering but convert to float32
-def extract_colors_from_pixels(pixels: np.ndarray, n_colors: int = 3) -> List[Tuple[Tuple[int,int,int], float]]:
+# Vectorized sRGB (D65) <-> CIELAB, same constants as skimage.color.rgb2lab.
+_RGB_TO_XYZ = np.array([[0.4124564, 0.3575761, 0.1804375],
+                        [0.2126729, 0.7151522, 0.0721750],
+                        [0.0193339, 0.1191920, 0.9503041]])
+_XYZ_TO_RGB = np.linalg.inv(_RGB_TO_XYZ)
+_D65_WHITE = np.array([0.95047, 1.00000, 1.08883])
+
+def rgb_to_lab(rgb: np.ndarray) -> np.ndarray:
+    """(..., 3) RGB in 0-255 -> (..., 3) Lab (float64)."""
+    c = np.asarray(rgb, dtype=np.float64) / 255.0
+    lin = np.where(c <= 0.04045, c / 12.92, ((c + 0.055) / 1.055) ** 2.4)
+    xyz = (lin @ _RGB_TO_XYZ.T) / _D65_WHITE
+    f = np.where(xyz > 0.008856, np.cbrt(xyz), 7.787 * xyz + 16 / 116)
+    L = 116 * f[..., 1] - 16
+    a = 500 * (f[..., 0] - f[..., 1])
+    b = 200 * (f[..., 1] - f[..., 2])
+    return np.stack([L, a, b], axis=-1)
+
+def lab_to_rgb(lab: np.ndarray) -> np.ndarray:
+    """(..., 3) Lab -> (..., 3) RGB uint8 (out-of-gamut values clipped)."""
+    lab = np.asarray(lab, dtype=np.float64)
+    fy = (lab[..., 0] + 16) / 116
+    f = np.stack([fy + lab[..., 1] / 500, fy, fy - lab[..., 2] / 200], axis=-1)
+    f3 = f ** 3
+    xyz = np.where(f3 > 0.008856, f3, (f - 16 / 116) / 7.787) * _D65_WHITE
+    lin = np.clip(xyz @ _XYZ_TO_RGB.T, 0.0, 1.0)
+    c = np.where(lin <= 0.0031308, 12.92 * lin, 1.055 * lin ** (1 / 2.4) - 0.055)
+    return np.clip(np.rint(c * 255), 0, 255).astype(np.uint8)
+
+# Clustering engines (COLOR_CLUSTER_METHOD or the `method` argument):
+#  kmeans    - sklearn KMeans(n_init=10) on every sampled pixel (original, slowest)
+#  histogram - 3-D RGB histogram with COLOR_HIST_BITS bits per channel; weighted k-means++
+#              with a single init over the occupied bins (bin means, weighted by pixel count)
+#  minibatch - MiniBatchKMeans on float32 pixels, single init
+COLOR_METHODS = ("kmeans", "histogram", "minibatch")
+COLOR_METHOD = os.environ.get("COLOR_CLUSTER_METHOD", "histogram")
+HIST_BITS = int(os.environ.get("COLOR_HIST_BITS", "5"))
+
+def _histogram_bins(pixels: np.ndarray, bits: int = HIST_BITS) -> Tuple[np.ndarray, np.ndarray]:
+    """Quantize Nx3 uint8 pixels into 2^(3*bits) bins. Returns (mean color per occupied bin, pixel count per bin)."""
+    shift = 8 - bits
+    q = pixels.astype(np.int32) >> shift
+    codes = (q[:, 0] << (2 * bits)) | (q[:, 1] << bits) | q[:, 2]
+    nbins = 1 << (3 * bits)
+    counts = np.bincount(codes, minlength=nbins)
+    occupied = np.flatnonzero(counts)
+    means = np.empty((len(occupied), 3), dtype=np.float32)
+    for ch in range(3):
+        means[:, ch] = np.bincount(codes, weights=pixels[:, ch], minlength=nbins)[occupied] / counts[occupied]
+    return means, counts[occupied].astype(np.float64)
+
+def _cluster(X: np.ndarray, n_clusters: int, method: str, weights: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns (centers, total weight per center) for points X (optionally weighted)."""
+    from sklearn.cluster import KMeans, MiniBatchKMeans
+
+    if method == "minibatch":
+        km = MiniBatchKMeans(n_clusters=n_clusters, random_state=42, n_init=1, batch_size=2048)
+    elif method == "histogram":
+        km = KMeans(n_clusters=n_clusters, random_state=42, n_init=1, init="k-means++")
+    else:
+        km = KMeans(n_clusters=n_clusters, random_state=42, n_init=10)
+    km.fit(X, sample_weight=weights)
+    counts = np.bincount(km.labels_, weights=weights, minlength=n_clusters)
+    return km.cluster_centers_, counts
+
+def cluster_pixels_lab(pixels: np.ndarray, n_colors: int = 3, method: Optional[str] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Cluster Nx3 uint8 pixels in CIELAB.
+    Returns (Lab centers kx3, pixel fraction per center), sorted by fraction desc.
+    The histogram method bins in RGB (cheap integer ops) and clusters the Lab bin means.
+    """
+    method = method or COLOR_METHOD
+    if method not in COLOR_METHODS:
+        raise ValueError(f"Unknown color method '{method}'. Expected one of {COLOR_METHODS}")
+    if method == "histogram":
+        bins, weights = _histogram_bins(pixels)
+        X = rgb_to_lab(bins)
+    else:
+        X = rgb_to_lab(pixels)
+        if method == "minibatch":
+            X = X.astype(np.float32)
+        weights = None
+    n_clusters = min(n_colors, len(X))
+    centers, counts = _cluster(X, n_clusters, method, weights)
+    fracs = counts / counts.sum()
+    order = np.argsort(-fracs, kind="stable")
+    return np.asarray(centers, dtype=np.float64)[order], fracs[order]
+
+def extract_colors_from_pixels(pixels: np.ndarray, n_colors: int = 3, method: Optional[str] = None) -> List[Tuple[Tuple[int,int,int], float]]:
     """
     pixels: Nx3 uint8
-    return list of (rgb_tuple, fraction)
+    method: one of COLOR_METHODS (None -> COLOR_CLUSTER_METHOD)
+    return list of (rgb_tuple, fraction), sorted by fraction desc
     """
     if len(pixels) == 0:
         return []
-    # KMeans in RGB space (fast and adequate). Convert to float.
-    X = pixels.astype(float) / 255.0
-    n_clusters = min(n_colors, len(pixels))
     try:
-        km = KMeans(n_clusters=n_clusters, random_state=42, n_init=10)
-        km.fit(X)
-        centers = (km.cluster_centers_ * 255).astype(int)
-        labels = km.labels_
-        counts = np.bincount(labels, minlength=n_clusters)
-        total = counts.sum()
-        results = []
-        for c, cnt in zip(centers, counts):
-            r, g, b = int(c[0]), int(c[1]), int(c[2])
-            frac = float(cnt) / float(total)
-            results.append(((r,g,b), frac))
-        # sort by frac desc
-        results.sort(key=lambda x: x[1], reverse=True)
-        return results
+        centers, fracs = cluster_pixels_lab(pixels, n_colors=n_colors, method=method)
+        rgbs = lab_to_rgb(centers)
+        return [((int(c[0]), int(c[1]), int(c[2])), float(f)) for c, f in zip(rgbs, fracs)]
+    except ValueError:
+        raise
     except Exception:
         # fallback to sampling median color
         med = np.median(pixels, axis=0).astype(int)
@@ -107,15 +232,6 @@ def rgb_to_hex(rgb: Tuple[int,int,int]) -> str:
 # Map color to closest CSS3 name using webcolors if available; else return None
 # Robust color name mapping using webcolors when available.
 
-# Try to use skimage for Lab conversion (recommended). Fall back to simple RGB if unavailable.
-_SKIMAGE_AVAILABLE = False
-try:
-    from skimage.color import rgb2lab
-    import numpy as np
-    _SKIMAGE_AVAILABLE = True
-except Exception:
-    _SKIMAGE_AVAILABLE = False
-
 # Build HEX_TO_NAMES palette robustly (prefer webcolors if present).
 try:
     import webcolors
@@ -175,50 +291,26 @@ def _hex_to_rgb_tuple(hex_color: str) -> Tuple[int,int,int]:
 _PALETTE_HEX: List[str] = list(HEX_TO_NAMES.keys())
 _PALETTE_NAMES: List[str] = [HEX_TO_NAMES[h] for h in _PALETTE_HEX]
 
-if _SKIMAGE_AVAILABLE:
-    # build Nx3 Lab array from palette RGB (values 0-1 -> rgb2lab expects float in [0,1])
-    import numpy as np
-    palette_rgb = np.array([_hex_to_rgb_tuple(h) for h in _PALETTE_HEX], dtype=float) / 255.0
-    try:
-        PALETTE_LAB = rgb2lab(palette_rgb.reshape(-1,1,3)).reshape(-1,3)  # shape (N,3)
-    except Exception:
-        # fallback to manual conversion if rgb2lab fails
-        PALETTE_LAB = None
-else:
-    PALETTE_LAB = None
+# Lab of every palette entry, computed once at import (no per-call palette conversion)
+PALETTE_LAB: np.ndarray = rgb_to_lab(np.array([_hex_to_rgb_tuple(h) for h in _PALETTE_HEX], dtype=np.float64).reshape(-1, 3))
 
 def _rgb_tuple_to_lab(rgb: Tuple[int,int,int]) -> Tuple[float,float,float]:
-    """Convert 0-255 RGB tuple to Lab using skimage if available, else approximate by scaling."""
-    if _SKIMAGE_AVAILABLE and PALETTE_LAB is not None:
-        import numpy as np
-        arr = np.array(rgb, dtype=float) / 255.0
-        lab = rgb2lab(arr.reshape(1,1,3)).reshape(3,)
-        return float(lab[0]), float(lab[1]), float(lab[2])
-    else:
-        # fallback: approximate Lab by simple transform (less accurate). Still deterministic.
-        r, g, b = rgb
-        # convert to linearized sRGB
-        def _to_lin(c):
-            c = c / 255.0
-            return (c/12.92) if c <= 0.04045 else pow((c+0.055)/1.055, 2.4)
-        R, G, B = _to_lin(r), _to_lin(g), _to_lin(b)
-        # convert to XYZ
-        X = 0.4124564*R + 0.3575761*G + 0.1804375*B
-        Y = 0.2126729*R + 0.7151522*G + 0.0721750*B
-        Z = 0.0193339*R + 0.1191920*G + 0.9503041*B
-        # reference white D65
-        Xn, Yn, Zn = 0.95047, 1.00000, 1.08883
-        def f(t):
-            return pow(t, 1/3) if t > 0.008856 else (7.787 * t + 16/116)
-        L = 116 * f(Y/Yn) - 16
-        a = 500 * (f(X/Xn) - f(Y/Yn))
-        b = 200 * (f(Y/Yn) - f(Z/Zn))
-        return L, a, b
+    """Convert 0-255 RGB tuple to Lab."""
+    lab = rgb_to_lab(np.array(rgb, dtype=np.float64))
+    return float(lab[0]), float(lab[1]), float(lab[2])
+
+def nearest_color_names(lab: np.ndarray) -> List[str]:
+    """Names for a kx3 array of Lab colors: one broadcast CIE76 distance against the whole palette."""
+    lab = np.asarray(lab, dtype=np.float64).reshape(-1, 3)
+    if len(lab) == 0:
+        return []
+    dists = np.sum((lab[:, None, :] - PALETTE_LAB[None, :, :]) ** 2, axis=2)  # (k, P)
+    return [_PALETTE_NAMES[i] for i in np.argmin(dists, axis=1)]
 
 def nearest_color_name(hex_color: str) -> str:
     """
     Returns the perceptually nearest color name (guaranteed non-empty).
-    Uses CIE76 (Euclidean in Lab) if skimage available, else a deterministic fallback.
+    Uses CIE76 (Euclidean in Lab) against the precomputed palette.
     """
     try:
         h = hex_color.lower()
@@ -227,36 +319,7 @@ def nearest_color_name(hex_color: str) -> str:
         # exact match
         if h in HEX_TO_NAMES:
             return HEX_TO_NAMES[h]
-        # compute Lab for input
-        rgb = _hex_to_rgb_tuple(h)
-        lab = _rgb_tuple_to_lab(rgb)
-        # if we have precomputed palette Lab, compute distances vectorized
-        best_idx = None
-        best_dist = None
-        if PALETTE_LAB is not None:
-            # numpy vectorized distance (fast)
-            import numpy as np
-            arr_lab = PALETTE_LAB  # shape (N,3)
-            dists = np.sqrt(np.sum((arr_lab - np.array(lab).reshape(1,3))**2, axis=1))
-            idx = int(np.argmin(dists))
-            best_idx = idx
-            best_dist = float(dists[idx])
-        else:
-            # fallback loop over palette using Lab computed per-entry
-            for idx, ph in enumerate(_PALETTE_HEX):
-                prgb = _hex_to_rgb_tuple(ph)
-                plab = _rgb_tuple_to_lab(prgb)
-                dist = (lab[0]-plab[0])**2 + (lab[1]-plab[1])**2 + (lab[2]-plab[2])**2
-                if best_idx is None or dist < best_dist:
-                    best_idx = idx
-                    best_dist = dist
-            if best_dist is not None:
-                best_dist = math.sqrt(best_dist)
-        # fallback if nothing found
-        if best_idx is None:
-            # return first palette name as ultimate fallback
-            return _PALETTE_NAMES[0]
-        return _PALETTE_NAMES[best_idx]
+        return nearest_color_names(rgb_to_lab(np.array(_hex_to_rgb_tuple(h), dtype=np.float64)))[0]
     except Exception:
         # ultimate safe fallback
         try:
@@ -266,75 +329,260 @@ def nearest_color_name(hex_color: str) -> str:
         except Exception:
             return _PALETTE_NAMES[0]
 
-def process_image_url(url: str, top_k: int, device: str) -> List[Dict]:
-    """Process single image URL into list of colors with percentages."""
-    data = download_image(url)
-    if not data:
-        return []
+def _image_seed(url: str) -> int:
+    """Per-image RNG seed: sampling depends only on the image, not on call order or process."""
+    return zlib.crc32(url.encode("utf-8"))
+
+def _strided_sample(n: int, k: int, seed: int) -> np.ndarray:
+    """k evenly strided indices out of n with a seeded random phase; O(k) memory."""
+    if n <= k:
+        return np.arange(n)
+    step = n / float(k)
+    offset = np.random.default_rng(seed).random() * step
+    return (offset + step * np.arange(k)).astype(np.int64)
+
+def pixels_from_bytes(data: bytes, seed: int = 0, stages: Optional[Dict[str, float]] = None) -> Tuple[np.ndarray, int]:
+    """
+    Foreground pixels (Nx3 uint8, at most COLOR_SAMPLE_PIXELS) of an encoded image, plus the
+    bytes of the arrays built at working resolution (the per-image memory bound).
+    stages, if given, receives the seconds spent decoding and masking.
+    """
+    stages = {} if stages is None else stages
+    t0 = time.perf_counter()
     pil = pil_from_bytes(data)
+    stages["pil_from_bytes"] = time.perf_counter() - t0
 
     mask = None
 
     # rembg
-    if REMBG_AVAILABLE:
+    if rembg_available():
+        t0 = time.perf_counter()
         try:
             mask = mask_with_rembg(pil)
         except Exception:
             mask = None
+        stages["mask_with_rembg"] = time.perf_counter() - t0
 
     if mask is None:
         mask = naive_mask(pil)
 
-    # extract masked pixels
-    arr = np.array(pil.convert("RGB"))
-    h,w,_ = arr.shape
-    mask_bool = mask.astype(bool)
-    if mask_bool.sum() == 0:
+    # extract masked pixels: pick strided positions among the foreground, copy only those
+    arr = np.asarray(pil.convert("RGB"))
+    flat = arr.reshape(-1,3)
+    fg = np.flatnonzero(mask)
+    if len(fg) == 0:
         # fallback: use all pixels
-        pixels = arr.reshape(-1,3)
+        idx = _strided_sample(len(flat), COLOR_SAMPLE_PIXELS, seed)
     else:
-        pixels = arr[mask_bool].reshape(-1,3)
+        idx = fg[_strided_sample(len(fg), COLOR_SAMPLE_PIXELS, seed)]
+    pixels = flat[idx]
+    work_bytes = pil.width * pil.height * 4 + arr.nbytes + mask.nbytes + fg.nbytes + idx.nbytes + pixels.nbytes
+    return pixels, work_bytes
+
+def masked_pixels(url: str) -> Optional[np.ndarray]:
+    """Download an image and return its foreground pixels (Nx3 uint8, at most COLOR_SAMPLE_PIXELS), or None."""
+    data = download_image(url)
+    if not data:
+        return None
+    return pixels_from_bytes(data, seed=_image_seed(url))[0]
+
+class ImagePalette(NamedTuple):
+    centers: np.ndarray  # Lab, kx3
+    fracs: np.ndarray    # pixel fraction per center
+    n_pixels: int        # sampled pixels behind the fractions
+    work_bytes: int      # arrays allocated for this image at working resolution
+    stages: Optional[Dict[str, float]] = None  # seconds per processing stage
+
+def palette_from_bytes(url: str, data: bytes, top_k: int, method: Optional[str] = None) -> ImagePalette:
+    """Palette of one already-downloaded image (runs inside the color worker processes)."""
+    stages: Dict[str, float] = {}
+    pixels, work_bytes = pixels_from_bytes(data, seed=_image_seed(url), stages=stages)
+    t0 = time.perf_counter()
+    try:
+        centers, fracs = cluster_pixels_lab(pixels, n_colors=top_k, method=method)
+    except ValueError:
+        raise
+    except Exception:
+        # fallback to median color
+        centers = rgb_to_lab(np.median(pixels, axis=0)).reshape(1, 3)
+        fracs = np.ones(1)
+    stages["cluster_pixels_lab"] = time.perf_counter() - t0
+    return ImagePalette(centers, fracs, len(pixels), work_bytes, stages)
 
-    # downsample for speed if huge
-    if len(pixels) > 20000:
-        idx = np.random.choice(len(pixels), 20000, replace=False)
-        pixels = pixels[idx]
+def _record_palette(p: Optional[ImagePalette]) -> Optional[ImagePalette]:
+    # recorded in the parent: worker processes have their own registry
+    if p is not None:
+        REGISTRY.max_gauge("color_image_work_bytes_max", p.work_bytes)
+        REGISTRY.incr("color_image_work_bytes_total", p.work_bytes)
+        REGISTRY.incr("color_images_total")
+        for stage, seconds in (p.stages or {}).items():
+            REGISTRY.observe("stage_seconds", seconds, stage=stage)
+    return p
 
-    clusters = extract_colors_from_pixels(pixels, n_colors=top_k)
+def _palette_to_dicts(centers: np.ndarray, fracs: np.ndarray, sources: List[str]) -> List[Dict]:
+    names = nearest_color_names(centers)
+    rgbs = lab_to_rgb(centers)
     out = []
-    for rgb, frac in clusters:
-        hexc = rgb_to_hex(rgb)
-        name = nearest_color_name(hexc)
+    for rgb, frac, name, src in zip(rgbs, fracs, names, sources):
+        hexc = rgb_to_hex(tuple(int(v) for v in rgb))
         out.append({
             "hex": hexc,
             "percentage": round(float(frac), 4),
             "name": name,
-            "source_image": url
+            "source_image": src
         })
     return out
 
-def aggregate_images(urls: List[str], top_k_per_image: int = 3, device: str = "cpu") -> List[Dict]:
-    """Process multiple images, merge and sort by global percentage."""
-    acc = {}  # hex -> total frac (averaged across images weighted by image area)
-    meta_for_hex = {}  # sample source
-    for url in urls:
+def colors_from_bytes(url: str, data: bytes, top_k: int, method: Optional[str] = None) -> List[Dict]:
+    """Color list for one already-downloaded image."""
+    p = _record_palette(palette_from_bytes(url, data, top_k, method=method))
+    return _palette_to_dicts(p.centers, p.fracs, [url] * len(p.centers))
+
+def process_image_url(url: str, top_k: int, device: str, method: Optional[str] = None) -> List[Dict]:
+    """Process single image URL into list of colors with percentages."""
+    data = download_image(url)
+    if not data:
+        return []
+    return colors_from_bytes(url, data, top_k, method=method)
+
+# ---------------------------
+# Parallel multi-image processing
+# ---------------------------
+# Downloads run on threads (I/O); rembg + clustering run in a process pool whose size is
+# claimed from the service-wide ML_CPU_BUDGET. COLOR_WORKERS=1 keeps everything in-process.
+COLOR_WORKERS = int(os.environ.get("COLOR_WORKERS", "2"))
+REGISTRY.set_buckets("color_request_images", SIZE_BUCKETS)
+COLOR_IO_WORKERS = int(os.environ.get("COLOR_IO_WORKERS", "8"))
+_color_pool: Optional[ProcessPoolExecutor] = None
+_color_pool_lock = threading.Lock()
+
+def _color_worker_init():
+    # N worker processes should use ~N cores: keep their BLAS/OpenMP pools single-threaded. The
+    # variables cover libraries loaded later (sklearn, onnxruntime via rembg); threadpoolctl the
+    # ones already loaded. The color path never uses torch, so it is not imported here.
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = "1"
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(1)
+    except Exception:
+        pass
+
+def _get_color_pool() -> Optional[ProcessPoolExecutor]:
+    global _color_pool
+    if COLOR_WORKERS <= 1:
+        return None
+    with _color_pool_lock:
+        if _color_pool is None:
+            workers = claim_workers("colors", COLOR_WORKERS)
+            if workers <= 1:
+                return None
+            # spawn: the service process has live threads (server, torch), which fork would copy unsafely
+            _color_pool = ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context("spawn"),
+                                              initializer=_color_worker_init)
+        return _color_pool
+
+def _reset_color_pool():
+    global _color_pool
+    with _color_pool_lock:
+        if _color_pool is not None:
+            _color_pool.shutdown(wait=False, cancel_futures=True)
+        _color_pool = None
+
+def image_palettes(urls: List[str], top_k: int, method: Optional[str] = None) -> List[Optional[ImagePalette]]:
+    """
+    palette_from_bytes results in the order of `urls` (None for images that fail).
+    Downloads overlap with each other and with the CPU work; results do not depend on scheduling.
+    """
+    def run_local(url):
+        data = download_image(url)
+        if not data:
+            return None
         try:
-            colors = process_image_url(url, top_k=top_k_per_image, device=device)
+            return _record_palette(palette_from_bytes(url, data, top_k, method=method))
         except Exception:
-            colors = []
-        # weight each image equally (optionally weight by image size)
-        for c in colors:
-            hexc = c["hex"].lower()
-            frac = c.get("percentage", 0.0)
-            acc[hexc] = acc.get(hexc, 0.0) + frac
-            if hexc not in meta_for_hex:
-                meta_for_hex[hexc] = {"name": c.get("name"), "source_image": c.get("source_image")}
-    # normalize totals
-    total = sum(acc.values()) or 1.0
-    out = []
-    for hexc, tot in acc.items():
-        entry = {"hex": hexc, "percentage": round(float(tot) / float(total), 4)}
-        entry.update(meta_for_hex.get(hexc, {}))
-        out.append(entry)
-    out.sort(key=lambda x: x["percentage"], reverse=True)
-    return out
+            return None
+
+    pool = _get_color_pool() if len(urls) > 1 else None
+    if pool is None:
+        return [run_local(url) for url in urls]
+
+    results: List[Optional[ImagePalette]] = [None for _ in urls]
+    cpu_futures = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(COLOR_IO_WORKERS, len(urls)))) as io_pool:
+        downloads = {io_pool.submit(download_image, url): i for i, url in enumerate(urls)}
+        for fut in as_completed(downloads):
+            i = downloads[fut]
+            data = fut.result()
+            if data:
+                cpu_futures[i] = pool.submit(palette_from_bytes, urls[i], data, top_k, method)
+    for i, fut in cpu_futures.items():
+        try:
+            results[i] = _record_palette(fut.result())
+        except BrokenProcessPool:
+            _reset_color_pool()
+            results[i] = run_local(urls[i])
+        except Exception:
+            results[i] = None
+    return results
+
+# Cluster centers from different images closer than this (CIE76 delta E) are the same color.
+COLOR_MERGE_DELTA_E = float(os.environ.get("COLOR_MERGE_DELTA_E", "10"))
+
+def merge_palettes(palettes: List[Optional[ImagePalette]], sources: List[str],
+                   delta_e: float = COLOR_MERGE_DELTA_E) -> Tuple[np.ndarray, np.ndarray, List[str]]:
+    """
+    Merge per-image palettes into one: every image weighs the same in the percentages, and
+    centers within `delta_e` of an already merged color are folded into it (pixel-count
+    weighted mean in Lab). Colors are visited by share, so big colors seed the clusters.
+    Returns (Lab centers, normalized shares, source image per color), sorted by share desc.
+    """
+    rows = []
+    for p, src in zip(palettes, sources):
+        if p is not None and len(p.centers):
+            rows.append((p.centers, p.fracs, p.n_pixels, src))
+    if not rows:
+        return np.zeros((0, 3)), np.zeros(0), []
+    labs = np.concatenate([c for c, _, _, _ in rows]).astype(np.float64)
+    shares = np.concatenate([f for _, f, _, _ in rows]).astype(np.float64)
+    pixels = np.concatenate([f * n for _, f, n, _ in rows]).astype(np.float64)
+    src_idx = np.concatenate([np.full(len(c), i) for i, (c, _, _, _) in enumerate(rows)])
+
+    order = np.argsort(-shares, kind="stable")
+    merged_lab = np.empty_like(labs)
+    merged_px = np.zeros(len(labs))
+    merged_share = np.zeros(len(labs))
+    merged_src = np.zeros(len(labs), dtype=int)
+    k = 0
+    for i in order:
+        if k:
+            d = np.linalg.norm(merged_lab[:k] - labs[i], axis=1)
+            j = int(np.argmin(d))
+            if d[j] <= delta_e:
+                px = merged_px[j] + pixels[i]
+                if px > 0:
+                    merged_lab[j] = (merged_lab[j] * merged_px[j] + labs[i] * pixels[i]) / px
+                merged_px[j] = px
+                merged_share[j] += shares[i]
+                continue
+        merged_lab[k] = labs[i]
+        merged_px[k] = pixels[i]
+        merged_share[k] = shares[i]
+        merged_src[k] = src_idx[i]
+        k += 1
+
+    merged_share = merged_share[:k] / (merged_share[:k].sum() or 1.0)
+    order = np.argsort(-merged_share, kind="stable")
+    return merged_lab[:k][order], merged_share[order], [rows[s][3] for s in merged_src[:k][order]]
+
+def aggregate_images(urls: List[str], top_k_per_image: int = 3, device: str = "cpu", method: Optional[str] = None,
+                     delta_e: Optional[float] = None) -> List[Dict]:
+    """
+    Process multiple images and merge them into one compact palette sorted by global percentage.
+    Near-identical colors from different photos (within delta_e, default COLOR_MERGE_DELTA_E) are one entry.
+    """
+    REGISTRY.observe("color_request_images", len(urls))
+    # images are processed in parallel but merged in input order, so the output is deterministic
+    palettes = image_palettes(urls, top_k=top_k_per_image, method=method)
+    centers, shares, sources = merge_palettes(palettes, urls, delta_e=COLOR_MERGE_DELTA_E if delta_e is None else delta_e)
+    return _palette_to_dicts(centers, shares, sources)
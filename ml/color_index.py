@@ -0,0 +1,188 @@
+# ml/color_index.py
+"""
+In-memory "shop by color" index.
+
+Every listing's palette (the detected_colors the backend stores on the listing:
+hex + percentage) is kept in CIELAB. Palette entries are bucketed into cubic Lab
+bins of COLOR_INDEX_BIN units; a query color only looks at the bins within
+max_delta_e of it, computes exact CIE76 distances for those entries and scores
+    score(listing) = mean over query colors of  sum(weight * (1 - dE / max_delta_e))
+so no image is touched at query time.
+"""
+import os
+import threading
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from color_detector import rgb_to_lab, HEX_TO_NAMES, _hex_to_rgb_tuple
+
+COLOR_INDEX_BIN = float(os.environ.get("COLOR_INDEX_BIN", "10"))
+COLOR_MAX_DELTA_E = float(os.environ.get("COLOR_MAX_DELTA_E", "20"))
+# upper bound on a requested max_delta_e; 100 already spans most of the Lab gamut
+COLOR_MAX_DELTA_E_LIMIT = 100.0
+# palette entries below this weight are noise (specks, shadows) and are not indexed
+COLOR_MIN_WEIGHT = float(os.environ.get("COLOR_MIN_WEIGHT", "0.03"))
+
+_NAME_TO_HEX = {name.lower(): hexc for hexc, name in HEX_TO_NAMES.items()}
+
+
+def color_to_lab(color: str) -> Optional[np.ndarray]:
+    """'#b3212a', 'b3212a' or a color name -> Lab (3,), or None if unknown."""
+    c = (color or "").strip().lower()
+    if not c:
+        return None
+    hexc = _NAME_TO_HEX.get(c)
+    if hexc is None:
+        try:
+            import webcolors
+            hexc = webcolors.name_to_hex(c)
+        except Exception:
+            hexc = c
+    try:
+        return rgb_to_lab(np.array(_hex_to_rgb_tuple(hexc), dtype=np.float64))
+    except Exception:
+        return None
+
+
+def listing_palette(doc: dict) -> List[dict]:
+    """
+    Palette to persist for a listing: [{hex, weight, lab}] from its detected_colors,
+    weights normalized to 1 (detected_colors may hold entries from several uploads).
+    """
+    entries = []
+    for c in doc.get("detected_colors") or []:
+        if not isinstance(c, dict) or not c.get("hex"):
+            continue
+        try:
+            weight = float(c.get("percentage") or 0.0)
+            lab = rgb_to_lab(np.array(_hex_to_rgb_tuple(c["hex"]), dtype=np.float64))
+        except Exception:
+            continue
+        if weight > 0:
+            entries.append({"hex": c["hex"].lower(), "weight": weight, "lab": [round(float(v), 2) for v in lab]})
+    total = sum(e["weight"] for e in entries)
+    for e in entries:
+        e["weight"] = round(e["weight"] / total, 4)
+    return [e for e in entries if e["weight"] >= COLOR_MIN_WEIGHT]
+
+
+class ColorIndex:
+    def __init__(self, bin_size: float = COLOR_INDEX_BIN):
+        self.bin_size = float(bin_size)
+        self._palettes: Dict[int, List[dict]] = {}
+        self._lock = threading.Lock()
+        self._dirty = True
+        # flat arrays over all palette entries + bin -> entry indices, rebuilt lazily after changes
+        self._labs = np.zeros((0, 3), dtype=np.float32)
+        self._weights = np.zeros(0, dtype=np.float32)
+        self._fids = np.zeros(0, dtype=np.int64)
+        self._postings: Dict[Tuple[int, int, int], np.ndarray] = {}
+
+    def __len__(self):
+        return len(self._palettes)
+
+    # ---------------------------
+    # Maintenance
+    # ---------------------------
+    def build(self, items: Iterable[Tuple[int, List[dict]]]) -> None:
+        with self._lock:
+            self._palettes = {int(fid): pal for fid, pal in items if pal}
+            self._dirty = True
+
+    def add(self, fid: int, palette: List[dict]) -> None:
+        with self._lock:
+            if palette:
+                self._palettes[int(fid)] = palette
+            else:
+                self._palettes.pop(int(fid), None)
+            self._dirty = True
+
+    def remove(self, fid: int) -> None:
+        with self._lock:
+            if self._palettes.pop(int(fid), None) is not None:
+                self._dirty = True
+
+    def _bin(self, labs: np.ndarray) -> np.ndarray:
+        return np.floor(labs / self.bin_size).astype(np.int64)
+
+    def _refresh(self) -> None:
+        # caller holds the lock
+        if not self._dirty:
+            return
+        labs, weights, fids = [], [], []
+        for fid, pal in self._palettes.items():
+            for e in pal:
+                labs.append(e["lab"])
+                weights.append(e["weight"])
+                fids.append(fid)
+        self._labs = np.asarray(labs, dtype=np.float32).reshape(-1, 3)
+        self._weights = np.asarray(weights, dtype=np.float32)
+        self._fids = np.asarray(fids, dtype=np.int64)
+        postings = defaultdict(list)
+        for i, b in enumerate(map(tuple, self._bin(self._labs))):
+            postings[b].append(i)
+        self._postings = {b: np.asarray(ix, dtype=np.int64) for b, ix in postings.items()}
+        self._dirty = False
+
+    # ---------------------------
+    # Query
+    # ---------------------------
+    def _candidates(self, lab: np.ndarray, max_delta_e: float) -> np.ndarray:
+        lo = self._bin(lab - max_delta_e)
+        hi = self._bin(lab + max_delta_e)
+        if np.prod(hi - lo + 1) > len(self._labs):
+            # more bins in range than entries: a full scan is cheaper than probing the bins
+            return np.arange(len(self._labs), dtype=np.int64)
+        parts = []
+        for i in range(lo[0], hi[0] + 1):
+            for j in range(lo[1], hi[1] + 1):
+                for k in range(lo[2], hi[2] + 1):
+                    ix = self._postings.get((i, j, k))
+                    if ix is not None:
+                        parts.append(ix)
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64)
+
+    def _entry_scores(self, query_labs: np.ndarray, max_delta_e: float) -> Tuple[np.ndarray, np.ndarray]:
+        """(fid per matching entry, score contribution per entry), averaged over query colors."""
+        fids, scores = [], []
+        for lab in query_labs:
+            ix = self._candidates(lab, max_delta_e)
+            if len(ix) == 0:
+                continue
+            d = np.linalg.norm(self._labs[ix] - lab, axis=1)
+            keep = d < max_delta_e
+            ix = ix[keep]
+            fids.append(self._fids[ix])
+            scores.append(self._weights[ix] * (1.0 - d[keep] / max_delta_e) / len(query_labs))
+        if not fids:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        return np.concatenate(fids), np.concatenate(scores)
+
+    def search(self, query_labs: np.ndarray, k: int = 10, max_delta_e: float = COLOR_MAX_DELTA_E) -> List[Tuple[int, float]]:
+        """Top-k (faiss_id, score) for the query colors (qx3 Lab)."""
+        query_labs = np.asarray(query_labs, dtype=np.float32).reshape(-1, 3)
+        with self._lock:
+            self._refresh()
+            fids, scores = self._entry_scores(query_labs, max_delta_e)
+        if len(fids) == 0:
+            return []
+        uniq, inv = np.unique(fids, return_inverse=True)
+        totals = np.bincount(inv, weights=scores)
+        k = min(k, len(uniq))
+        top = np.argpartition(-totals, k - 1)[:k]
+        top = top[np.argsort(-totals[top], kind="stable")]
+        return [(int(uniq[i]), float(totals[i])) for i in top]
+
+    def score(self, query_labs: np.ndarray, fids: List[int], max_delta_e: float = COLOR_MAX_DELTA_E) -> Dict[int, float]:
+        """Color score of specific listings (0 for listings without a matching color)."""
+        query_labs = np.asarray(query_labs, dtype=np.float32).reshape(-1, 3)
+        with self._lock:
+            self._refresh()
+            mfids, scores = self._entry_scores(query_labs, max_delta_e)
+        out = {int(f): 0.0 for f in fids}
+        for f, sc in zip(mfids.tolist(), scores.tolist()):
+            if f in out:
+                out[f] += sc
+        return out
@@ -0,0 +1,148 @@
+# ml/description_cache.py
+"""
+Persistent cache of generated product descriptions.
+
+Drafts are regenerated with the same input far more often than with new input, so results
+are stored in a small sqlite file keyed by a hash of the normalized request (title, features,
+category, tone, model and generation settings). Each key keeps a few candidate descriptions
+that are handed out round-robin, so repeated clicks still show some variety; a fresh request
+generates a new one and puts it in front. Least recently used keys are evicted beyond
+max_entries.
+
+Environment variables (optional):
+- GEN_DESC_CACHE (default: 1) set to 0 to disable
+- GEN_DESC_CACHE_PATH (default: $ML_DATA_DIR/description_cache.sqlite)
+- GEN_DESC_CACHE_MAX_ENTRIES (default: 20000) keys kept
+- GEN_DESC_CACHE_VARIANTS (default: 3) candidates kept per key
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import logging
+from typing import List, Optional
+
+from metrics import REGISTRY
+
+LOG = logging.getLogger("description_cache")
+
+GEN_DESC_CACHE = os.environ.get("GEN_DESC_CACHE", "1") == "1"
+GEN_DESC_CACHE_PATH = os.environ.get(
+    "GEN_DESC_CACHE_PATH", os.path.join(os.environ.get("ML_DATA_DIR") or ".", "description_cache.sqlite"))
+GEN_DESC_CACHE_MAX_ENTRIES = int(os.environ.get("GEN_DESC_CACHE_MAX_ENTRIES", "20000"))
+GEN_DESC_CACHE_VARIANTS = int(os.environ.get("GEN_DESC_CACHE_VARIANTS", "3"))
+
+
+def _norm(value) -> str:
+    return re.sub(r"\s+", " ", str(value or "").strip().lower())
+
+
+def cache_key(title: str, features: List[str], category: Optional[str], tone: Optional[str], **params) -> str:
+    """Stable hash of the normalized request; params holds model name and generation settings."""
+    payload = {
+        "title": _norm(title),
+        "features": [_norm(f) for f in features or [] if _norm(f)],
+        "category": _norm(category),
+        "tone": _norm(tone),
+        "params": {k: params[k] for k in sorted(params)},
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class DescriptionCache:
+    def __init__(self, path: str = GEN_DESC_CACHE_PATH, max_entries: int = GEN_DESC_CACHE_MAX_ENTRIES,
+                 variants: int = GEN_DESC_CACHE_VARIANTS):
+        self.path = path
+        self.max_entries = max(1, int(max_entries))
+        self.variants = max(1, int(variants))
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS descriptions ("
+            " key TEXT PRIMARY KEY, candidates TEXT NOT NULL, cursor INTEGER NOT NULL DEFAULT 0,"
+            " created REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS descriptions_last_used ON descriptions(last_used)")
+        REGISTRY.set_gauge("gen_desc_cache_entries", len(self))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM descriptions").fetchone()[0]
+
+    def _record(self, hit: bool) -> None:
+        # caller holds the lock
+        if hit:
+            self._hits += 1
+        else:
+            self._misses += 1
+        REGISTRY.incr("gen_desc_cache_total", result="hit" if hit else "miss")
+        REGISTRY.set_gauge("gen_desc_cache_hit_rate", round(self._hits / (self._hits + self._misses), 4))
+
+    def get(self, key: str) -> Optional[str]:
+        """Next cached candidate for key (round-robin), or None."""
+        with self._lock:
+            row = self._conn.execute("SELECT candidates, cursor FROM descriptions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self._record(False)
+                return None
+            candidates = json.loads(row[0])
+            self._conn.execute("UPDATE descriptions SET cursor = ?, last_used = ? WHERE key = ?",
+                               (row[1] + 1, time.time(), key))
+            self._record(True)
+            return candidates[row[1] % len(candidates)]
+
+    def put(self, key: str, candidates: List[str]) -> None:
+        """Store new candidates in front of the existing ones (deduplicated, capped)."""
+        candidates = [c for c in candidates if c]
+        if not candidates:
+            return
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT candidates FROM descriptions WHERE key = ?", (key,)).fetchone()
+            merged = []
+            for c in candidates + (json.loads(row[0]) if row else []):
+                if c not in merged:
+                    merged.append(c)
+            merged = merged[:self.variants]
+            # the cursor restarts at the newest candidate, which the caller is returning right now
+            self._conn.execute(
+                "INSERT INTO descriptions (key, candidates, cursor, created, last_used) VALUES (?, ?, 1, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET candidates = excluded.candidates, cursor = 1, last_used = excluded.last_used",
+                (key, json.dumps(merged, ensure_ascii=False), now, now),
+            )
+            self._conn.execute(
+                "DELETE FROM descriptions WHERE key IN "
+                "(SELECT key FROM descriptions ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            count = self._conn.execute("SELECT COUNT(*) FROM descriptions").fetchone()[0]
+        REGISTRY.set_gauge("gen_desc_cache_entries", count)
+
+
+_cache: Optional[DescriptionCache] = None
+_cache_failed = False
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> Optional[DescriptionCache]:
+    """Process-wide cache, or None when disabled or the file cannot be opened."""
+    global _cache, _cache_failed
+    if not GEN_DESC_CACHE or _cache_failed:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None and not _cache_failed:
+                try:
+                    _cache = DescriptionCache()
+                except Exception as e:
+                    LOG.warning("Description cache disabled, cannot open %s: %s", GEN_DESC_CACHE_PATH, e)
+                    _cache_failed = True
+    return _cache
@@ -0,0 +1,251 @@
+# ml/executors.py
+"""
+CPU budget shared by the worker pools of the ML service.
+
+ML_CPU_BUDGET (default: os.cpu_count()) is the number of cores the service as a whole
+may keep busy. Every pool asks for its size through claim_workers(), so pools created
+by different modules (color processes, ...) never add up to more than the budget.
+
+Request handling is split per workload class (search, tagging, colors, generation); see
+get_executor() below.
+"""
+import asyncio
+import heapq
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, Optional, Tuple
+
+from metrics import REGISTRY
+
+ML_CPU_BUDGET = max(1, int(os.environ.get("ML_CPU_BUDGET", os.cpu_count() or 1)))
+
+_claims: Dict[str, int] = {}
+_claims_lock = threading.Lock()
+
+
+def claim_workers(name: str, requested: int) -> int:
+    """
+    Reserve up to `requested` workers for pool `name` from what is left of the budget
+    (always at least 1). Claiming again under the same name returns the first grant.
+    """
+    with _claims_lock:
+        if name in _claims:
+            return _claims[name]
+        free = ML_CPU_BUDGET - sum(_claims.values())
+        granted = max(1, min(int(requested), free))
+        _claims[name] = granted
+        return granted
+
+
+def set_cpu_budget(cores: int) -> None:
+    """Replace the budget before any pool claims from it (serve.py splits it across worker processes)."""
+    global ML_CPU_BUDGET
+    with _claims_lock:
+        ML_CPU_BUDGET = max(1, int(cores))
+
+
+def worker_claims() -> Dict[str, int]:
+    with _claims_lock:
+        return dict(_claims, budget=ML_CPU_BUDGET)
+
+
+# ---------------------------
+# Per-workload executors
+# ---------------------------
+# Each workload class gets its own bounded set of worker threads and its own queue, so a
+# burst of heavy tagging or generation requests queues behind itself instead of taking the
+# threads cheap search requests need.
+#
+# torch's intra-op thread count is process-wide (torch.set_num_threads from any thread
+# changes it for every thread), so it cannot differ per workload. The service sets one cap,
+# ML_TORCH_THREADS (default: a quarter of the budget), at startup via apply_torch_threads();
+# every concurrently running model call gets a team of that size, so with the default about
+# four concurrent model calls fill the budget. ML_<NAME>_TORCH_THREADS only sizes the share
+# of the budget a workload claims.
+#
+# Admission control: every task may carry a deadline (monotonic seconds) and a priority.
+# Interactive tasks are dequeued before batch tasks; tasks whose deadline has passed while
+# queued are dropped instead of run; and a full queue rejects new tasks right away
+# (batch tasks are shed once the queue is half full).
+#
+# ML_<NAME>_WORKERS        concurrent requests of that workload
+# ML_<NAME>_TORCH_THREADS  cores per worker the workload claims from the budget
+# ML_<NAME>_MAX_QUEUE      queued (not yet running) requests before new ones are rejected
+WORKLOADS = ("search", "tagging", "generation", "colors")
+PRIORITIES = {"interactive": 0, "batch": 1}
+
+
+class Rejected(Exception):
+    """A task was not run: queue full, batch shed, or its deadline passed / cannot be met."""
+
+    def __init__(self, reason: str, status: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.status = status
+
+
+_local = threading.local()
+
+
+def current_deadline() -> Optional[float]:
+    """Deadline (time.monotonic() seconds) of the task running on this thread, if any."""
+    return getattr(_local, "deadline", None)
+
+
+def deadline_passed() -> bool:
+    deadline = current_deadline()
+    return deadline is not None and time.monotonic() > deadline
+
+
+def set_torch_threads(n: int) -> None:
+    """Set torch's intra-op thread count. This is process-wide: the last call wins for every thread."""
+    if n <= 0:
+        return
+    try:
+        import torch
+        torch.set_num_threads(n)
+    except Exception:
+        pass
+
+
+def torch_threads_cap() -> int:
+    return max(1, int(os.environ.get("ML_TORCH_THREADS", ML_CPU_BUDGET // 4)))
+
+
+def apply_torch_threads() -> int:
+    """Apply the process-wide torch thread cap (after set_cpu_budget in serve.py workers)."""
+    cap = torch_threads_cap()
+    set_torch_threads(cap)
+    return cap
+
+
+class WorkloadExecutor:
+    def __init__(self, name: str, workers: int, torch_threads: int, claim: Optional[int] = None, max_queue: int = 32):
+        self.name = name
+        self.workers = max(1, int(workers))
+        self.torch_threads = int(torch_threads)
+        self.max_queue = max(1, int(max_queue))
+        cores = self.workers * max(1, self.torch_threads) if claim is None else int(claim)
+        if cores > 0:
+            granted = claim_workers(name, cores)
+            if granted < cores and self.torch_threads > 0:
+                # shrink per-worker threads first, concurrency last
+                self.torch_threads = max(1, granted // self.workers)
+        # (priority, seq, deadline, enqueued, future, fn, args, kwargs)
+        self._queue: list = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._avg_run = 0.0  # EWMA of task run time, for "can this deadline still be met"
+        for i in range(self.workers):
+            threading.Thread(target=self._worker, name=f"ml-{name}-{i}", daemon=True).start()
+
+    @property
+    def pending(self) -> int:
+        """Requests submitted but not started yet."""
+        return len(self._queue)
+
+    def _shed(self, reason: str, status: int) -> Rejected:
+        REGISTRY.incr("executor_shed_total", workload=self.name, reason=reason)
+        return Rejected(reason, status)
+
+    def submit(self, fn: Callable, *args, deadline: Optional[float] = None, priority: str = "interactive", **kwargs) -> Future:
+        prio = PRIORITIES.get(priority, 0)
+        now = time.monotonic()
+        with self._cond:
+            depth = len(self._queue)
+            if prio > 0 and depth >= max(1, self.max_queue // 2):
+                raise self._shed("batch_shed", 429)
+            if depth >= self.max_queue:
+                raise self._shed("queue_full", 503)
+            if deadline is not None:
+                expected = self._avg_run * (1 + depth / self.workers)
+                if now > deadline or (self._avg_run and now + expected > deadline):
+                    raise self._shed("deadline_unreachable", 503)
+            fut: Future = Future()
+            heapq.heappush(self._queue, (prio, next(self._seq), deadline, now, fut, fn, args, kwargs))
+            REGISTRY.set_gauge("executor_queue_depth", len(self._queue), workload=self.name)
+            REGISTRY.max_gauge("executor_queue_depth_max", len(self._queue), workload=self.name)
+            self._cond.notify()
+        return fut
+
+    async def run(self, fn: Callable, *args, **kwargs):
+        """Await fn(*args, **kwargs) on this workload's threads (accepts deadline= and priority=)."""
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                _, _, deadline, enqueued, fut, fn, args, kwargs = heapq.heappop(self._queue)
+                REGISTRY.set_gauge("executor_queue_depth", len(self._queue), workload=self.name)
+            if not fut.set_running_or_notify_cancel():
+                continue
+            started = time.monotonic()
+            REGISTRY.observe("executor_queue_wait_seconds", started - enqueued, workload=self.name)
+            if deadline is not None and started > deadline:
+                # the caller has given up already; do not burn CPU on an answer nobody reads
+                fut.set_exception(self._shed("deadline", 503))
+                continue
+            _local.deadline = deadline
+            try:
+                fut.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                fut.set_exception(e)
+            finally:
+                _local.deadline = None
+                elapsed = time.monotonic() - started
+                self._avg_run = elapsed if not self._avg_run else 0.8 * self._avg_run + 0.2 * elapsed
+                REGISTRY.observe("executor_run_seconds", elapsed, workload=self.name)
+
+    def stats(self) -> Dict[str, int]:
+        return {"workers": self.workers, "torch_threads": self.torch_threads,
+                "pending": len(self._queue), "max_queue": self.max_queue}
+
+
+def workload_defaults(name: str) -> Tuple[int, int, Optional[int], int]:
+    """
+    (workers, torch threads, cores claimed from the budget, max queue) for a workload.
+    Computed from the budget at call time, so set_cpu_budget() in a forked worker applies.
+    """
+    quarter = max(1, ML_CPU_BUDGET // 4)
+    return {
+        "search": (2, 1, None, 64),
+        "tagging": (1, quarter, None, 8),
+        # requests mostly wait on the generation batcher, whose single thread does the compute
+        "generation": (4, quarter, quarter, 32),
+        # the CPU work runs in the color process pool, which claims its own share
+        "colors": (2, 1, 0, 8),
+    }.get(name, (1, 0, None, 32))
+
+
+_executors: Dict[str, WorkloadExecutor] = {}
+_executors_lock = threading.Lock()
+
+
+def _workload_env(name: str, key: str, default) -> int:
+    return int(os.environ.get(f"ML_{name.upper()}_{key}", default))
+
+
+def workload_torch_threads(name: str) -> int:
+    """Cores per worker a workload claims from the budget (not applied to torch, see above)."""
+    return _workload_env(name, "TORCH_THREADS", workload_defaults(name)[1])
+
+
+def get_executor(name: str) -> WorkloadExecutor:
+    with _executors_lock:
+        ex = _executors.get(name)
+        if ex is None:
+            workers, _, claim, max_queue = workload_defaults(name)
+            ex = WorkloadExecutor(name, _workload_env(name, "WORKERS", workers), workload_torch_threads(name),
+                                  claim=claim, max_queue=_workload_env(name, "MAX_QUEUE", max_queue))
+            _executors[name] = ex
+        return ex
+
+
+def executor_stats() -> Dict[str, Dict[str, int]]:
+    with _executors_lock:
+        return {name: ex.stats() for name, ex in _executors.items()}
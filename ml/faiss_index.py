@@ -1,8 +1,10 @@
 import os
 import json
 import time
+import shutil
 import datetime
 import logging
+from contextlib import contextmanager
 import numpy as np
 import faiss
 from pymongo import MongoClient
@@ -11,6 +13,14 @@ from sentence_transformers import SentenceTransformer
 from tqdm import tqdm
 import pytz
 
+try:
+    import fcntl
+except ImportError:  # Windows: single-process use only
+    fcntl = None
+
+from color_index import ColorIndex, listing_palette
+from metrics import REGISTRY
+
 try:
     from dotenv import load_dotenv
     load_dotenv(dotenv_path='../backend/.env')
@@ -28,6 +38,15 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 TEXT_EMBED_MODEL = os.environ.get("TEXT_EMBED_MODEL", "all-MiniLM-L6-v2")
+# images per listing that go into the listing's CLIP embedding (image index)
+IMAGE_INDEX_MAX_IMAGES = int(os.environ.get("IMAGE_INDEX_MAX_IMAGES", "3"))
+# listings whose images are downloaded and encoded together during a rebuild
+IMAGE_INDEX_BATCH = int(os.environ.get("IMAGE_INDEX_BATCH", "32"))
+# every persist writes a new snapshot <data_dir>/snapshots/<version>/ and then points
+# <data_dir>/CURRENT at it, so readers in other processes never see a half-written index
+INDEX_SNAPSHOTS_KEEP = int(os.environ.get("INDEX_SNAPSHOTS_KEEP", "3"))
+# memory-map persisted indexes read-only, so worker processes share one copy in the page cache
+INDEX_MMAP = os.environ.get("INDEX_MMAP", "1") == "1"
 
 # ==========================================================
 #                 FAISS TEXT INDEXER (UPGRADED)
@@ -38,8 +57,15 @@ class FaissTextIndexer:
         db_name,
         collection_name,
         data_dir,
-        mongo_uri=None
+        mongo_uri=None,
+        image_embedder=None,
+        text_model=None
     ):
+        """
+        image_embedder: optional object with `model_name` and `embed_image_uris(uris) -> np.ndarray | None`
+        (ClipTagger). When attached, rebuild/sync also maintain a CLIP image index over the same ids.
+        text_model: an already loaded TEXT_EMBED_MODEL SentenceTransformer to share instead of loading another.
+        """
         # SECURITY: Get MongoDB URI from environment variable
         if mongo_uri is None:
             mongo_uri = os.environ.get("MONGO_URI")
@@ -47,28 +73,41 @@ class FaissTextIndexer:
                 raise ValueError("MONGO_URI environment variable is required. Set it in your .env file.")
 
         # MongoDB
-        self.client = MongoClient(mongo_uri)
-        self.db = self.client[db_name]
-        self.collection = self.db[collection_name]
+        self._mongo = (mongo_uri, db_name, collection_name)
+        self.reconnect()
 
-        # Paths
+        # Paths: the published snapshot, or the flat files written before snapshots existed (version 0)
         self.ml_data_dir = data_dir
         os.makedirs(self.ml_data_dir, exist_ok=True)
-
-        self.index_path = os.path.join(self.ml_data_dir, "index.faiss")
-        self.meta_path = os.path.join(self.ml_data_dir, "meta.json")
+        self.snapshots_dir = os.path.join(self.ml_data_dir, "snapshots")
+        self.current_path = os.path.join(self.ml_data_dir, "CURRENT")
+        self.version = self.published_version()
+        self._set_paths(self._snapshot_dir(self.version) if self.version else self.ml_data_dir)
+        self._mapped = False
 
         # Transform model
-        logger.info("Loading SentenceTransformer model...")
-        model_path = os.environ.get('HF_HOME', './model_cache')
-        self.model = SentenceTransformer("sentence-transformers/" + TEXT_EMBED_MODEL, cache_folder=model_path)
+        if text_model is not None:
+            self.model = text_model
+        else:
+            logger.info("Loading SentenceTransformer model...")
+            model_path = os.environ.get('HF_HOME', './model_cache')
+            self.model = SentenceTransformer("sentence-transformers/" + TEXT_EMBED_MODEL, cache_folder=model_path)
 
         # Load or create index
         self.index = self._load_or_create()
         self.id_to_meta = self._load_meta()
 
+        # "shop by color": palettes persisted in meta.json, bucketed in Lab in memory
+        self.color_index = self._build_color_index(self.id_to_meta)
+
         self.dim = None  # will be set when building embeddings
 
+        # CLIP image index (same faiss ids as the text index), tied to the model that built it
+        self.image_embedder = None
+        self.image_index, self.image_model = self._load_image_index()
+        if image_embedder is not None:
+            self.attach_image_embedder(image_embedder)
+
 
     # ==========================================================
     #            HELPER FUNCTIONS
@@ -76,11 +115,76 @@ class FaissTextIndexer:
     def _faiss_id(self, oid):
         return int(str(oid), 16) % (2**63 - 1)
 
+    def reconnect(self):
+        """(Re)open the MongoDB client; a forked worker must not reuse its parent's connections."""
+        mongo_uri, db_name, collection_name = self._mongo
+        self.client = MongoClient(mongo_uri)
+        self.db = self.client[db_name]
+        self.collection = self.db[collection_name]
+
+    def _set_paths(self, directory):
+        self.index_path = os.path.join(directory, "index.faiss")
+        self.meta_path = os.path.join(directory, "meta.json")
+        self.image_index_path = os.path.join(directory, "image_index.faiss")
+        self.image_info_path = os.path.join(directory, "image_index.json")
+
+    def _snapshot_dir(self, version):
+        return os.path.join(self.snapshots_dir, str(version))
+
+    @contextmanager
+    def _snapshot_lock(self):
+        """Exclusive lock on the data dir, so processes publishing at once pick distinct versions."""
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.ml_data_dir, ".snapshot.lock"), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def published_version(self):
+        """Version named by CURRENT (0 when nothing has been published as a snapshot yet)."""
+        try:
+            with open(self.current_path, "r", encoding="utf-8") as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def _snapshot_versions(self):
+        if not os.path.isdir(self.snapshots_dir):
+            return []
+        return sorted(int(name) for name in os.listdir(self.snapshots_dir) if name.isdigit())
+
+    def _read_index(self, path):
+        """Read a persisted index, memory-mapped read-only when INDEX_MMAP is set and faiss supports it."""
+        if INDEX_MMAP:
+            # IO_FLAG_MMAP_IFC (newer faiss) maps flat codes too; older versions only map IVF lists
+            flag = getattr(faiss, "IO_FLAG_MMAP_IFC", None) or faiss.IO_FLAG_MMAP
+            try:
+                index = faiss.read_index(path, flag | faiss.IO_FLAG_READ_ONLY)
+                self._mapped = True
+                return index
+            except Exception as e:
+                logger.debug("mmap read of %s failed, reading into memory: %s", path, e)
+        return faiss.read_index(path)
+
+    def _ensure_writable(self):
+        """Incremental updates need private in-memory copies of memory-mapped indexes."""
+        if not self._mapped:
+            return
+        if self.index is not None and os.path.exists(self.index_path):
+            self.index = faiss.read_index(self.index_path)
+        if self.image_index is not None and os.path.exists(self.image_index_path):
+            self.image_index = faiss.read_index(self.image_index_path)
+        self._mapped = False
+
     def _load_or_create(self):
         if os.path.exists(self.index_path):
             try:
-                logger.info("Loading existing FAISS index...")
-                return faiss.read_index(self.index_path)
+                logger.info("Loading existing FAISS index from %s...", self.index_path)
+                return self._read_index(self.index_path)
             except Exception as e:
                 logger.warning("Failed to load FAISS index: %s", e)
 
@@ -96,17 +200,100 @@ class FaissTextIndexer:
                 logger.warning("Failed to load meta.json: %s", e)
         return {}
 
+    def _load_image_index(self):
+        if not os.path.exists(self.image_index_path):
+            return None, None
+        try:
+            with open(self.image_info_path, "r", encoding="utf-8") as f:
+                info = json.load(f)
+            logger.info("Loading existing image FAISS index (%s)...", info.get("model"))
+            return self._read_index(self.image_index_path), info.get("model")
+        except Exception as e:
+            logger.warning("Failed to load image FAISS index: %s", e)
+            return None, None
+
+    def _build_color_index(self, id_to_meta):
+        color_index = ColorIndex()
+        color_index.build((int(fid), meta.get("palette")) for fid, meta in id_to_meta.items())
+        return color_index
+
+    def attach_image_embedder(self, embedder):
+        """Attach the CLIP embedder; an image index built by a different model is dropped until the next rebuild."""
+        self.image_embedder = embedder
+        model = getattr(embedder, "model_name", None)
+        if self.image_index is not None and self.image_model != model:
+            logger.warning("Image index was built with %s, embedder is %s. Ignoring it until rebuild.", self.image_model, model)
+            self.image_index = None
+        self.image_model = model
+
     def _persist(self):
+        """Write the index as a new snapshot, then publish it by atomically replacing CURRENT."""
         if self.index is None:
             return
         try:
-            faiss.write_index(self.index, self.index_path)
-            with open(self.meta_path, "w", encoding="utf-8") as f:
-                json.dump(self.id_to_meta, f, ensure_ascii=False, indent=2)
-            logger.info("Saved FAISS index + metadata.")
+            # choosing the version, writing, publishing and pruning happen under one lock: two
+            # workers persisting at once would otherwise write the same version and prune each other
+            with self._snapshot_lock():
+                version = max([self.published_version(), self.version] + self._snapshot_versions()) + 1
+                final = self._snapshot_dir(version)
+                tmp = f"{final}.tmp{os.getpid()}"
+                shutil.rmtree(tmp, ignore_errors=True)
+                os.makedirs(tmp)
+                faiss.write_index(self.index, os.path.join(tmp, "index.faiss"))
+                with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+                    json.dump(self.id_to_meta, f, ensure_ascii=False, indent=2)
+                if self.image_index is not None:
+                    faiss.write_index(self.image_index, os.path.join(tmp, "image_index.faiss"))
+                    with open(os.path.join(tmp, "image_index.json"), "w", encoding="utf-8") as f:
+                        json.dump({"model": self.image_model, "dim": self.image_index.d, "ntotal": self.image_index.ntotal}, f)
+                os.rename(tmp, final)
+
+                self._set_paths(final)
+                self.version = version
+                with open(self.current_path + ".tmp", "w", encoding="utf-8") as f:
+                    f.write(str(version))
+                os.replace(self.current_path + ".tmp", self.current_path)
+                self._prune_snapshots()
+            logger.info("Saved FAISS index + metadata as snapshot %d.", version)
         except Exception as e:
             logger.error("Persist failed: %s", e)
 
+    def _prune_snapshots(self):
+        # unlinking is safe for workers that still map an old snapshot: their pages stay valid
+        keep = max(1, INDEX_SNAPSHOTS_KEEP)
+        for version in self._snapshot_versions()[:-keep]:
+            if version != self.version:
+                shutil.rmtree(self._snapshot_dir(version), ignore_errors=True)
+
+    def reload_if_changed(self):
+        """
+        Switch to the published snapshot if another process (or the CLI rebuild) published a
+        newer one. Returns True when the index was reloaded.
+        """
+        version = self.published_version()
+        if version == self.version:
+            return False
+        previous = (self.index_path, self.meta_path, self.image_index_path, self.image_info_path)
+        self._set_paths(self._snapshot_dir(version))
+        index = self._load_or_create()
+        if index is None:
+            self.index_path, self.meta_path, self.image_index_path, self.image_info_path = previous
+            return False
+        id_to_meta = self._load_meta()
+        color_index = self._build_color_index(id_to_meta)
+        image_index, image_model = self._load_image_index()
+        model = getattr(self.image_embedder, "model_name", None)
+        if self.image_embedder is not None and image_index is not None and image_model != model:
+            logger.warning("Image index of snapshot %d was built with %s, embedder is %s. Ignoring it.", version, image_model, model)
+            image_index = None
+
+        # searches read these attributes without a lock; each assignment is atomic
+        self.index, self.id_to_meta, self.color_index = index, id_to_meta, color_index
+        self.image_index, self.image_model = image_index, model or image_model
+        self.version = version
+        logger.info("Reloaded FAISS index snapshot %d (ntotal=%d).", version, index.ntotal)
+        return True
+
     def _normalize(self, vecs):
         norms = np.linalg.norm(vecs, axis=1, keepdims=True)
         norms[norms == 0] = 1.0
@@ -121,6 +308,45 @@ class FaissTextIndexer:
             return ""
         return str(value)
 
+    def _image_urls(self, doc):
+        """Listing image URLs, preferring the same size the draft tagging flow sends (hi_res > large > thumb)."""
+        urls = []
+        for img in doc.get("images") or []:
+            if isinstance(img, str):
+                url = img
+            elif isinstance(img, dict):
+                url = img.get("hi_res") or img.get("large") or img.get("thumb") or img.get("url")
+            else:
+                url = None
+            if url:
+                urls.append(url)
+            if len(urls) >= IMAGE_INDEX_MAX_IMAGES:
+                break
+        return urls
+
+    def _embed_images(self, doc):
+        if self.image_embedder is None:
+            return None
+        urls = self._image_urls(doc)
+        if not urls:
+            return None
+        try:
+            return self.image_embedder.embed_image_uris(urls)
+        except Exception as e:
+            logger.error("Image embedding failed for %s: %s", doc.get("_id"), e)
+            return None
+
+    def _embed_images_many(self, docs):
+        """_embed_images for several listings; embedders with embed_image_uri_lists fetch and encode them together."""
+        embed_lists = getattr(self.image_embedder, "embed_image_uri_lists", None)
+        if embed_lists is None:
+            return [self._embed_images(doc) for doc in docs]
+        try:
+            return embed_lists([self._image_urls(doc) for doc in docs])
+        except Exception as e:
+            logger.error("Image embedding failed for %d listings: %s", len(docs), e)
+            return [None] * len(docs)
+
     def _to_ist(self, dt):
         if not dt:
             return ""
@@ -156,6 +382,22 @@ class FaissTextIndexer:
 
         return ""
 
+    def iter_texts(self, fields=("title", "description"), chunk_size=1000):
+        """Yield lists of listing texts (the given fields joined) in chunks, streaming from MongoDB."""
+        projection = {f: 1 for f in fields}
+        projection["_id"] = 0
+        cursor = self.collection.find({}, projection, batch_size=chunk_size)
+        chunk = []
+        for doc in cursor:
+            text = ". ".join(p for p in (self._flatten(doc.get(f)) for f in fields) if p.strip())
+            if text:
+                chunk.append(text)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
     # NEW: Write embedding data back to MongoDB
     def _update_mongo_embedding_info(self, listing_id, faiss_id, created_at):
         try:
@@ -195,6 +437,7 @@ class FaissTextIndexer:
                 "images": 1,
                 "details": 1,
                 "parent_asin": 1,
+                "detected_colors": 1,
                 "updatedAt": 1
             }
         )
@@ -246,6 +489,7 @@ class FaissTextIndexer:
                 "images": doc.get("images", []),
                 "details": doc.get("details", {}),
                 "parent_asin": self._flatten(doc.get("parent_asin")),
+                "palette": listing_palette(doc),
                 "updatedAt": str(self._to_ist(doc.get("updatedAt"))),
                 "faiss_vector_id": fid,
                 "embedding_created_at": created_at
@@ -278,15 +522,38 @@ class FaissTextIndexer:
         logger.info("FAISS index built with %d vectors", self.index.ntotal)
 
         self.id_to_meta = {str(meta["faiss_vector_id"]): meta for meta in metas}
+        self.color_index = self._build_color_index(self.id_to_meta)
+        self._rebuild_image_index(docs, ids)
         self._persist()
 
         logger.info("TOTAL REBUILD TIME: %.2f minutes", (time.time() - total_start) / 60)
 
 
+    def _rebuild_image_index(self, docs, ids):
+        if self.image_embedder is None:
+            return
+        img_ids, img_vecs = [], []
+        for start in tqdm(range(0, len(docs), IMAGE_INDEX_BATCH), desc="Image embeddings", ncols=100):
+            vecs = self._embed_images_many(docs[start:start + IMAGE_INDEX_BATCH])
+            for fid, vec in zip(ids[start:start + IMAGE_INDEX_BATCH], vecs):
+                if vec is not None:
+                    img_ids.append(fid)
+                    img_vecs.append(vec)
+        if not img_vecs:
+            logger.warning("No listing images could be embedded; image index left empty.")
+            self.image_index = None
+            return
+        vecs = self._normalize(np.vstack(img_vecs).astype("float32"))
+        self.image_index = faiss.IndexIDMap(faiss.IndexFlatIP(vecs.shape[1]))
+        self.image_index.add_with_ids(vecs, np.array(img_ids, dtype="int64"))
+        logger.info("Image FAISS index built with %d vectors (%s)", self.image_index.ntotal, self.image_model)
+
+
     # ==========================================================
     #                    INCREMENTAL OPERATIONS
     # ==========================================================
     def add_listing(self, doc):
+        self._ensure_writable()
         text = " ".join([
             self._flatten(doc.get("title")),
             self._flatten(doc.get("description"))
@@ -306,27 +573,43 @@ class FaissTextIndexer:
 
         self.index.add_with_ids(vec, np.array([fid], dtype="int64"))
 
+        img_vec = self._embed_images(doc)
+        if img_vec is not None:
+            img_vec = self._normalize(img_vec.reshape(1, -1).astype("float32"))
+            if self.image_index is None:
+                self.image_index = faiss.IndexIDMap(faiss.IndexFlatIP(img_vec.shape[1]))
+            self.image_index.add_with_ids(img_vec, np.array([fid], dtype="int64"))
+
         created_at = str(self._to_ist(datetime.datetime.now(datetime.UTC)))
 
         self.id_to_meta[str(fid)] = {
             "listing_id": str(doc["_id"]),
             "title": doc.get("title"),
             "description": doc.get("description"),
+            "palette": listing_palette(doc),
             "updatedAt": str(self._to_ist(doc.get("updatedAt"))),
             "faiss_vector_id": fid,
             "embedding_created_at": created_at
         }
+        self.color_index.add(fid, self.id_to_meta[str(fid)]["palette"])
 
         # NEW: write to MongoDB
         self._update_mongo_embedding_info(doc["_id"], fid, created_at)
 
     def remove_listing(self, listing_id):
+        self._ensure_writable()
         fid = self._faiss_id(listing_id)
         try:
             self.index.remove_ids(np.array([fid], dtype="int64"))
         except Exception as e:
             logger.debug("remove_ids failed for %s: %s", fid, e)
+        if self.image_index is not None:
+            try:
+                self.image_index.remove_ids(np.array([fid], dtype="int64"))
+            except Exception as e:
+                logger.debug("image remove_ids failed for %s: %s", fid, e)
         self.id_to_meta.pop(str(fid), None)
+        self.color_index.remove(fid)
 
     def update_listing(self, doc):
         self.remove_listing(doc["_id"])
@@ -431,7 +714,8 @@ class FaissTextIndexer:
                 q = q.reshape(1, -1)
             q = self._normalize(q.astype("float32"))
 
-        scores, ids = self.index.search(q, k)
+        with REGISTRY.timer("stage_seconds", stage="index.search", index="text"):
+            scores, ids = self.index.search(q, k)
 
         results = []
         for score, doc_id in zip(scores[0], ids[0]):
@@ -443,6 +727,54 @@ class FaissTextIndexer:
 
         return results
 
+    def search_images(self, query, k=5):
+        """Search the CLIP image index with a CLIP image or text embedding (numpy vector)."""
+        if self.image_index is None or self.image_index.ntotal == 0:
+            return []
+
+        q = query
+        if not isinstance(q, np.ndarray):
+            q = np.array(q, dtype="float32")
+        if len(q.shape) == 1:
+            q = q.reshape(1, -1)
+        q = self._normalize(q.astype("float32"))
+
+        with REGISTRY.timer("stage_seconds", stage="index.search", index="image"):
+            scores, ids = self.image_index.search(q, k)
+
+        results = []
+        for score, doc_id in zip(scores[0], ids[0]):
+            meta = self.id_to_meta.get(str(doc_id))
+            if meta:
+                item = dict(meta)
+                item["score"] = float(score)
+                results.append(item)
+
+        return results
+
+    def search_by_color(self, query_labs, k=10, max_delta_e=None, candidate_ids=None):
+        """
+        Listings whose palette is close to the query colors (qx3 Lab). With candidate_ids,
+        only those listings are scored (used to re-rank text search results by color).
+        """
+        kwargs = {} if max_delta_e is None else {"max_delta_e": max_delta_e}
+        if candidate_ids is not None:
+            scored = self.color_index.score(query_labs, candidate_ids, **kwargs)
+            hits = sorted(scored.items(), key=lambda kv: -kv[1])
+        else:
+            with REGISTRY.timer("stage_seconds", stage="index.search", index="color"):
+                hits = self.color_index.search(query_labs, k=k, **kwargs)
+
+        results = []
+        for doc_id, score in hits:
+            meta = self.id_to_meta.get(str(doc_id))
+            if meta:
+                item = dict(meta)
+                item["color_score"] = float(score)
+                results.append(item)
+
+        return results
+
 # ==========================================================
 #                 MANUAL REBUILD
 # ==========================================================
@@ -16,6 +16,20 @@ Environment variables (optional):
 - GEN_DESC_FEATURE_LIMIT (default: 12)
 - GEN_DESC_MIN_CHARS (default: 60)
 - GEN_DESC_NUM_CANDIDATES (default: 3)
+- GEN_DESC_BACKEND (default: "torch"; "int8" or "onnx", see t5_backends.py)
+- GEN_DESC_PROMPT_VARIANT (default: "full"; "compact" = shorter instructions, one example)
+- GEN_DESC_RETRY_MODE (default: "reuse") when no first-pass candidate passes: "reuse" decodes
+  single extra samples from the first pass' encoder outputs until one passes; "strict" runs a
+  second full generation with the strict prompt
+- GEN_DESC_RETRY_SAMPLES (default: 4) extra samples the reuse path may decode
+- GEN_STREAM_TIMEOUT (default: 120) seconds to wait for the next streamed event
+- GEN_DESC_CACHE / GEN_DESC_CACHE_PATH / ... persistent result cache, see description_cache.py
+- GEN_BACKFILL_CHECKPOINT (default: $ML_DATA_DIR/description_backfill.json) resume point of --backfill
+  (POST /backfill_descriptions runs the same job inside the service at batch priority)
+- GEN_BATCHING (default: 1) queue concurrent prompts and run them through one generate call
+- GEN_BATCH_MAX_SIZE (default: 8) prompts per batch
+- GEN_BATCH_TOKEN_BUDGET (default: 4096) padded encoder tokens per batch
+- GEN_BATCH_WAIT_MS (default: 15) how long the first queued prompt waits for company
 
 Notes:
 - This file is CPU-first. If you install torch and transformers, it will
@@ -24,10 +38,21 @@ Notes:
 """
 from dotenv import load_dotenv
 import os
+import json
 import time
+import datetime
 import logging
+import queue
 import re
-from typing import List, Optional, Union
+import threading
+from concurrent.futures import Future
+from functools import lru_cache, partial
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+from metrics import REGISTRY, SIZE_BUCKETS
+from t5_backends import GEN_BACKEND, T5_BACKENDS, load_t5_model
+from description_cache import cache_key, get_cache
+from executors import Rejected, current_deadline, deadline_passed
 
 # optional deps
 try:
@@ -37,9 +62,15 @@ except Exception:
 
 try:
     from transformers import T5Tokenizer, T5ForConditionalGeneration
+    from transformers import StoppingCriteria, StoppingCriteriaList, TextStreamer
+    from transformers.modeling_outputs import BaseModelOutput
 except Exception:
     T5Tokenizer = None
     T5ForConditionalGeneration = None
+    StoppingCriteria = None
+    StoppingCriteriaList = None
+    TextStreamer = None
+    BaseModelOutput = None
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("gen_desc")
@@ -56,6 +87,19 @@ _FEATURE_LIMIT = int(os.getenv("GEN_DESC_FEATURE_LIMIT", "12"))
 _TOKENIZER_MAX_LENGTH = int(os.getenv("GEN_DESC_TOKENIZER_MAX_LEN", "512"))
 MIN_CHARS = int(os.getenv("GEN_DESC_MIN_CHARS", "60"))
 NUM_CANDIDATES = int(os.getenv("GEN_DESC_NUM_CANDIDATES", "3"))
+PROMPT_VARIANTS = ("full", "compact")
+PROMPT_VARIANT = os.getenv("GEN_DESC_PROMPT_VARIANT", "full").lower()
+RETRY_MODE = os.getenv("GEN_DESC_RETRY_MODE", "reuse").lower()
+RETRY_SAMPLES = int(os.getenv("GEN_DESC_RETRY_SAMPLES", "4"))
+GEN_STREAM_TIMEOUT = float(os.getenv("GEN_STREAM_TIMEOUT", "120"))
+BACKFILL_CHECKPOINT = os.getenv(
+    "GEN_BACKFILL_CHECKPOINT", os.path.join(os.environ.get("ML_DATA_DIR") or ".", "description_backfill.json"))
+BACKFILL_RETRY_S = 1.0
+GEN_BATCHING = os.getenv("GEN_BATCHING", "1") == "1"
+GEN_BATCH_MAX_SIZE = int(os.getenv("GEN_BATCH_MAX_SIZE", "8"))
+GEN_BATCH_TOKEN_BUDGET = int(os.getenv("GEN_BATCH_TOKEN_BUDGET", "4096"))
+GEN_BATCH_WAIT_MS = float(os.getenv("GEN_BATCH_WAIT_MS", "15"))
+REGISTRY.set_buckets("gen_batch_size", SIZE_BUCKETS)
 
 CACHE_DIR = os.environ.get("HF_HOME", "./model_cache")
 os.makedirs(CACHE_DIR, exist_ok=True)
@@ -67,6 +111,8 @@ os.environ["HF_HOME"] = CACHE_DIR
 # lazy globals
 _local_tokenizer = None
 _local_model = None
+_local_backend = None
+_init_lock = threading.Lock()
 
 # ----------------------
 # Utility functions
@@ -85,7 +131,15 @@ def _init_local_model(model_name: str = DEFAULT_MODEL):
     Load tokenizer & model with defensive CPU-only strategy.
     Returns (tokenizer, model) or (None, None) if not available.
     """
-    global _local_tokenizer, _local_model
+    if _local_model is not None and _local_tokenizer is not None:
+        return _local_tokenizer, _local_model
+    # concurrent first requests wait for one load instead of each loading the model
+    with _init_lock:
+        return _load_local_model(model_name)
+
+
+def _load_local_model(model_name: str):
+    global _local_tokenizer, _local_model, _local_backend
     if _local_model is not None and _local_tokenizer is not None:
         return _local_tokenizer, _local_model
 
@@ -100,25 +154,57 @@ def _init_local_model(model_name: str = DEFAULT_MODEL):
         logger.exception("Failed to load tokenizer: %s", e)
         return None, None
 
+    backend = GEN_BACKEND if GEN_BACKEND in T5_BACKENDS else "torch"
     try:
-        logger.info("Loading model (CPU) for: %s", model_name)
-        # Prefer a safe CPU load; do not assume GPU availability.
-        model = T5ForConditionalGeneration.from_pretrained(model_name, cache_dir=CACHE_DIR)
-        # Move to CPU explicitly if torch and the model support it
+        logger.info("Loading model (CPU, %s backend) for: %s", backend, model_name)
         try:
-            device = torch.device("cpu")
-            model.to(device)
-        except Exception:
-            # best-effort; ignore if cannot move
-            pass
+            model = load_t5_model(model_name, CACHE_DIR, backend)
+        except Exception as e:
+            if backend == "torch":
+                raise
+            logger.exception("Failed to load %s backend (%s); falling back to torch fp32.", backend, e)
+            REGISTRY.incr("gen_backend_fallbacks_total", backend=backend)
+            backend = "torch"
+            model = load_t5_model(model_name, CACHE_DIR, backend)
         _local_tokenizer = tokenizer
         _local_model = model
+        _local_backend = backend
         logger.info("Local model loaded.")
         return _local_tokenizer, _local_model
     except Exception as e:
         logger.exception("Failed to load model: %s", e)
         return None, None
 
+
+def load_model(model_name: str = DEFAULT_MODEL) -> bool:
+    """Load the model without running it (serve.py loads it before forking workers). False if unavailable."""
+    return _init_local_model(model_name)[1] is not None
+
+
+def warmup(model_name: str = DEFAULT_MODEL) -> bool:
+    """
+    Load the model eagerly and run one short generation (and the batcher) so the first
+    request does not pay for loading or first-call overhead. Returns False if unavailable.
+    """
+    tokenizer, model = _init_local_model(model_name)
+    if tokenizer is None or model is None:
+        return False
+    ids = compile_prompt(tokenizer, "Handmade ceramic mug", ["Stoneware"], "Kitchen", None)
+    _generate_batch_ids(tokenizer, model, [ids], _gen_kwargs(tokenizer, 8, TEMPERATURE, TOP_P, 1))
+    if GEN_BATCHING:
+        get_batcher(model_name)
+    return True
+
+
+def loaded_backend() -> Optional[str]:
+    """Backend of the loaded description model (None until it is loaded)."""
+    return _local_backend
+
+
+def loaded_model():
+    """The loaded description model (None until it is loaded)."""
+    return _local_model
+
 # ----------------------
 # Prompt building & sanitize
 # ----------------------
@@ -173,49 +259,97 @@ _FEW_SHOT = [
     }
 ]
 
-def _build_prompt(title: str,
-                  features: Optional[List[str]] = None,
-                  category: Optional[str] = None,
-                  tone: Optional[str] = None,
-                  strict: bool = False) -> str:
-    features = features or []
-    inst = [
-        "Instruction: Write a concise e-commerce product description based on the product information below.",
-        "- Output only the description (no headings, labels, or bullet lists).",
-        "- DO NOT repeat the input labels ('Title', 'Category', 'Features') or copy features verbatim.",
-        "- Paraphrase each feature and clearly explain the user benefit.",
-        f"- Produce 1–3 short sentences (or up to {MAX_LINES} short lines). Keep it suitable for a product listing.",
-    ]
+def _example_block(ex: dict) -> str:
+    ex_feats = "\n".join(f"- {f}" for f in ex["features"])
+    return f"Example Input:\nTitle: {ex['title']}\nCategory: {ex['category']}\nFeatures:\n{ex_feats}\nTone: {ex['tone']}\nExample Output: {ex['example']}"
+
+
+@lru_cache(maxsize=128)
+def _prompt_prefix(tone: Optional[str], strict: bool, variant: str) -> str:
+    """
+    Everything in the prompt before the product information. It only depends on
+    (tone, strict, variant), so it is built once per combination.
+    """
+    if variant == "compact":
+        inst = [
+            "Instruction: Write a short product description for an online listing.",
+            "- Output only the description. Do not copy the input or its labels.",
+            "- Explain the benefit of each feature in 1-3 sentences.",
+        ]
+        examples = _FEW_SHOT[:1]
+    else:
+        inst = [
+            "Instruction: Write a concise e-commerce product description based on the product information below.",
+            "- Output only the description (no headings, labels, or bullet lists).",
+            "- DO NOT repeat the input labels ('Title', 'Category', 'Features') or copy features verbatim.",
+            "- Paraphrase each feature and clearly explain the user benefit.",
+            f"- Produce 1–3 short sentences (or up to {MAX_LINES} short lines). Keep it suitable for a product listing.",
+        ]
+        examples = _FEW_SHOT
     if tone:
         inst.append(f"- Tone: {tone}.")
     if strict:
         inst.append("- STRICT: If your output contains verbatim input text, rewrite to remove it.")
 
     instruction_text = "\n".join(inst)
+    examples_text = "\n\n".join(_example_block(ex) for ex in examples)
+    return instruction_text + "\n\n" + examples_text + "\n\n" + "Product information:\n"
 
-    # Attach few-shot examples
-    examples = []
-    for ex in _FEW_SHOT:
-        ex_feats = "\n".join(f"- {f}" for f in ex["features"])
-        examples.append(
-            f"Example Input:\nTitle: {ex['title']}\nCategory: {ex['category']}\nFeatures:\n{ex_feats}\nTone: {ex['tone']}\nExample Output: {ex['example']}"
-        )
-    examples_text = "\n\n".join(examples)
 
-    # Product info
+def _prompt_suffix(title: str, features: Optional[List[str]], category: Optional[str]) -> str:
     parts = []
     parts.append(f"Title: {title.strip()}" if title else "Title: ")
     if category:
         parts.append(f"Category: {category.strip()}")
     if features:
         parts.append("Features:\n" + "\n".join(f"- {f}" for f in features))
-    info = "\n".join(parts)
+    return "\n".join(parts) + "\n\nOutput:"
+
 
-    prompt = instruction_text + "\n\n" + examples_text + "\n\n" + "Product information:\n" + info + "\n\nOutput:"
+def _resolve_variant(variant: Optional[str]) -> str:
+    variant = (variant or PROMPT_VARIANT).lower()
+    return variant if variant in PROMPT_VARIANTS else "full"
+
+
+def _build_prompt(title: str,
+                  features: Optional[List[str]] = None,
+                  category: Optional[str] = None,
+                  tone: Optional[str] = None,
+                  strict: bool = False,
+                  variant: Optional[str] = None) -> str:
+    tone = tone.strip() if tone else None
+    prompt = _prompt_prefix(tone, strict, _resolve_variant(variant)) + _prompt_suffix(title, features or [], category)
     if len(prompt) > 12000:
         prompt = prompt[:12000]
     return prompt
 
+
+@lru_cache(maxsize=128)
+def _prefix_ids(tokenizer, tone: Optional[str], strict: bool, variant: str) -> Tuple[int, ...]:
+    return tuple(tokenizer(_prompt_prefix(tone, strict, variant), add_special_tokens=False).input_ids)
+
+
+def compile_prompt(tokenizer,
+                   title: str,
+                   features: Optional[List[str]] = None,
+                   category: Optional[str] = None,
+                   tone: Optional[str] = None,
+                   strict: bool = False,
+                   variant: Optional[str] = None) -> List[int]:
+    """
+    Encoder input ids for a prompt: the cached prefix ids plus the freshly tokenized
+    product part, truncated like the tokenizer would (end cut, EOS kept).
+    """
+    tone = tone.strip() if tone else None
+    prefix = _prefix_ids(tokenizer, tone, strict, _resolve_variant(variant))
+    suffix = tokenizer(_prompt_suffix(title, features or [], category), add_special_tokens=False).input_ids
+    ids = list(prefix) + suffix
+    if len(ids) > _TOKENIZER_MAX_LENGTH - 1:
+        ids = ids[:_TOKENIZER_MAX_LENGTH - 1]
+    ids.append(tokenizer.eos_token_id)
+    REGISTRY.incr("gen_prompt_tokens_total", len(ids))
+    return ids
+
 # ----------------------
 # Post-processing & fallback
 # ----------------------
@@ -294,6 +428,10 @@ def _overlap_count(candidate: str, title: str, features: List[str]) -> int:
     return len(cand_words & src_words)
 
 
+def _passes_filter(text: str, overlap: int, title: str, min_chars: int = MIN_CHARS) -> bool:
+    return len(text) >= min_chars and overlap < max(1, int(0.25 * len(_words_set(title)) + 0.5))
+
+
 def _select_best_candidate(candidates: List[str], title: str, features: List[str], min_chars: int = MIN_CHARS):
     scored = []
     for c in candidates:
@@ -307,7 +445,7 @@ def _select_best_candidate(candidates: List[str], title: str, features: List[str
         return None
     scored.sort(key=lambda x: (x[0], len(x[2])), reverse=True)
     for score, overlap, text in scored:
-        if len(text) >= min_chars and overlap < max(1, int(0.25 * len(_words_set(title)) + 0.5)):
+        if _passes_filter(text, overlap, title, min_chars):
             return text
     top = scored[0]
     if len(top[2]) >= int(min_chars / 2):
@@ -315,45 +453,29 @@ def _select_best_candidate(candidates: List[str], title: str, features: List[str
     return None
 
 
-def _generate_with_local_transformers_sampling(prompt: str,
-                                               model_name: str = DEFAULT_MODEL,
-                                               max_tokens: int = MAX_TOKENS,
-                                               temperature: float = TEMPERATURE,
-                                               top_p: float = TOP_P,
-                                               num_return_sequences: int = NUM_CANDIDATES):
-    """
-    Use HuggingFace Transformers locally to sample multiple candidates.
-    Raises RuntimeError if transformers/torch aren't available or model fails to load.
-    """
-    if T5Tokenizer is None or T5ForConditionalGeneration is None or torch is None:
-        raise RuntimeError("Local Transformers / torch not available in environment.")
-    tokenizer, model = _init_local_model(model_name)
-    if tokenizer is None or model is None:
-        raise RuntimeError("Failed to initialize local model/tokenizer.")
-
-    # Tokenize (CPU tensors)
-    inputs = tokenizer(prompt, return_tensors="pt", truncation=True, max_length=_TOKENIZER_MAX_LENGTH)
-    input_ids = inputs.input_ids
-    attention_mask = inputs.attention_mask if "attention_mask" in inputs else None
-
-    # Ensure tensors on the same device as model parameters (best-effort)
+def _model_device(model):
+    """Device of the model parameters (best-effort, cpu otherwise)."""
     try:
         emb = getattr(model.get_input_embeddings(), "weight", None)
         if emb is not None and hasattr(emb, "device") and emb.device.type != "meta":
-            dev = emb.device
-            input_ids = input_ids.to(dev)
-            if attention_mask is not None:
-                attention_mask = attention_mask.to(dev)
-        else:
-            input_ids = input_ids.to("cpu")
-            if attention_mask is not None:
-                attention_mask = attention_mask.to("cpu")
+            return emb.device
     except Exception:
-        input_ids = input_ids.to("cpu")
-        if attention_mask is not None:
-            attention_mask = attention_mask.to("cpu")
+        pass
+    return "cpu"
+
+
+def _encode_prompt(tokenizer, prompt: str) -> List[int]:
+    return tokenizer(prompt, truncation=True, max_length=_TOKENIZER_MAX_LENGTH).input_ids
+
+
+class GenResult(NamedTuple):
+    texts: List[str]
+    # (1, prompt_len, d_model) encoder output of the prompt, reusable for more decoding
+    encoder_state: Optional[object] = None
 
-    gen_kwargs = {
+
+def _gen_kwargs(tokenizer, max_tokens: int, temperature: float, top_p: float, num_return_sequences: int) -> Dict:
+    return {
         "max_new_tokens": int(max_tokens),
         "do_sample": True,
         "temperature": float(temperature),
@@ -363,23 +485,259 @@ def _generate_with_local_transformers_sampling(prompt: str,
         "min_length": 12,
     }
 
+
+def _generate_batch_ids(tokenizer, model, batch_ids: List[List[int]], gen_kwargs: Dict) -> List[GenResult]:
+    """
+    One generate call for several prompts (token id lists). Prompts are right-padded with an
+    attention mask; returns num_return_sequences decoded candidates per prompt, in order,
+    with each prompt's encoder output so a retry only has to decode.
+    """
+    pad_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else 0
+    width = max(len(ids) for ids in batch_ids)
+    input_ids = torch.full((len(batch_ids), width), pad_id, dtype=torch.long)
+    attention_mask = torch.zeros((len(batch_ids), width), dtype=torch.long)
+    for i, ids in enumerate(batch_ids):
+        input_ids[i, :len(ids)] = torch.tensor(ids, dtype=torch.long)
+        attention_mask[i, :len(ids)] = 1
+    dev = _model_device(model)
+    input_ids = input_ids.to(dev)
+    attention_mask = attention_mask.to(dev)
+
     with torch.no_grad():
-        outputs = model.generate(input_ids=input_ids, attention_mask=attention_mask, **gen_kwargs)
+        with REGISTRY.timer("stage_seconds", stage="model.encoder"):
+            hidden = model.get_encoder()(input_ids=input_ids, attention_mask=attention_mask, return_dict=True).last_hidden_state
+        # generate expands encoder_outputs in place for num_return_sequences, so hand it a wrapper
+        with REGISTRY.timer("stage_seconds", stage="model.generate"):
+            outputs = model.generate(encoder_outputs=BaseModelOutput(last_hidden_state=hidden),
+                                     attention_mask=attention_mask, **gen_kwargs)
+
+    REGISTRY.incr("gen_tokens_total", int((outputs != pad_id).sum()))
+    n = int(gen_kwargs.get("num_return_sequences", 1))
+    texts = tokenizer.batch_decode(outputs, skip_special_tokens=True)
+    return [GenResult(texts[i * n:(i + 1) * n], hidden[i:i + 1, :len(ids)])
+            for i, ids in enumerate(batch_ids)]
 
-    results = []
-    for i in range(outputs.shape[0]):
-        results.append(tokenizer.decode(outputs[i], skip_special_tokens=True))
-    return results
+
+def _decode_until_accepted(tokenizer, model, encoder_state, gen_kwargs: Dict, accept, max_samples: int = RETRY_SAMPLES) -> List[str]:
+    """
+    Sample one candidate at a time from an already computed encoder output and stop at
+    the first one `accept` likes. Only the decoder runs; returns every sample drawn.
+    """
+    mask = torch.ones(encoder_state.shape[:2], dtype=torch.long, device=encoder_state.device)
+    kwargs = dict(gen_kwargs, num_return_sequences=1)
+    out = []
+    for i in range(max(1, max_samples)):
+        if i and deadline_passed():
+            break
+        with torch.no_grad(), REGISTRY.timer("stage_seconds", stage="model.generate"):
+            ids = model.generate(encoder_outputs=BaseModelOutput(last_hidden_state=encoder_state),
+                                 attention_mask=mask, **kwargs)
+        REGISTRY.incr("gen_recovery_samples_total")
+        REGISTRY.incr("gen_tokens_total", int((ids != (tokenizer.pad_token_id or 0)).sum()))
+        text = tokenizer.decode(ids[0], skip_special_tokens=True)
+        out.append(text)
+        if accept(text):
+            break
+    return out
+
+
+class _GenItem:
+    __slots__ = ("input_ids", "gen_kwargs", "key", "future", "enqueued", "deadline")
+
+    def __init__(self, input_ids: List[int], gen_kwargs: Dict):
+        self.input_ids = input_ids
+        self.gen_kwargs = gen_kwargs
+        self.key = tuple(sorted(gen_kwargs.items()))
+        self.future: Future = Future()
+        self.enqueued = time.perf_counter()
+        # deadline of the request that submitted it (see executors.current_deadline)
+        self.deadline = current_deadline()
+
+
+class GenerationBatcher:
+    """
+    Dynamic batching for concurrent description requests.
+
+    Callers submit tokenized prompts and block on the returned future; one worker thread
+    waits up to wait_ms after the oldest queued prompt for others to arrive, then runs a
+    single generate call for prompts sharing the same generation settings, as long as the
+    padded encoder input stays within token_budget (a prompt alone is always allowed).
+    """
+
+    def __init__(self, tokenizer, model, max_size: int = GEN_BATCH_MAX_SIZE,
+                 token_budget: int = GEN_BATCH_TOKEN_BUDGET, wait_ms: float = GEN_BATCH_WAIT_MS):
+        self.tokenizer = tokenizer
+        self.model = model
+        self.max_size = max(1, int(max_size))
+        self.token_budget = int(token_budget)
+        self.wait_s = max(0.0, float(wait_ms)) / 1000.0
+        self._pending: List[_GenItem] = []
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="gen-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, input_ids: List[int], gen_kwargs: Dict) -> Future:
+        item = _GenItem(input_ids, gen_kwargs)
+        with self._cond:
+            self._pending.append(item)
+            REGISTRY.max_gauge("gen_queue_depth_max", len(self._pending))
+            self._cond.notify()
+        return item.future
+
+    def generate(self, input_ids: List[int], gen_kwargs: Dict) -> GenResult:
+        return self.submit(input_ids, gen_kwargs).result()
+
+    def _take_batch(self) -> List[_GenItem]:
+        # caller holds the lock; the oldest item decides which settings run next
+        head = self._pending[0]
+        batch, width = [], 0
+        for item in self._pending:
+            if item.key != head.key:
+                continue
+            w = max(width, len(item.input_ids))
+            if batch and (len(batch) >= self.max_size or w * (len(batch) + 1) > self.token_budget):
+                break
+            batch.append(item)
+            width = w
+        taken = set(map(id, batch))
+        self._pending = [it for it in self._pending if id(it) not in taken]
+        return batch
+
+    @staticmethod
+    def _drop_expired(batch: List[_GenItem]) -> List[_GenItem]:
+        """Fail items whose request deadline passed while queued instead of generating for them."""
+        now = time.monotonic()
+        keep = []
+        for item in batch:
+            if item.deadline is not None and now > item.deadline:
+                REGISTRY.incr("executor_shed_total", workload="generation", reason="deadline")
+                item.future.set_exception(Rejected("deadline", 503))
+            else:
+                keep.append(item)
+        return keep
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                deadline = self._pending[0].enqueued + self.wait_s
+                while len(self._pending) < self.max_size:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._take_batch()
+
+            batch = self._drop_expired(batch)
+            if not batch:
+                continue
+            now = time.perf_counter()
+            for item in batch:
+                REGISTRY.observe("gen_queue_wait_seconds", now - item.enqueued)
+            tokens_before = REGISTRY.counter("gen_tokens_total")
+            try:
+                with REGISTRY.timer("gen_batch_seconds"):
+                    results = _generate_batch_ids(self.tokenizer, self.model, [it.input_ids for it in batch], batch[0].gen_kwargs)
+            except Exception as e:
+                for item in batch:
+                    item.future.set_exception(e)
+                continue
+            elapsed = time.perf_counter() - now
+            REGISTRY.incr("gen_batches_total")
+            REGISTRY.incr("gen_batch_items_total", len(batch))
+            REGISTRY.observe("gen_batch_size", len(batch))
+            REGISTRY.set_gauge("gen_batch_size_last", len(batch))
+            REGISTRY.max_gauge("gen_batch_size_max", len(batch))
+            if elapsed > 0:
+                REGISTRY.set_gauge("gen_tokens_per_second", round((REGISTRY.counter("gen_tokens_total") - tokens_before) / elapsed, 2))
+            for item, res in zip(batch, results):
+                item.future.set_result(res)
+
+
+_batcher: Optional[GenerationBatcher] = None
+_batcher_lock = threading.Lock()
+
+
+def get_batcher(model_name: str = DEFAULT_MODEL) -> Optional[GenerationBatcher]:
+    global _batcher
+    if _batcher is not None:
+        return _batcher
+    with _batcher_lock:
+        if _batcher is None:
+            tokenizer, model = _init_local_model(model_name)
+            if tokenizer is None or model is None:
+                return None
+            _batcher = GenerationBatcher(tokenizer, model)
+    return _batcher
+
+
+def _generate_with_local_transformers_sampling(prompt: Union[str, List[int]],
+                                               model_name: str = DEFAULT_MODEL,
+                                               max_tokens: int = MAX_TOKENS,
+                                               temperature: float = TEMPERATURE,
+                                               top_p: float = TOP_P,
+                                               num_return_sequences: int = NUM_CANDIDATES,
+                                               return_encoder: bool = False):
+    """
+    Use HuggingFace Transformers locally to sample multiple candidates.
+    `prompt` is the prompt text or its token ids from compile_prompt.
+    With GEN_BATCHING the prompt joins the shared batcher queue instead of running alone.
+    Returns the candidate texts, or a GenResult (texts + encoder output) with return_encoder.
+    Raises RuntimeError if transformers/torch aren't available or model fails to load.
+    """
+    if T5Tokenizer is None or T5ForConditionalGeneration is None or torch is None:
+        raise RuntimeError("Local Transformers / torch not available in environment.")
+    tokenizer, model = _init_local_model(model_name)
+    if tokenizer is None or model is None:
+        raise RuntimeError("Failed to initialize local model/tokenizer.")
+
+    input_ids = _encode_prompt(tokenizer, prompt) if isinstance(prompt, str) else list(prompt)
+    gen_kwargs = _gen_kwargs(tokenizer, max_tokens, temperature, top_p, num_return_sequences)
+
+    batcher = get_batcher(model_name) if GEN_BATCHING else None
+    if batcher is not None:
+        result = batcher.generate(input_ids, gen_kwargs)
+    else:
+        result = _generate_batch_ids(tokenizer, model, [input_ids], gen_kwargs)[0]
+    return result if return_encoder else result.texts
 
 # ----------------------
 # Public entry
 # ----------------------
+def _description_cache_key(title: str, features: List[str], category: Optional[str], tone: Optional[str],
+                           max_lines: int, variant: str) -> str:
+    return cache_key(title, features, category, tone, model=DEFAULT_MODEL, backend=GEN_BACKEND, variant=variant,
+                     max_tokens=MAX_TOKENS, temperature=TEMPERATURE, top_p=TOP_P,
+                     num_candidates=NUM_CANDIDATES, max_lines=max_lines)
+
+
+def cached_description(title: str,
+                       features: Optional[Union[List[str], str]] = None,
+                       category: Optional[str] = None,
+                       tone: Optional[str] = None,
+                       max_lines: int = MAX_LINES,
+                       prompt_variant: Optional[str] = None) -> Optional[str]:
+    """The cached description generate_description would return for these inputs, if any (no model needed)."""
+    cache = get_cache()
+    if cache is None:
+        return None
+    features_list = sanitize_features(features)
+    return cache.get(_description_cache_key(title, features_list, category, tone, max_lines, _resolve_variant(prompt_variant)))
+
+
 def generate_description(title: str,
                          features: Optional[Union[List[str], str]] = None,
                          category: Optional[str] = None,
                          tone: Optional[str] = None,
                          max_lines: int = MAX_LINES,
-                         use_model: bool = True) -> str:
+                         use_model: bool = True,
+                         prompt_variant: Optional[str] = None,
+                         fresh: bool = False) -> str:
+    """
+    Description for a product. Model results are memoized by normalized input: repeated
+    requests get the cached candidates round-robin, fresh=True always generates a new one.
+    """
     features_list = sanitize_features(features)
     logger.info("generate_description called | title='%s' | features_count=%d | category='%s' | model=%s",
                 (title or "")[:140], len(features_list), (category or "")[:60], DEFAULT_MODEL)
@@ -387,50 +745,435 @@ def generate_description(title: str,
     if not use_model:
         return _template_fallback(title, features_list, category)
 
-    prompt = _build_prompt(title or "", features_list, category, tone, strict=False)
-    logger.debug("Prompt preview: %s", prompt[:1200])
+    variant = _resolve_variant(prompt_variant)
+    cache = get_cache()
+    key = _description_cache_key(title, features_list, category, tone, max_lines, variant) if cache is not None else None
+    if cache is not None and not fresh:
+        cached = cache.get(key)
+        if cached:
+            return cached
 
-    try:
-        # Try local generation only (minimal HF usage as requested)
-        candidates = _generate_with_local_transformers_sampling(prompt, model_name=DEFAULT_MODEL, max_tokens=MAX_TOKENS, temperature=TEMPERATURE, top_p=TOP_P, num_return_sequences=NUM_CANDIDATES)
-        if not isinstance(candidates, list):
-            candidates = [str(candidates)]
+    descriptions = _generate_descriptions(title, features_list, category, tone, max_lines, variant)
+    if not descriptions:
+        return _template_fallback(title, features_list, category)
+    if cache is not None:
+        cache.put(key, descriptions)
+    return descriptions[0]
+
+
+def _finish_descriptions(first: GenResult, tokenizer, model, title: str, features_list: List[str],
+                         category: Optional[str], tone: Optional[str], max_lines: int, variant: str) -> List[str]:
+    """Select from first-pass candidates, recovering (reuse or strict mode) when none passes."""
+    candidates = list(first.texts)
 
-        cleaned_candidates = [_strip_echo_lines(c) for c in candidates]
-        best = _select_best_candidate(cleaned_candidates, title or "", features_list, min_chars=MIN_CHARS)
-        if best:
-            final = _post_process_description(best, max_lines=max_lines)
-            if final and len(final.strip()) >= 30:
-                return final
+    cleaned_candidates = [_strip_echo_lines(c) for c in candidates]
+    best = _select_best_candidate(cleaned_candidates, title or "", features_list, min_chars=MIN_CHARS)
+    if best:
+        final = _post_process_description(best, max_lines=max_lines)
+        if final and len(final.strip()) >= 30:
+            REGISTRY.incr("gen_desc_path_total", path="first_pass")
+            alternates = []
+            for c in cleaned_candidates:
+                text = _normalize_text(c)
+                if not text or not _passes_filter(text, _overlap_count(text, title or "", features_list), title or "", MIN_CHARS):
+                    continue
+                alt = _post_process_description(text, max_lines=max_lines)
+                if len(alt.strip()) >= 30 and alt not in alternates and alt != final:
+                    alternates.append(alt)
+            return [final] + alternates
 
+    retry_max_tokens = min(MAX_TOKENS, 320)
+    retry_temperature = max(0.6, TEMPERATURE - 0.1)
+    retry_top_p = min(0.98, TOP_P)
+    retry_min_chars = int(MIN_CHARS * 0.8)
+    if RETRY_MODE == "reuse" and first.encoder_state is not None:
+        # decode more samples from the first pass' encoder output, stop at the first good one
+        logger.warning("No satisfactory candidate from first pass. Decoding extra samples.")
+        retry_path = "recovery"
+
+        def _accept(c):
+            text = _normalize_text(_strip_echo_lines(c))
+            return _passes_filter(text, _overlap_count(text, title or "", features_list), title or "", retry_min_chars)
+
+        candidates2 = _decode_until_accepted(
+            tokenizer, model, first.encoder_state,
+            _gen_kwargs(tokenizer, retry_max_tokens, retry_temperature, retry_top_p, 1), _accept)
+    else:
         # retry with strict prompt
         logger.warning("No satisfactory candidate from first pass. Retrying with stricter prompt.")
-        strict_prompt = _build_prompt(title or "", features_list, category, tone, strict=True)
-        candidates2 = _generate_with_local_transformers_sampling(strict_prompt, model_name=DEFAULT_MODEL, max_tokens=min(MAX_TOKENS, 320), temperature=max(0.6, TEMPERATURE - 0.1), top_p=min(0.98, TOP_P), num_return_sequences=NUM_CANDIDATES)
-        if not isinstance(candidates2, list):
-            candidates2 = [str(candidates2)]
-        cleaned2 = [_strip_echo_lines(c) for c in candidates2]
-        best2 = _select_best_candidate(cleaned2, title or "", features_list, min_chars=int(MIN_CHARS * 0.8))
-        if best2:
-            final2 = _post_process_description(best2, max_lines=max_lines)
-            if final2 and len(final2.strip()) >= 30:
-                return final2
-
-        # fallback choices
-        all_cands = cleaned_candidates + cleaned2
-        all_cands = [c for c in all_cands if c and len(c.strip()) > 20]
-        if all_cands:
-            longest = max(all_cands, key=lambda s: len(s))
-            final_longest = _post_process_description(longest, max_lines=max_lines)
-            if final_longest and len(final_longest.strip()) >= 30:
-                return final_longest
-
-        logger.warning("All generation attempts failed to produce substantial text. Returning template fallback.")
-        return _template_fallback(title, features_list, category)
+        retry_path = "strict_retry"
+        strict_prompt = compile_prompt(tokenizer, title or "", features_list, category, tone, strict=True, variant=variant)
+        candidates2 = _generate_with_local_transformers_sampling(strict_prompt, model_name=DEFAULT_MODEL, max_tokens=retry_max_tokens, temperature=retry_temperature, top_p=retry_top_p, num_return_sequences=NUM_CANDIDATES)
+    if not isinstance(candidates2, list):
+        candidates2 = [str(candidates2)]
+    cleaned2 = [_strip_echo_lines(c) for c in candidates2]
+    best2 = _select_best_candidate(cleaned2, title or "", features_list, min_chars=retry_min_chars)
+    if best2:
+        final2 = _post_process_description(best2, max_lines=max_lines)
+        if final2 and len(final2.strip()) >= 30:
+            REGISTRY.incr("gen_desc_path_total", path=retry_path)
+            return [final2]
+
+    # fallback choices
+    all_cands = cleaned_candidates + cleaned2
+    all_cands = [c for c in all_cands if c and len(c.strip()) > 20]
+    if all_cands:
+        longest = max(all_cands, key=lambda s: len(s))
+        final_longest = _post_process_description(longest, max_lines=max_lines)
+        if final_longest and len(final_longest.strip()) >= 30:
+            REGISTRY.incr("gen_desc_path_total", path="longest")
+            return [final_longest]
+
+    logger.warning("All generation attempts failed to produce substantial text. Returning template fallback.")
+    REGISTRY.incr("gen_desc_path_total", path="template")
+    return []
+
+
+def _generate_descriptions(title: str, features_list: List[str], category: Optional[str], tone: Optional[str],
+                           max_lines: int, variant: str) -> List[str]:
+    """
+    Model descriptions, best first: the selected one plus any other first-pass candidates
+    that pass the filter. Empty when only the template fallback is left.
+    """
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Prompt preview: %s", _build_prompt(title or "", features_list, category, tone, strict=False, variant=variant)[:1200])
+
+    try:
+        # Try local generation only (minimal HF usage as requested)
+        tokenizer, model = _init_local_model(DEFAULT_MODEL)
+        if tokenizer is None:
+            raise RuntimeError("Failed to initialize local model/tokenizer.")
+        prompt = compile_prompt(tokenizer, title or "", features_list, category, tone, strict=False, variant=variant)
+        first = _generate_with_local_transformers_sampling(prompt, model_name=DEFAULT_MODEL, max_tokens=MAX_TOKENS, temperature=TEMPERATURE, top_p=TOP_P, num_return_sequences=NUM_CANDIDATES, return_encoder=True)
+        return _finish_descriptions(first, tokenizer, model, title, features_list, category, tone, max_lines, variant)
 
     except Exception as e:
         logger.exception("Generation error: %s. Falling back to template.", e)
-        return _template_fallback(title, features_list, category)
+        REGISTRY.incr("gen_desc_path_total", path="error")
+        return []
+
+def _token_streamer(tokenizer, on_text: Callable[[str], None]):
+    """TextStreamer that hands each decoded piece to on_text on the decoding thread."""
+    class _Streamer(TextStreamer):
+        def on_finalized_text(self, text: str, stream_end: bool = False):
+            if text:
+                on_text(text)
+    return _Streamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+
+
+def _stop_when(stopped: Callable[[], bool]):
+    """Stopping criteria that end generate() as soon as stopped() is true (checked per token)."""
+    class _Stop(StoppingCriteria):
+        def __call__(self, input_ids, scores, **kwargs) -> bool:
+            return stopped()
+    return StoppingCriteriaList([_Stop()])
+
+
+def _submit_thread(fn: Callable) -> Future:
+    fut: Future = Future()
+
+    def run():
+        fut.set_running_or_notify_cancel()
+        try:
+            fut.set_result(fn())
+        except BaseException as e:
+            fut.set_exception(e)
+
+    threading.Thread(target=run, name="gen-stream", daemon=True).start()
+    return fut
+
+
+def _relay(events: "queue.Queue", job: Future) -> Iterator[Tuple[str, object]]:
+    while True:
+        item = events.get(timeout=GEN_STREAM_TIMEOUT)
+        if item is None:
+            break
+        yield item
+    if job.exception() is not None:
+        # dropped before it ran (e.g. Rejected: its deadline passed in the queue)
+        raise job.exception()
+
+
+def stream_description(title: str,
+                       features: Optional[Union[List[str], str]] = None,
+                       category: Optional[str] = None,
+                       tone: Optional[str] = None,
+                       max_lines: int = MAX_LINES,
+                       prompt_variant: Optional[str] = None,
+                       fresh: bool = False,
+                       submit: Optional[Callable[[Callable], Future]] = None,
+                       cancel: Optional[threading.Event] = None) -> Iterator[Tuple[str, object]]:
+    """
+    Streaming flavour of generate_description. Returns an iterator of (event, data) pairs:
+      ("token", text)  pieces of the leading candidate as the decoder produces them
+      ("done", {...})  the final description, which may differ from the streamed text when
+                       the leading candidate fails the filter and recovery picks another
+    The encoder, decoder and recovery run as one job handed to submit(fn) -> Future (the
+    generation executor in the service, a new thread by default) before this returns, so an
+    admission rejection raises here; the iterator only relays the job's events.
+    Only one candidate is streamed (streamers need batch size 1, so this bypasses the
+    batcher); recovery decodes extra samples from the same encoder output like
+    generate_description does. A cached description (see generate_description) is sent as a
+    single token event without submitting anything.
+    Decoding stops early once `cancel` is set (the client went away) or the deadline of the
+    executor task (executors.current_deadline) passes.
+    """
+    t0 = time.perf_counter()
+    features_list = sanitize_features(features)
+    variant = _resolve_variant(prompt_variant)
+    cache = get_cache()
+    key = _description_cache_key(title, features_list, category, tone, max_lines, variant) if cache is not None else None
+    if cache is not None and not fresh:
+        cached = cache.get(key)
+        if cached:
+            return iter([
+                ("token", cached),
+                ("done", {"description": cached, "ttft_ms": round(1000 * (time.perf_counter() - t0), 1), "cached": True}),
+            ])
+
+    events: "queue.Queue" = queue.Queue()
+    job = (submit or _submit_thread)(partial(_stream_job, events.put, cancel or threading.Event(), t0, title,
+                                             features_list, category, tone, max_lines, variant, cache, key))
+    job.add_done_callback(lambda _: events.put(None))
+    return _relay(events, job)
+
+
+def _stream_job(emit: Callable[[Tuple[str, object]], None], cancel: threading.Event, t0: float, title: str, features_list: List[str],
+                category: Optional[str], tone: Optional[str], max_lines: int, variant: str, cache, key) -> None:
+    tokenizer, model = _init_local_model(DEFAULT_MODEL)
+    if tokenizer is None or TextStreamer is None:
+        REGISTRY.incr("gen_desc_path_total", path="template")
+        emit(("done", {"description": _template_fallback(title, features_list, category), "ttft_ms": None}))
+        return
+
+    ids = compile_prompt(tokenizer, title or "", features_list, category, tone, strict=False, variant=variant)
+    input_ids = torch.tensor([ids], dtype=torch.long, device=_model_device(model))
+    with torch.no_grad(), REGISTRY.timer("stage_seconds", stage="model.encoder"):
+        hidden = model.get_encoder()(input_ids=input_ids, attention_mask=torch.ones_like(input_ids),
+                                     return_dict=True).last_hidden_state
+
+    pieces, ttft = [], None
+
+    def _on_text(piece: str):
+        nonlocal ttft
+        if ttft is None:
+            ttft = time.perf_counter() - t0
+            REGISTRY.observe("gen_ttft_seconds", ttft)
+        pieces.append(piece)
+        emit(("token", piece))
+
+    def _stopped() -> bool:
+        return cancel.is_set() or deadline_passed()
+
+    kwargs = _gen_kwargs(tokenizer, MAX_TOKENS, TEMPERATURE, TOP_P, 1)
+    try:
+        with torch.no_grad(), REGISTRY.timer("stage_seconds", stage="model.generate"):
+            model.generate(encoder_outputs=BaseModelOutput(last_hidden_state=hidden),
+                           attention_mask=torch.ones_like(input_ids), streamer=_token_streamer(tokenizer, _on_text),
+                           stopping_criteria=_stop_when(_stopped), **kwargs)
+    except Exception as e:
+        logger.error("Streaming generation failed: %s", e)
+    if cancel.is_set():
+        REGISTRY.incr("gen_stream_cancelled_total")
+        return
+    # a decode cut short by the deadline is neither retried nor cached
+    truncated = deadline_passed()
+
+    leading = _strip_echo_lines("".join(pieces))
+    best = _select_best_candidate([leading], title or "", features_list, min_chars=MIN_CHARS) if leading else None
+    path = "first_pass"
+    candidates = [leading]
+    if not best and not truncated:
+        path = "recovery"
+        retry_min_chars = int(MIN_CHARS * 0.8)
+
+        def _accept(c):
+            text = _normalize_text(_strip_echo_lines(c))
+            return _passes_filter(text, _overlap_count(text, title or "", features_list), title or "", retry_min_chars)
+
+        try:
+            extra = _decode_until_accepted(tokenizer, model, hidden,
+                                           _gen_kwargs(tokenizer, min(MAX_TOKENS, 320), max(0.6, TEMPERATURE - 0.1), min(0.98, TOP_P), 1),
+                                           _accept)
+            candidates += [_strip_echo_lines(c) for c in extra]
+        except Exception as e:
+            logger.exception("Streaming recovery failed: %s", e)
+        best = _select_best_candidate(candidates, title or "", features_list, min_chars=retry_min_chars)
+
+    final = _post_process_description(best, max_lines=max_lines) if best else ""
+    if not final or len(final.strip()) < 30:
+        longest = max((c for c in candidates if c and len(c.strip()) > 20), key=len, default="")
+        final = _post_process_description(longest, max_lines=max_lines)
+        path = "longest"
+        if not final or len(final.strip()) < 30:
+            final = _template_fallback(title, features_list, category)
+            path = "template"
+    REGISTRY.incr("gen_desc_path_total", path=path)
+    if cache is not None and path != "template" and not truncated:
+        cache.put(key, [final])
+    emit(("done", {"description": final, "ttft_ms": round(1000 * ttft, 1) if ttft is not None else None}))
+
+# ----------------------
+# Catalog backfill
+# ----------------------
+def _needs_description_filter(min_chars: int) -> dict:
+    """Listings without a description, or with one shorter than min_chars."""
+    return {"$or": [
+        {"description": {"$exists": False}},
+        {"description": {"$in": [None, ""]}},
+        {"$expr": {"$and": [
+            {"$eq": [{"$type": "$description"}, "string"]},
+            {"$lt": [{"$strLenCP": {"$trim": {"input": "$description"}}}, min_chars]},
+        ]}},
+    ]}
+
+
+def _load_checkpoint(path: str):
+    from bson import ObjectId
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            last_id = json.load(f).get("last_id")
+        return ObjectId(last_id) if last_id else None
+    except FileNotFoundError:
+        return None
+
+
+def _save_checkpoint(path: str, last_id, stats: dict) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"last_id": str(last_id), "updated": time.time(), **stats}, f)
+    os.replace(tmp, path)
+
+
+def _length_batches(items: list, max_size: int, token_budget: int):
+    """Split length-sorted items into batches bounded by size and padded token count."""
+    batch = []
+    for item in items:
+        if batch and (len(batch) >= max_size or len(item[0]) * (len(batch) + 1) > token_budget):
+            yield batch
+            batch = []
+        batch.append(item)
+    if batch:
+        yield batch
+
+
+def _backfill_batch(tokenizer, model, batch: list, gen_kwargs: Dict, tone: Optional[str], variant: str) -> List[List[str]]:
+    """Accepted descriptions for one padded batch of (ids, _id, title, features, category) items."""
+    results = _generate_batch_ids(tokenizer, model, [it[0] for it in batch], gen_kwargs)
+    out = []
+    for (_, _id, title, features, category), first in zip(batch, results):
+        try:
+            out.append(_finish_descriptions(first, tokenizer, model, title, features, category, tone, MAX_LINES, variant))
+        except Exception as e:
+            logger.warning("Backfill generation failed for %s: %s", _id, e)
+            out.append([])
+    return out
+
+
+def _run_admitted(submit: Callable[[Callable], Future], fn: Callable):
+    """Run fn through submit, waiting and retrying while it is shed (batch work yields to interactive)."""
+    while True:
+        try:
+            return submit(fn).result()
+        except Rejected as e:
+            REGISTRY.incr("gen_backfill_deferred_total", reason=e.reason)
+            time.sleep(BACKFILL_RETRY_S)
+
+
+def _backfill_chunk(collection, tokenizer, model, docs: list, tone: Optional[str], variant: str,
+                    batch_size: int, dry_run: bool, stats: dict, run: Callable[[Callable], object]) -> None:
+    from pymongo import UpdateOne
+
+    items = []
+    for doc in docs:
+        title = str(doc.get("title") or "").strip()
+        if not title:
+            stats["skipped"] += 1
+            continue
+        features = sanitize_features(doc.get("features"))
+        category = doc.get("main_category") or None
+        ids = compile_prompt(tokenizer, title, features, category, tone, variant=variant)
+        items.append((ids, doc["_id"], title, features, category))
+    # similar lengths in one batch keep padding (wasted encoder work) small
+    items.sort(key=lambda it: len(it[0]))
+
+    kwargs = _gen_kwargs(tokenizer, MAX_TOKENS, TEMPERATURE, TOP_P, NUM_CANDIDATES)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    ops = []
+    for batch in _length_batches(items, batch_size, GEN_BATCH_TOKEN_BUDGET):
+        results = run(partial(_backfill_batch, tokenizer, model, batch, kwargs, tone, variant))
+        for (_, _id, _, _, _), descriptions in zip(batch, results):
+            if not descriptions:
+                stats["failed"] += 1
+                continue
+            ops.append(UpdateOne({"_id": _id}, {"$set": {"description": descriptions[0], "updatedAt": now}}))
+
+    if ops and not dry_run:
+        res = collection.bulk_write(ops, ordered=False)
+        stats["written"] += res.modified_count
+    elif ops:
+        stats["written"] += len(ops)
+
+
+def backfill_descriptions(collection,
+                          checkpoint_path: str = BACKFILL_CHECKPOINT,
+                          chunk_size: int = 64,
+                          batch_size: int = GEN_BATCH_MAX_SIZE,
+                          min_chars: int = MIN_CHARS,
+                          tone: Optional[str] = None,
+                          prompt_variant: Optional[str] = None,
+                          limit: Optional[int] = None,
+                          dry_run: bool = False,
+                          submit: Optional[Callable[[Callable], Future]] = None) -> dict:
+    """
+    Generate descriptions for listings that have none (or a too short one).
+
+    Listings are streamed in _id order, chunk_size at a time. Each chunk is sorted by prompt
+    length and generated in padded batches, written back with one bulk_write, and then the
+    last _id is checkpointed, so an interrupted run resumes after the last finished chunk.
+
+    With `submit` (the service passes the generation executor with priority "batch") every
+    padded batch runs as one task there, behind queued interactive requests; a batch that is
+    shed is retried after BACKFILL_RETRY_S.
+    """
+    run = partial(_run_admitted, submit) if submit is not None else (lambda fn: fn())
+    tokenizer, model = _init_local_model(DEFAULT_MODEL)
+    if tokenizer is None or model is None:
+        raise RuntimeError("Failed to initialize local model/tokenizer.")
+    variant = _resolve_variant(prompt_variant)
+
+    query = _needs_description_filter(min_chars)
+    last_id = _load_checkpoint(checkpoint_path)
+    if last_id is not None:
+        logger.info("Resuming backfill after _id %s", last_id)
+        query = {"$and": [query, {"_id": {"$gt": last_id}}]}
+    cursor = collection.find(query, {"title": 1, "features": 1, "main_category": 1}).sort("_id", 1).batch_size(chunk_size)
+    if limit:
+        cursor = cursor.limit(int(limit))
+
+    stats = {"processed": 0, "written": 0, "failed": 0, "skipped": 0}
+    t0 = time.perf_counter()
+
+    def _flush(chunk):
+        _backfill_chunk(collection, tokenizer, model, chunk, tone, variant, batch_size, dry_run, stats, run)
+        stats["processed"] += len(chunk)
+        if not dry_run:
+            _save_checkpoint(checkpoint_path, chunk[-1]["_id"], stats)
+        elapsed = time.perf_counter() - t0
+        stats["listings_per_hour"] = round(3600 * stats["processed"] / elapsed, 1) if elapsed > 0 else 0.0
+        logger.info("Backfill: processed=%d written=%d failed=%d skipped=%d (%.1f listings/hour)",
+                    stats["processed"], stats["written"], stats["failed"], stats["skipped"], stats["listings_per_hour"])
+
+    chunk = []
+    for doc in cursor:
+        chunk.append(doc)
+        if len(chunk) >= chunk_size:
+            _flush(chunk)
+            chunk = []
+    if chunk:
+        _flush(chunk)
+    return stats
 
 # ----------------------
 # CLI quick test
@@ -438,16 +1181,41 @@ def generate_description(title: str,
 if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser(description="Generate product description (sampling + selection) using Flan-T5")
-    parser.add_argument("--title", "-t", required=True)
+    parser.add_argument("--title", "-t")
     parser.add_argument("--features", "-f", help="Pipe/comma/newline separated features or JSON-like list")
     parser.add_argument("--category", "-c", help="Category")
     parser.add_argument("--tone", help="Tone hint")
     parser.add_argument("--no-model", action="store_true", help="Use fallback only")
     parser.add_argument("--max-lines", type=int, default=MAX_LINES)
+    parser.add_argument("--prompt-variant", choices=PROMPT_VARIANTS, default=None)
+    parser.add_argument("--backfill", action="store_true", help="Fill missing/short descriptions of listings in Mongo (ML_DB/ML_COLLECTION)")
+    parser.add_argument("--chunk-size", type=int, default=64, help="Backfill: listings per bulk write / checkpoint")
+    parser.add_argument("--batch-size", type=int, default=GEN_BATCH_MAX_SIZE, help="Backfill: prompts per generate call")
+    parser.add_argument("--min-chars", type=int, default=MIN_CHARS, help="Backfill: descriptions shorter than this are regenerated")
+    parser.add_argument("--limit", type=int, default=None, help="Backfill: stop after this many listings")
+    parser.add_argument("--checkpoint", default=BACKFILL_CHECKPOINT, help="Backfill: resume file")
+    parser.add_argument("--reset", action="store_true", help="Backfill: ignore the checkpoint and start over")
+    parser.add_argument("--dry-run", action="store_true", help="Backfill: generate but do not write")
     args = parser.parse_args()
 
+    if args.backfill:
+        from pymongo import MongoClient
+        mongo_uri = os.environ.get("MONGO_URI")
+        if not mongo_uri:
+            parser.error("MONGO_URI environment variable is required for --backfill")
+        if args.reset and os.path.exists(args.checkpoint):
+            os.remove(args.checkpoint)
+        coll = MongoClient(mongo_uri)[os.environ.get("ML_DB")][os.environ.get("ML_COLLECTION")]
+        summary = backfill_descriptions(coll, checkpoint_path=args.checkpoint, chunk_size=args.chunk_size,
+                                        batch_size=args.batch_size, min_chars=args.min_chars, tone=args.tone,
+                                        prompt_variant=args.prompt_variant, limit=args.limit, dry_run=args.dry_run)
+        print(json.dumps(summary, indent=2))
+        raise SystemExit(0)
+    if not args.title:
+        parser.error("--title is required (or use --backfill)")
+
     feats = args.features
-    desc = generate_description(title=args.title, features=feats, category=args.category, tone=args.tone, max_lines=args.max_lines, use_model=(not args.no_model))
+    desc = generate_description(title=args.title, features=feats, category=args.category, tone=args.tone, max_lines=args.max_lines, use_model=(not args.no_model), prompt_variant=args.prompt_variant)
     print("\n=== DESCRIPTION ===\n")
     print(desc)
     print("\n===================\n")
@@ -0,0 +1,277 @@
+# ml/metrics.py
+"""
+Small in-process counters and timers shared by the ML service modules.
+
+Everything is keyed by a metric name plus optional labels, e.g.
+    REGISTRY.incr("clip_escalations_total")
+    with REGISTRY.timer("clip_tag_seconds", model="ViT-B-32"):
+        ...
+and read back as a plain dict via REGISTRY.snapshot() (served on /stats) or in the
+Prometheus text format via REGISTRY.prometheus() (served on /metrics). Timers are
+histograms over LATENCY_BUCKETS unless set_buckets() gave the metric other bounds
+(SIZE_BUCKETS for batch sizes). Internal steps of a request share one histogram:
+    @REGISTRY.timed("stage_seconds", stage="_fetch_image")
+Updates take one short lock and a bisect, so it is cheap enough to leave on in production.
+
+Several worker processes (serve.py) each keep their own registry. After
+enable_multiprocess(dir) every process writes its state to <dir>/<pid>.json (every
+METRICS_FLUSH_INTERVAL seconds and on each scrape) and prometheus() merges all files:
+counters and histograms are summed over workers, including workers that have exited, and
+gauges of live workers get a `worker` label.
+"""
+import functools
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+def _escape(value: object) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _key(name: str, labels: Dict[str, object]) -> str:
+    if not labels:
+        return name
+    inner = ",".join(f'{k}="{_escape(labels[k])}"' for k in sorted(labels))
+    return f"{name}{{{inner}}}"
+
+
+def _split_key(key: str) -> Tuple[str, str]:
+    """'name{a="1"}' -> ('name', 'a="1"')"""
+    name, _, inner = key.partition("{")
+    return name, inner[:-1]
+
+
+def _with_label(key: str, label: str, value: object) -> str:
+    name, inner = _split_key(key)
+    inner = f'{inner},{label}="{_escape(value)}"' if inner else f'{label}="{_escape(value)}"'
+    return f"{name}{{{inner}}}"
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+
+METRICS_FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", "5"))
+_multiprocess_dir: Optional[str] = None
+
+
+def enable_multiprocess(directory: str) -> None:
+    """Share metrics across processes forked after this call through files in `directory`."""
+    global _multiprocess_dir
+    os.makedirs(directory, exist_ok=True)
+    _multiprocess_dir = directory
+
+
+def _fmt(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, float] = {}
+        # key -> [count, total_seconds, max_seconds, per-bucket counts (last one is +Inf)]
+        self._timers: Dict[str, list] = {}
+        self._gauges: Dict[str, float] = {}
+        # metric name -> bucket upper bounds (default LATENCY_BUCKETS)
+        self._buckets: Dict[str, Tuple[float, ...]] = {}
+
+    def set_buckets(self, name: str, buckets: Sequence[float]) -> None:
+        """Histogram bounds for metric `name`; call before its first observation."""
+        with self._lock:
+            self._buckets[name] = tuple(sorted(buckets))
+
+    def incr(self, name: str, value: float = 1, **labels) -> None:
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels) -> None:
+        key = _key(name, labels)
+        with self._lock:
+            buckets = self._buckets.get(name, LATENCY_BUCKETS)
+            t = self._timers.get(key)
+            if t is None:
+                t = self._timers[key] = [0, 0.0, seconds, [0] * (len(buckets) + 1)]
+            t[0] += 1
+            t[1] += seconds
+            if seconds > t[2]:
+                t[2] = seconds
+            t[3][bisect_left(buckets, seconds)] += 1
+
+    def set_gauge(self, name: str, value: float, **labels) -> None:
+        with self._lock:
+            self._gauges[_key(name, labels)] = value
+
+    def max_gauge(self, name: str, value: float, **labels) -> None:
+        """Keep the largest value seen (peak-style gauges)."""
+        key = _key(name, labels)
+        with self._lock:
+            if value > self._gauges.get(key, float("-inf")):
+                self._gauges[key] = value
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - t0, **labels)
+
+    def timed(self, name: str, **labels):
+        """Decorator form of timer()."""
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.timer(name, **labels):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def counter(self, name: str, **labels) -> float:
+        with self._lock:
+            return self._counters.get(_key(name, labels), 0)
+
+    def snapshot(self) -> Dict[str, dict]:
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            timers = {
+                k: {
+                    "count": c,
+                    "total_s": round(total, 6),
+                    "avg_ms": round(1000 * total / c, 3) if c else 0.0,
+                    "max_ms": round(1000 * mx, 3),
+                }
+                for k, (c, total, mx, _) in self._timers.items()
+                if _split_key(k)[0] not in self._buckets
+            }
+            # histograms of sizes rather than seconds
+            timers.update({
+                k: {"count": c, "sum": total, "avg": round(total / c, 3) if c else 0.0, "max": mx}
+                for k, (c, total, mx, _) in self._timers.items()
+                if _split_key(k)[0] in self._buckets
+            })
+        return {"counters": counters, "gauges": gauges, "timers": timers}
+
+    def _state(self) -> dict:
+        with self._lock:
+            return {
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+                "timers": {k: [c, total, list(counts)] for k, (c, total, _, counts) in self._timers.items()},
+                "buckets": {name: list(b) for name, b in self._buckets.items()},
+            }
+
+    def flush(self) -> None:
+        """Write this process's state for the other workers' scrapes (no-op in a single process)."""
+        if _multiprocess_dir is None:
+            return
+        path = os.path.join(_multiprocess_dir, f"{os.getpid()}.json")
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self._state(), f)
+        os.replace(path + ".tmp", path)
+
+    def start_flushing(self, refresh: Optional[Callable[[], None]] = None) -> None:
+        """
+        Flush every METRICS_FLUSH_INTERVAL seconds from a daemon thread (multiprocess mode only),
+        calling refresh() first to update scrape-time gauges.
+        """
+        if _multiprocess_dir is None:
+            return
+
+        def loop():
+            while True:
+                try:
+                    if refresh is not None:
+                        refresh()
+                    self.flush()
+                except Exception:
+                    pass
+                time.sleep(METRICS_FLUSH_INTERVAL)
+
+        threading.Thread(target=loop, name="metrics-flush", daemon=True).start()
+
+    def _merged_state(self) -> dict:
+        self.flush()
+        merged = {"counters": {}, "gauges": {}, "timers": {}, "buckets": {}}
+        for fname in sorted(os.listdir(_multiprocess_dir)):
+            if not fname.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(_multiprocess_dir, fname), encoding="utf-8") as f:
+                    state = json.load(f)
+            except (OSError, ValueError):
+                continue
+            pid = int(fname[:-len(".json")])
+            for key, value in state["counters"].items():
+                merged["counters"][key] = merged["counters"].get(key, 0) + value
+            if _alive(pid):
+                for key, value in state["gauges"].items():
+                    merged["gauges"][_with_label(key, "worker", pid)] = value
+            for key, (count, total, counts) in state["timers"].items():
+                t = merged["timers"].get(key)
+                if t is None or len(t[2]) != len(counts):
+                    merged["timers"][key] = [count, total, list(counts)]
+                else:
+                    t[0] += count
+                    t[1] += total
+                    t[2] = [a + b for a, b in zip(t[2], counts)]
+            merged["buckets"].update(state["buckets"])
+        return merged
+
+    def prometheus(self, prefix: str = "ml_") -> str:
+        """All metrics in the Prometheus text exposition format (version 0.0.4), merged over workers."""
+        state = self._merged_state() if _multiprocess_dir is not None else self._state()
+        counters = list(state["counters"].items())
+        gauges = list(state["gauges"].items())
+        timers = list(state["timers"].items())
+        bounds = {name: tuple(b) for name, b in state["buckets"].items()}
+        # samples of one metric must be contiguous, so sort by (name, labels) rather than by key
+        counters.sort(key=lambda kv: _split_key(kv[0]))
+        gauges.sort(key=lambda kv: _split_key(kv[0]))
+        timers.sort(key=lambda kv: _split_key(kv[0]))
+
+        lines: List[str] = []
+        typed = set()
+
+        def header(name: str, kind: str) -> None:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {prefix}{name} {kind}")
+
+        for kind, items in (("counter", counters), ("gauge", gauges)):
+            for key, value in items:
+                name, inner = _split_key(key)
+                header(name, kind)
+                lines.append(f"{prefix}{key} {_fmt(value)}")
+        for key, (count, total, counts) in timers:
+            name, inner = _split_key(key)
+            header(name, "histogram")
+            sep = "," if inner else ""
+            cumulative = 0
+            for bound, n in zip(bounds.get(name, LATENCY_BUCKETS) + (float("inf"),), counts):
+                cumulative += n
+                lines.append(f'{prefix}{name}_bucket{{{inner}{sep}le="{_fmt(bound)}"}} {cumulative}')
+            labels = f"{{{inner}}}" if inner else ""
+            lines.append(f"{prefix}{name}_sum{labels} {_fmt(total)}")
+            lines.append(f"{prefix}{name}_count{labels} {count}")
+        return "\n".join(lines) + "\n"
+
+REGISTRY = MetricsRegistry()
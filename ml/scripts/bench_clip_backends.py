@@ -0,0 +1,98 @@
+# ml/scripts/bench_clip_backends.py
+"""
+Compare the torch and onnxruntime CLIP backends on a fixed image set.
+
+Reports image-encoder throughput (images/sec, preprocessing included, download excluded)
+and label agreement with the torch backend: the fraction of attributes whose top-1 label
+matches and the mean top-k overlap.
+
+Usage (from ml/):
+  python scripts/bench_clip_backends.py --images images.txt [--model ViT-B-32] [--batch 8] [--threads 4]
+The first onnx run exports the towers into HF_HOME/onnx/clip/ (and int8 with --quantize).
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from clip_tagging import ClipTagger, _pretrained_tag, CACHE_DIR
+from clip_onnx import load_or_export
+
+ATTRS = ("materials", "styles", "colors", "occasions")
+
+
+def _throughput(tagger, images, batch):
+    tier = tagger.tiers[tagger.model_name]
+    tier.encode_images(images[:1])  # warm-up
+    t0 = time.perf_counter()
+    for i in range(0, len(images), batch):
+        tier.encode_images(images[i:i + batch])
+    return len(images) / (time.perf_counter() - t0)
+
+
+def _tags(tagger, uris_images):
+    return [tagger.zero_shot_tags_for_image(u, crop_policy="none", image=img, escalate=False) for u, img in uris_images]
+
+
+def _agreement(tags, ref):
+    top1 = overlap = 0.0
+    n = 0
+    for a, b in zip(tags, ref):
+        for attr in ATTRS:
+            la = [p["label"] for p in a[attr]]
+            lb = [p["label"] for p in b[attr]]
+            top1 += float(bool(la) and bool(lb) and la[0] == lb[0])
+            union = set(la) | set(lb)
+            overlap += len(set(la) & set(lb)) / len(union) if union else 1.0
+            n += 1
+    return top1 / n, overlap / n
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark torch vs onnxruntime CLIP backends")
+    parser.add_argument("--images", required=True, help="File with one image URL/path per line")
+    parser.add_argument("--model", default="ViT-B-32")
+    parser.add_argument("--batch", type=int, default=8)
+    parser.add_argument("--threads", type=int, default=0, help="onnxruntime intra-op threads (0 = default)")
+    parser.add_argument("--quantize", action="store_true", help="Also benchmark the int8 export")
+    args = parser.parse_args()
+
+    with open(args.images, "r", encoding="utf-8") as f:
+        uris = [ln.strip() for ln in f if ln.strip()]
+
+    tagger = ClipTagger(model_preference=args.model, backend="torch")
+    loaded = []
+    for u in uris:
+        try:
+            loaded.append((u, tagger._fetch_image(u)))
+        except Exception as e:
+            print("skip", u, e)
+    if not loaded:
+        print("no images loaded")
+        return
+    images = [img for _, img in loaded]
+
+    tier = tagger.tiers[tagger.model_name]
+    variants = [("torch", None)]
+    variants.append(("onnx", load_or_export(tier.model, tier.name, _pretrained_tag(tier.name), CACHE_DIR, quantize=False, threads=args.threads)))
+    if args.quantize:
+        variants.append(("onnx-int8", load_or_export(tier.model, tier.name, _pretrained_tag(tier.name), CACHE_DIR, quantize=True, threads=args.threads)))
+
+    print(f"model={tier.name} images={len(images)} batch={args.batch} ort_threads={args.threads or 'default'}")
+    print(f"{'backend':<10} {'img/s':>8} {'top1':>6} {'overlap':>8}")
+    reference = None
+    for name, encoder in variants:
+        tier.onnx = encoder
+        tier._label_cache.clear()
+        ips = _throughput(tagger, images, args.batch)
+        tags = _tags(tagger, loaded)
+        if reference is None:
+            reference = tags
+        top1, overlap = _agreement(tags, reference)
+        print(f"{name:<10} {ips:>8.2f} {top1:>6.2f} {overlap:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
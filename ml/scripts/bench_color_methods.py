@@ -0,0 +1,76 @@
+# ml/scripts/bench_color_methods.py
+"""
+Compare the color clustering engines of color_detector on a fixed image set.
+
+Pixels are extracted once per image (download + mask + sampling are excluded from timing),
+then every method clusters the same pixels. Agreement with the reference method:
+  - dE: pixel-weighted mean CIE76 distance from each reference color to the nearest
+        color of the candidate palette (lower is better; < ~5 is hard to see)
+  - name: fraction of images whose dominant color name matches the reference
+
+Usage (from ml/):
+  python scripts/bench_color_methods.py --images images.txt [--top-k 3] [--reference kmeans]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from color_detector import (COLOR_METHODS, extract_colors_from_pixels, masked_pixels,
+                            nearest_color_name, rgb_to_hex, _rgb_tuple_to_lab)
+
+
+def _delta_e(ref, cand):
+    cand_lab = np.array([_rgb_tuple_to_lab(rgb) for rgb, _ in cand])
+    total = 0.0
+    for rgb, frac in ref:
+        lab = np.array(_rgb_tuple_to_lab(rgb))
+        total += frac * float(np.min(np.linalg.norm(cand_lab - lab, axis=1)))
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark color clustering methods")
+    parser.add_argument("--images", required=True, help="File with one image URL/path per line")
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--reference", default="kmeans", choices=COLOR_METHODS)
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per image/method")
+    args = parser.parse_args()
+
+    with open(args.images, "r", encoding="utf-8") as f:
+        urls = [ln.strip() for ln in f if ln.strip()]
+    sets = [(u, masked_pixels(u)) for u in urls]
+    sets = [(u, p) for u, p in sets if p is not None and len(p)]
+    if not sets:
+        print("no images loaded")
+        return
+
+    palettes = {m: [] for m in COLOR_METHODS}
+    latency = {m: [] for m in COLOR_METHODS}
+    for method in COLOR_METHODS:
+        for _, pixels in sets:
+            for _ in range(max(1, args.repeat)):
+                t0 = time.perf_counter()
+                pal = extract_colors_from_pixels(pixels, n_colors=args.top_k, method=method)
+                latency[method].append(time.perf_counter() - t0)
+            palettes[method].append(pal)
+
+    print(f"images={len(sets)} top_k={args.top_k} reference={args.reference}")
+    print(f"{'method':<10} {'mean_ms':>9} {'p95_ms':>9} {'dE':>6} {'name':>6}")
+    ref = palettes[args.reference]
+    for method in COLOR_METHODS:
+        lat = sorted(latency[method])
+        mean_ms = 1000 * sum(lat) / len(lat)
+        p95_ms = 1000 * lat[min(len(lat) - 1, int(0.95 * len(lat)))]
+        de = np.mean([_delta_e(r, c) for r, c in zip(ref, palettes[method])])
+        names = np.mean([nearest_color_name(rgb_to_hex(r[0][0])) == nearest_color_name(rgb_to_hex(c[0][0]))
+                         for r, c in zip(ref, palettes[method])])
+        print(f"{method:<10} {mean_ms:>9.1f} {p95_ms:>9.1f} {de:>6.2f} {names:>6.2f}")
+
+
+if __name__ == "__main__":
+    main()
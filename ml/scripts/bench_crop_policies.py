@@ -0,0 +1,89 @@
+# ml/scripts/bench_crop_policies.py
+"""
+Compare CLIP multi-crop policies on a fixed image set.
+
+For every image and policy this reports the tagging latency (crops + encode + scoring,
+image download excluded) and how well the tags agree with a reference policy:
+  - top1: fraction of attributes (materials/styles/colors/occasions) whose top label matches
+  - overlap: mean Jaccard overlap of the top-k label sets
+
+Usage (from ml/):
+  python scripts/bench_crop_policies.py --images images.txt [--model ViT-B-32] [--reference five_crop]
+where images.txt holds one URL or local path per line.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from clip_tagging import ClipTagger, CROP_POLICIES
+
+ATTRS = ("materials", "styles", "colors", "occasions")
+
+
+def _labels(tags, attr):
+    return [p["label"] for p in tags.get(attr, [])]
+
+
+def _agreement(tags, ref):
+    top1 = overlap = 0.0
+    for attr in ATTRS:
+        a, b = _labels(tags, attr), _labels(ref, attr)
+        top1 += float(bool(a) and bool(b) and a[0] == b[0])
+        union = set(a) | set(b)
+        overlap += len(set(a) & set(b)) / len(union) if union else 1.0
+    return top1 / len(ATTRS), overlap / len(ATTRS)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark CLIP crop policies")
+    parser.add_argument("--images", required=True, help="File with one image URL/path per line")
+    parser.add_argument("--model", default="ViT-B-32")
+    parser.add_argument("--reference", default="five_crop", choices=CROP_POLICIES)
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=1, help="Timed runs per image/policy")
+    args = parser.parse_args()
+
+    with open(args.images, "r", encoding="utf-8") as f:
+        uris = [ln.strip() for ln in f if ln.strip()]
+
+    tagger = ClipTagger(model_preference=args.model)
+    images = []
+    for u in uris:
+        try:
+            images.append((u, tagger._fetch_image(u)))
+        except Exception as e:
+            print("skip", u, e)
+    if not images:
+        print("no images loaded")
+        return
+
+    # warm-up so the first policy does not pay for lazy initialisation
+    tagger.zero_shot_tags_for_image(images[0][0], top_k_per_attr=args.top_k, crop_policy="none", image=images[0][1])
+
+    results = {p: {} for p in CROP_POLICIES}
+    latency = {p: [] for p in CROP_POLICIES}
+    for policy in CROP_POLICIES:
+        for uri, img in images:
+            for _ in range(max(1, args.repeat)):
+                t0 = time.perf_counter()
+                tags = tagger.zero_shot_tags_for_image(uri, top_k_per_attr=args.top_k, crop_policy=policy, image=img)
+                latency[policy].append(time.perf_counter() - t0)
+            results[policy][uri] = tags
+
+    print(f"model={tagger.model_name} images={len(images)} reference={args.reference}")
+    print(f"{'policy':<12} {'mean_ms':>9} {'p95_ms':>9} {'top1':>6} {'overlap':>8}")
+    for policy in CROP_POLICIES:
+        lat = sorted(latency[policy])
+        mean_ms = 1000 * sum(lat) / len(lat)
+        p95_ms = 1000 * lat[min(len(lat) - 1, int(0.95 * len(lat)))]
+        agree = [_agreement(results[policy][u], results[args.reference][u]) for u, _ in images]
+        top1 = sum(a[0] for a in agree) / len(agree)
+        overlap = sum(a[1] for a in agree) / len(agree)
+        print(f"{policy:<12} {mean_ms:>9.1f} {p95_ms:>9.1f} {top1:>6.2f} {overlap:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+# ml/scripts/bench_prompt_variants.py
+"""
+Compare the description prompt variants of generate_description on a fixed product set.
+
+For each variant:
+  - tokens:   encoder input length (cached prefix + product part)
+  - tok_ms:   prompt preparation time, re-tokenizing the whole prompt vs compile_prompt
+  - mean_ms / p95_ms: end-to-end generate_description latency
+  - chars:    mean description length
+  - overlap:  mean number of title/feature words copied into the description (lower is better)
+  - pass:     fraction of descriptions that pass the first-pass filter (length + overlap)
+
+Sampling is seeded per product, so reruns are comparable. The description cache is turned
+off, so every run times real generations and nothing lands in the service's cache file.
+
+Usage (from ml/):
+  python scripts/bench_prompt_variants.py [--repeat 2] [--variants full compact]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ["GEN_DESC_CACHE"] = "0"  # read when description_cache is imported
+
+import torch
+
+import generate_description as gd
+
+PRODUCTS = [
+    ("Hand-thrown Stoneware Mug", ["Food-safe glaze", "Holds 350 ml", "Dishwasher safe"], "Kitchen", None),
+    ("Block Printed Cotton Table Runner", ["Hand block printed", "Natural dyes", "180 x 35 cm"], "Home & Living", "warm"),
+    ("Brass Diya Set of 4", ["Solid brass", "Hand polished"], "Decor", "festive"),
+    ("Macrame Wall Hanging", ["Recycled cotton cord", "Driftwood dowel"], "Decor", None),
+    ("Jute Tote Bag", ["Eco-friendly jute", "Cotton lining", "Inner zip pocket"], "Bags", "practical"),
+    ("Terracotta Planter", ["Hand-painted", "Drainage hole"], "Garden", None),
+    ("Silver Filigree Earrings", ["925 sterling silver", "Lightweight"], "Jewelry", "elegant"),
+    ("Kantha Quilt", ["Layered vintage saris", "Hand stitched", "Reversible"], "Bedding", None),
+]
+
+
+def _passes(text, title, features):
+    overlap = gd._overlap_count(text, title, features)
+    return len(text) >= gd.MIN_CHARS and overlap < max(1, int(0.25 * len(gd._words_set(title)) + 0.5)), overlap
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark description prompt variants")
+    parser.add_argument("--variants", nargs="+", default=list(gd.PROMPT_VARIANTS), choices=gd.PROMPT_VARIANTS)
+    parser.add_argument("--repeat", type=int, default=2, help="Generations per product/variant")
+    args = parser.parse_args()
+
+    tokenizer, model = gd._init_local_model(gd.DEFAULT_MODEL)
+    if model is None:
+        print("model not available")
+        return
+
+    print(f"model={gd.DEFAULT_MODEL} products={len(PRODUCTS)} repeat={args.repeat}")
+    print(f"{'variant':<9} {'tokens':>7} {'tok_ms':>13} {'mean_ms':>9} {'p95_ms':>9} {'chars':>6} {'overlap':>8} {'pass':>5}")
+    for variant in args.variants:
+        tokens, t_full, t_compiled, lat, chars, overlaps, passed = [], [], [], [], [], [], []
+        for seed, (title, feats, category, tone) in enumerate(PRODUCTS):
+            t0 = time.perf_counter()
+            tokenizer(gd._build_prompt(title, feats, category, tone, variant=variant), truncation=True, max_length=gd._TOKENIZER_MAX_LENGTH)
+            t_full.append(time.perf_counter() - t0)
+            t0 = time.perf_counter()
+            ids = gd.compile_prompt(tokenizer, title, feats, category, tone, variant=variant)
+            t_compiled.append(time.perf_counter() - t0)
+            tokens.append(len(ids))
+
+            for r in range(max(1, args.repeat)):
+                torch.manual_seed(1000 * seed + r)
+                t0 = time.perf_counter()
+                text = gd.generate_description(title, feats, category, tone, prompt_variant=variant, fresh=True)
+                lat.append(time.perf_counter() - t0)
+                ok, overlap = _passes(text, title, feats)
+                chars.append(len(text))
+                overlaps.append(overlap)
+                passed.append(ok)
+
+        lat.sort()
+        n = len(lat)
+        tok_ms = f"{1000 * sum(t_full) / len(t_full):.2f}/{1000 * sum(t_compiled) / len(t_compiled):.2f}"
+        print(f"{variant:<9} {sum(tokens) / len(tokens):>7.0f} {tok_ms:>13} {1000 * sum(lat) / n:>9.0f} "
+              f"{1000 * lat[min(n - 1, int(0.95 * n))]:>9.0f} {sum(chars) / n:>6.0f} "
+              f"{sum(overlaps) / n:>8.2f} {sum(passed) / n:>5.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+# ml/scripts/bench_rembg.py
+"""
+Per-image background-removal latency: the original path (full-resolution PNG round-trip,
+no session) against mask_with_rembg (shared session, downscaled input, array in/out).
+Also reports the foreground IoU of the new mask against the original one.
+
+Usage (from ml/):
+  python scripts/bench_rembg.py --images images.txt [--max-side 640] [--repeat 3]
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import color_detector
+from color_detector import download_image, pil_from_bytes, mask_with_rembg
+
+
+def _legacy_mask(pil_img):
+    buf = io.BytesIO()
+    pil_img.convert("RGBA").save(buf, format="PNG")
+    out = Image.open(io.BytesIO(color_detector._rembg().remove(buf.getvalue()))).convert("RGBA")
+    return (np.array(out.split()[-1]) > 10).astype(np.uint8)
+
+
+def _timed(fn, img, repeat):
+    times, mask = [], None
+    for _ in range(max(1, repeat)):
+        t0 = time.perf_counter()
+        mask = fn(img)
+        times.append(time.perf_counter() - t0)
+    return min(times), mask
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark rembg masking")
+    parser.add_argument("--images", required=True, help="File with one image URL per line")
+    parser.add_argument("--max-side", type=int, default=color_detector.REMBG_MAX_SIDE)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    if not color_detector.rembg_available():
+        print("rembg is not installed")
+        return
+
+    with open(args.images, "r", encoding="utf-8") as f:
+        urls = [ln.strip() for ln in f if ln.strip()]
+
+    print(f"{'image':<40} {'size':>11} {'before_ms':>10} {'after_ms':>9} {'iou':>5}")
+    before_all, after_all = [], []
+    for url in urls:
+        data = download_image(url)
+        if not data:
+            print("skip", url)
+            continue
+        img = pil_from_bytes(data, max_side=0)  # full resolution, as the original path saw it
+        t_before, m_before = _timed(_legacy_mask, img, args.repeat)
+        t_after, m_after = _timed(lambda im: mask_with_rembg(im, max_side=args.max_side), img, args.repeat)
+        union = np.logical_or(m_before, m_after).sum()
+        iou = np.logical_and(m_before, m_after).sum() / union if union else 1.0
+        before_all.append(t_before)
+        after_all.append(t_after)
+        size = f"{img.size[0]}x{img.size[1]}"
+        print(f"{url[-40:]:<40} {size:>11} {1000 * t_before:>10.1f} {1000 * t_after:>9.1f} {iou:>5.2f}")
+    if before_all:
+        print(f"mean: before={1000 * np.mean(before_all):.1f}ms after={1000 * np.mean(after_all):.1f}ms "
+              f"(max_side={args.max_side})")
+
+
+if __name__ == "__main__":
+    main()
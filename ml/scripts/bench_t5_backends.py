@@ -0,0 +1,91 @@
+# ml/scripts/bench_t5_backends.py
+"""
+Compare the Flan-T5 description backends (torch fp32, torch int8, onnxruntime) on CPU.
+
+Every (model, backend) pair runs in a fresh spawned process so memory numbers are not
+polluted by earlier loads. Reported per pair:
+  - load_s:  model load time (the first run of int8/onnx also pays the one-off export)
+  - rss_mb:  resident memory added by loading the model
+  - mean_ms / p95_ms: one generate call (NUM_CANDIDATES samples) per product prompt
+  - tok/s:   generated tokens per second
+
+Usage (from ml/):
+  python scripts/bench_t5_backends.py [--models google/flan-t5-base google/flan-t5-large]
+                                      [--backends torch int8 onnx] [--repeat 3]
+"""
+import argparse
+import multiprocessing as mp
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PRODUCTS = [
+    ("Hand-thrown Stoneware Mug", ["Food-safe glaze", "Holds 350 ml", "Dishwasher safe"], "Kitchen"),
+    ("Block Printed Cotton Table Runner", ["Hand block printed", "Natural dyes"], "Home & Living"),
+    ("Brass Diya Set of 4", ["Solid brass", "Hand polished"], "Decor"),
+    ("Jute Tote Bag", ["Eco-friendly jute", "Cotton lining", "Inner zip pocket"], "Bags"),
+]
+
+
+def _run(model_name, backend, repeat, out):
+    import psutil
+    import torch
+    from transformers import T5Tokenizer
+
+    import generate_description as gd
+    from t5_backends import load_t5_model
+
+    proc = psutil.Process()
+    rss0 = proc.memory_info().rss
+    t0 = time.perf_counter()
+    tokenizer = T5Tokenizer.from_pretrained(model_name, cache_dir=gd.CACHE_DIR)
+    model = load_t5_model(model_name, gd.CACHE_DIR, backend)
+    load_s = time.perf_counter() - t0
+    rss_mb = (proc.memory_info().rss - rss0) / 2**20
+
+    kwargs = gd._gen_kwargs(tokenizer, gd.MAX_TOKENS, gd.TEMPERATURE, gd.TOP_P, gd.NUM_CANDIDATES)
+    prompts = [gd.compile_prompt(tokenizer, t, f, c) for t, f, c in PRODUCTS]
+    gd._generate_batch_ids(tokenizer, model, prompts[:1], kwargs)  # warm-up
+
+    lat = []
+    tokens0 = gd.REGISTRY.counter("gen_tokens_total")
+    for r in range(max(1, repeat)):
+        for i, ids in enumerate(prompts):
+            torch.manual_seed(1000 * i + r)
+            t0 = time.perf_counter()
+            gd._generate_batch_ids(tokenizer, model, [ids], kwargs)
+            lat.append(time.perf_counter() - t0)
+    tokens = gd.REGISTRY.counter("gen_tokens_total") - tokens0
+    out.put((load_s, rss_mb, lat, tokens))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Flan-T5 backends")
+    parser.add_argument("--models", nargs="+", default=["google/flan-t5-base", "google/flan-t5-large"])
+    parser.add_argument("--backends", nargs="+", default=["torch", "int8", "onnx"], choices=["torch", "int8", "onnx"])
+    parser.add_argument("--repeat", type=int, default=3, help="Generations per product")
+    args = parser.parse_args()
+
+    ctx = mp.get_context("spawn")
+    print(f"products={len(PRODUCTS)} repeat={args.repeat}")
+    print(f"{'model':<24} {'backend':<7} {'load_s':>7} {'rss_mb':>8} {'mean_ms':>9} {'p95_ms':>9} {'tok/s':>7}")
+    for model_name in args.models:
+        for backend in args.backends:
+            out = ctx.Queue()
+            p = ctx.Process(target=_run, args=(model_name, backend, args.repeat, out))
+            p.start()
+            p.join()
+            if out.empty():
+                print(f"{model_name:<24} {backend:<7} failed (exit code {p.exitcode})")
+                continue
+            load_s, rss_mb, lat, tokens = out.get()
+            lat.sort()
+            n = len(lat)
+            print(f"{model_name:<24} {backend:<7} {load_s:>7.1f} {rss_mb:>8.0f} {1000 * sum(lat) / n:>9.0f} "
+                  f"{1000 * lat[min(n - 1, int(0.95 * n))]:>9.0f} {tokens / sum(lat):>7.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+# ml/serve.py
+"""
+Multi-process server for the ML service.
+
+`uvicorn app:app --workers N` makes every worker load its own text model, CLIP models and
+FAISS index. This runner loads them once in the parent, then forks the workers, so the
+model weights are shared copy-on-write (gc.freeze() keeps the garbage collector from
+touching, and so copying, the pages of objects created before the fork). Each worker
+serves from the same listening socket and keeps its own executors, caches and metrics.
+
+The persisted index is memory-mapped read-only (INDEX_MMAP), so every worker reads the same
+page-cache copy. A rebuild or sync in any worker (or `python faiss_index.py`) publishes a new
+snapshot; the other workers reload it within INDEX_RELOAD_INTERVAL seconds and report it as
+`index_version` on /health.
+
+Models backed by onnxruntime are loaded in each worker instead: onnxruntime starts its
+thread pools when a session is created, and threads do not survive fork. For the same
+reason the parent runs torch single-threaded while loading and never runs inference;
+models are warmed in the workers.
+
+Usage (from ml/):
+  python serve.py [--workers 2] [--host 0.0.0.0] [--port 8000]
+
+Environment variables (optional):
+- ML_WORKERS (default: 2) worker processes
+- PORT (default: 8000)
+- ML_CPU_BUDGET and torch's thread count are split evenly across the workers
+- ML_METRICS_DIR (default: a fresh temporary directory) where workers share their metrics,
+  so /metrics on any worker reports the totals of all of them
+"""
+import argparse
+import gc
+import logging
+import os
+import signal
+import socket
+import sys
+import tempfile
+import time
+
+# the model modules (torch, app, ...) are imported in main(): the color pool's spawned
+# workers re-import __main__, and should not load them again
+from executors import ML_CPU_BUDGET, set_cpu_budget
+from metrics import enable_multiprocess
+
+LOG = logging.getLogger("serve")
+
+ML_WORKERS = int(os.environ.get("ML_WORKERS", "2"))
+# a worker that exits sooner than this after starting is restarted with a delay
+RESTART_BACKOFF_S = 5.0
+
+
+def _bind(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _run_worker(sock: socket.socket, workers: int) -> None:
+    import uvicorn
+
+    import app as service
+
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    # each worker gets its share of the cores; the lifespan sizes the executors and torch's
+    # thread cap (executors.apply_torch_threads) from this budget
+    set_cpu_budget(ML_CPU_BUDGET // workers)
+    if service.indexer is not None:
+        service.indexer.reconnect()
+    config = uvicorn.Config(service.app, log_level="info", lifespan="on")
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def _spawn(sock: socket.socket, workers: int) -> int:
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            _run_worker(sock, workers)
+        except BaseException:
+            LOG.exception("Worker %d crashed", os.getpid())
+            code = 1
+        finally:
+            os._exit(code)
+    LOG.info("Started worker %d", pid)
+    return pid
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the ML service from pre-forked workers")
+    parser.add_argument("--workers", type=int, default=ML_WORKERS)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", 8000)))
+    args = parser.parse_args()
+    workers = max(1, args.workers)
+
+    import torch
+
+    import app as service
+    from clip_onnx import CLIP_BACKEND
+    from t5_backends import GEN_BACKEND
+
+    torch.set_num_threads(1)
+    t0 = time.perf_counter()
+    service.load_models(clip=CLIP_BACKEND != "onnx",
+                        generator=service.GEN_DESC_EAGER and GEN_BACKEND != "onnx")
+    LOG.info("Models loaded in parent in %.1fs; forking %d workers", time.perf_counter() - t0, workers)
+    gc.collect()
+    gc.freeze()
+
+    # a fresh directory per run: totals restart with the server, like a single process's would
+    metrics_dir = os.environ.get("ML_METRICS_DIR") or tempfile.mkdtemp(prefix="ml-metrics-")
+    enable_multiprocess(metrics_dir)
+    for name in os.listdir(metrics_dir):
+        if name.endswith(".json"):
+            os.remove(os.path.join(metrics_dir, name))
+
+    sock = _bind(args.host, args.port)
+    children = {}
+    for _ in range(workers):
+        children[_spawn(sock, workers)] = time.monotonic()
+
+    stopping = False
+
+    def _stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        started = children.pop(pid, None)
+        if started is None or stopping:
+            continue
+        LOG.warning("Worker %d exited (status %d); restarting", pid, status)
+        if time.monotonic() - started < RESTART_BACKOFF_S:
+            time.sleep(RESTART_BACKOFF_S)
+        children[_spawn(sock, workers)] = time.monotonic()
+    sock.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
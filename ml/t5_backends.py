@@ -0,0 +1,111 @@
+# ml/t5_backends.py
+"""
+Alternative CPU backends for the Flan-T5 description model.
+
+- torch: the fp32 T5ForConditionalGeneration (default)
+- int8:  torch dynamic int8 quantization of the Linear layers; the quantized module is
+         saved once to HF_HOME/t5/<model>-int8.pt so later starts skip the fp32 load
+- onnx:  encoder/decoder (with KV-cache) exported through optimum and run by onnxruntime;
+         the export is saved once to HF_HOME/onnx/t5/<model>/
+
+All backends expose the transformers generate()/get_encoder() API, so generate_description
+does not care which one is loaded. If a backend cannot be loaded the caller falls back to torch.
+
+Environment variables (optional):
+- GEN_DESC_BACKEND (default: "torch"; "int8" or "onnx")
+- GEN_DESC_ORT_THREADS (default: 0 = onnxruntime default) intra-op threads per session
+"""
+import os
+import logging
+import shutil
+import tempfile
+
+LOG = logging.getLogger("t5_backends")
+
+T5_BACKENDS = ("torch", "int8", "onnx")
+GEN_BACKEND = os.environ.get("GEN_DESC_BACKEND", "torch").lower()
+GEN_ORT_THREADS = int(os.environ.get("GEN_DESC_ORT_THREADS", "0"))
+
+
+def _safe_name(model_name: str) -> str:
+    return model_name.replace("/", "--")
+
+
+def int8_path(cache_dir: str, model_name: str) -> str:
+    return os.path.join(cache_dir, "t5", f"{_safe_name(model_name)}-int8.pt")
+
+
+def onnx_dir(cache_dir: str, model_name: str) -> str:
+    return os.path.join(cache_dir, "onnx", "t5", _safe_name(model_name))
+
+
+def load_torch(model_name: str, cache_dir: str):
+    import torch
+    from transformers import T5ForConditionalGeneration
+
+    model = T5ForConditionalGeneration.from_pretrained(model_name, cache_dir=cache_dir)
+    return model.to(torch.device("cpu")).eval()
+
+
+def load_int8(model_name: str, cache_dir: str):
+    import torch
+
+    path = int8_path(cache_dir, model_name)
+    if os.path.exists(path):
+        try:
+            LOG.info("Loading int8 T5 from %s", path)
+            return torch.load(path, weights_only=False).eval()
+        except Exception as e:
+            LOG.warning("Cached int8 T5 unreadable (%s); re-quantizing.", e)
+
+    model = load_torch(model_name, cache_dir)
+    LOG.info("Quantizing %s Linear layers to int8", model_name)
+    qmodel = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8).eval()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp{os.getpid()}"
+    torch.save(qmodel, tmp)
+    os.replace(tmp, path)
+    return qmodel
+
+
+def load_onnx(model_name: str, cache_dir: str, threads: int = GEN_ORT_THREADS):
+    # optional dependency: pip install optimum[onnxruntime]
+    import onnxruntime as ort
+    from optimum.onnxruntime import ORTModelForSeq2SeqLM
+
+    opts = ort.SessionOptions()
+    if threads > 0:
+        opts.intra_op_num_threads = threads
+    opts.inter_op_num_threads = 1
+    opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+    out_dir = onnx_dir(cache_dir, model_name)
+    if os.path.exists(os.path.join(out_dir, "config.json")):
+        LOG.info("Loading ONNX T5 from %s", out_dir)
+        return ORTModelForSeq2SeqLM.from_pretrained(out_dir, use_cache=True, session_options=opts)
+
+    LOG.info("Exporting %s to ONNX (encoder + decoder with KV-cache): %s", model_name, out_dir)
+    model = ORTModelForSeq2SeqLM.from_pretrained(model_name, export=True, use_cache=True,
+                                                 cache_dir=cache_dir, session_options=opts)
+    # export to a private directory, then rename it into place; several workers may export at once
+    os.makedirs(os.path.dirname(out_dir), exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix=os.path.basename(out_dir) + ".tmp", dir=os.path.dirname(out_dir))
+    try:
+        model.save_pretrained(tmp)
+        os.rename(tmp, out_dir)
+    except OSError:
+        if not os.path.exists(os.path.join(out_dir, "config.json")):
+            raise
+        LOG.info("ONNX T5 export already saved to %s by another process; keeping that one", out_dir)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return model
+
+
+def load_t5_model(model_name: str, cache_dir: str, backend: str = GEN_BACKEND):
+    """Load the description model with the requested backend. Raises on failure."""
+    if backend == "int8":
+        return load_int8(model_name, cache_dir)
+    if backend == "onnx":
+        return load_onnx(model_name, cache_dir)
+    return load_torch(model_name, cache_dir)
@@ -0,0 +1,79 @@
+import pytest
+
+pytest.importorskip("dotenv")
+bson = pytest.importorskip("bson")
+
+import generate_description as gd
+
+
+class _Cursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, *args):
+        return self
+
+    def batch_size(self, n):
+        return self
+
+    def limit(self, n):
+        self.docs = self.docs[:n]
+        return self
+
+    def __iter__(self):
+        return iter(self.docs)
+
+
+class _Collection:
+    """Records the find() query; returns the docs whose _id is after the resume point."""
+
+    def __init__(self, docs):
+        self.docs = docs
+        self.queries = []
+
+    def find(self, query, projection=None):
+        self.queries.append(query)
+        after = None
+        for clause in query.get("$and", []):
+            after = clause.get("_id", {}).get("$gt", after)
+        return _Cursor([d for d in self.docs if after is None or d["_id"] > after])
+
+
+@pytest.fixture
+def no_model(monkeypatch):
+    """Skip generation: every chunk is recorded instead of written."""
+    seen = []
+    monkeypatch.setattr(gd, "_init_local_model", lambda name: (object(), object()))
+    monkeypatch.setattr(gd, "_backfill_chunk", lambda coll, tok, model, docs, *args: seen.append([d["_id"] for d in docs]))
+    return seen
+
+
+def test_filter_matches_missing_null_empty_and_short():
+    clauses = gd._needs_description_filter(60)["$or"]
+    assert {"description": {"$exists": False}} in clauses
+    assert {"description": {"$in": [None, ""]}} in clauses
+    short = clauses[2]["$expr"]["$and"][1]["$lt"]
+    assert short[1] == 60
+
+
+def test_checkpoint_roundtrip(tmp_path):
+    path = str(tmp_path / "ckpt" / "backfill.json")
+    assert gd._load_checkpoint(path) is None
+    oid = bson.ObjectId()
+    gd._save_checkpoint(path, oid, {"processed": 3})
+    assert gd._load_checkpoint(path) == oid
+
+
+def test_backfill_resumes_after_checkpoint(tmp_path, no_model):
+    path = str(tmp_path / "backfill.json")
+    docs = [{"_id": bson.ObjectId(), "title": f"item {i}"} for i in range(5)]
+    coll = _Collection(docs)
+
+    gd.backfill_descriptions(coll, checkpoint_path=path, chunk_size=2, limit=3)
+    assert no_model == [[docs[0]["_id"], docs[1]["_id"]], [docs[2]["_id"]]]
+    assert gd._load_checkpoint(path) == docs[2]["_id"]
+
+    no_model.clear()
+    gd.backfill_descriptions(coll, checkpoint_path=path, chunk_size=2)
+    assert coll.queries[-1]["$and"][1] == {"_id": {"$gt": docs[2]["_id"]}}
+    assert no_model == [[docs[3]["_id"], docs[4]["_id"]]]
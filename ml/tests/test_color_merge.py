@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+from color_detector import ImagePalette, merge_palettes
+
+
+def _palette(centers, fracs, n_pixels=100):
+    return ImagePalette(np.array(centers, dtype=np.float64), np.array(fracs, dtype=np.float64), n_pixels, 0)
+
+
+def test_near_colors_across_images_merge():
+    red, red_2, blue = [50, 70, 50], [52, 68, 51], [30, 20, -60]
+    centers, shares, sources = merge_palettes(
+        [_palette([red, blue], [0.75, 0.25]), _palette([red_2], [1.0], n_pixels=300)],
+        ["a.jpg", "b.jpg"], delta_e=10,
+    )
+    assert len(centers) == 2
+    # every image weighs the same in the shares: (0.75 + 1.0) / 2 vs 0.25 / 2
+    assert shares == pytest.approx([0.875, 0.125])
+    # Lab is averaged by pixel count (75 vs 300); the larger share seeds the cluster
+    assert centers[0] == pytest.approx((np.array(red) * 75 + np.array(red_2) * 300) / 375)
+    assert sources == ["b.jpg", "a.jpg"]
+
+
+def test_colors_beyond_delta_e_stay_apart():
+    centers, shares, _ = merge_palettes(
+        [_palette([[50, 0, 0]], [1.0]), _palette([[50, 11, 0]], [1.0])], ["a", "b"], delta_e=10,
+    )
+    assert len(centers) == 2
+    assert shares == pytest.approx([0.5, 0.5])
+
+
+def test_missing_palettes_skipped():
+    centers, shares, sources = merge_palettes([None, _palette([], [])], ["a", "b"])
+    assert (len(centers), len(shares), sources) == (0, 0, [])
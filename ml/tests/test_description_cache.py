@@ -0,0 +1,44 @@
+import itertools
+
+import pytest
+
+import description_cache
+from description_cache import DescriptionCache, cache_key
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Strictly increasing time.time(), so last_used never ties between calls."""
+    ticks = itertools.count(1000)
+    monkeypatch.setattr(description_cache.time, "time", lambda: float(next(ticks)))
+
+
+def test_candidates_round_robin_newest_first(tmp_path, clock):
+    cache = DescriptionCache(str(tmp_path / "cache.sqlite"), max_entries=10, variants=3)
+    cache.put("k", ["a"])
+    cache.put("k", ["b"])
+    cache.put("k", ["c", "b"])
+    cache.put("k", ["d"])
+    # newest first, duplicates dropped, capped at `variants`; the cursor skips the candidate
+    # the caller just returned
+    assert [cache.get("k") for _ in range(4)] == ["c", "b", "d", "c"]
+    assert cache.get("missing") is None
+
+
+def test_least_recently_used_keys_evicted(tmp_path, clock):
+    cache = DescriptionCache(str(tmp_path / "cache.sqlite"), max_entries=2, variants=1)
+    cache.put("old", ["1"])
+    cache.put("used", ["2"])
+    cache.get("old")
+    cache.put("new", ["3"])
+    assert len(cache) == 2
+    assert cache.get("used") is None
+    assert cache.get("old") == "1"
+    assert cache.get("new") == "3"
+
+
+def test_cache_key_normalizes_request():
+    a = cache_key("  Linen  Scarf ", ["Hand Woven", ""], "Accessories", "friendly", model="t5", num_beams=4)
+    b = cache_key("linen scarf", ["hand woven"], "accessories", "Friendly", num_beams=4, model="t5")
+    assert a == b
+    assert a != cache_key("linen scarf", ["hand woven"], "accessories", "friendly", model="t5", num_beams=2)
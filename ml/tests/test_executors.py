@@ -0,0 +1,54 @@
+import threading
+
+import pytest
+
+from executors import Rejected, WorkloadExecutor
+
+
+def _blocked_executor(name, max_queue):
+    """Single-worker executor whose worker is busy until the returned event is set."""
+    ex = WorkloadExecutor(name, workers=1, torch_threads=0, claim=0, max_queue=max_queue)
+    release, started = threading.Event(), threading.Event()
+
+    def hold():
+        started.set()
+        release.wait(5)
+
+    ex.submit(hold)
+    assert started.wait(5)
+    return ex, release
+
+
+def test_batch_shed_while_interactive_admitted():
+    ex, release = _blocked_executor("test-shed", max_queue=4)
+    try:
+        queued = [ex.submit(lambda: "interactive") for _ in range(2)]
+        with pytest.raises(Rejected) as err:
+            ex.submit(lambda: "batch", priority="batch")
+        assert (err.value.reason, err.value.status) == ("batch_shed", 429)
+        queued.append(ex.submit(lambda: "interactive", priority="interactive"))
+    finally:
+        release.set()
+    assert [f.result(5) for f in queued] == ["interactive"] * 3
+
+
+def test_interactive_runs_before_queued_batch():
+    ex, release = _blocked_executor("test-order", max_queue=8)
+    order = []
+    try:
+        futures = [ex.submit(order.append, "batch", priority="batch"),
+                   ex.submit(order.append, "interactive")]
+    finally:
+        release.set()
+    for f in futures:
+        f.result(5)
+    assert order == ["interactive", "batch"]
+
+
+def test_batch_admitted_with_single_slot_queue():
+    ex, release = _blocked_executor("test-single", max_queue=1)
+    try:
+        queued = ex.submit(lambda: "batch", priority="batch")
+    finally:
+        release.set()
+    assert queued.result(5) == "batch"
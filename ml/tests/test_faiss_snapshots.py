@@ -0,0 +1,51 @@
+import os
+
+import numpy as np
+import pytest
+
+faiss = pytest.importorskip("faiss")
+for _name in ("pymongo", "bson", "sentence_transformers", "tqdm", "pytz"):
+    pytest.importorskip(_name)
+
+import faiss_index
+from faiss_index import FaissTextIndexer
+
+
+def _indexer(data_dir):
+    # MongoClient connects lazily; the text model is never used by these tests
+    return FaissTextIndexer("db", "listings", str(data_dir), mongo_uri="mongodb://localhost:1", text_model=object())
+
+
+def _fill(indexer, n, dim=4):
+    vecs = np.random.default_rng(n).random((n, dim), dtype=np.float32)
+    indexer.index = faiss.IndexIDMap(faiss.IndexFlatIP(dim))
+    indexer.index.add_with_ids(vecs, np.arange(n, dtype=np.int64))
+    indexer.id_to_meta = {str(i): {"title": f"item {i}"} for i in range(n)}
+
+
+def test_persist_publishes_and_other_process_reloads(tmp_path):
+    writer, reader = _indexer(tmp_path), _indexer(tmp_path)
+    assert reader.version == 0 and reader.index is None
+    assert not reader.reload_if_changed()
+
+    _fill(writer, 3)
+    writer._persist()
+    assert writer.published_version() == writer.version == 1
+    assert reader.reload_if_changed()
+    assert (reader.version, reader.index.ntotal) == (1, 3)
+    assert reader.id_to_meta["2"]["title"] == "item 2"
+    assert not reader.reload_if_changed()
+
+    # a fresh process starts from the published snapshot
+    assert _indexer(tmp_path).index.ntotal == 3
+
+
+def test_old_snapshots_pruned(tmp_path, monkeypatch):
+    monkeypatch.setattr(faiss_index, "INDEX_SNAPSHOTS_KEEP", 2)
+    writer, reader = _indexer(tmp_path), _indexer(tmp_path)
+    for n in range(1, 5):
+        _fill(writer, n)
+        writer._persist()
+    assert sorted(os.listdir(tmp_path / "snapshots")) == ["3", "4"]
+    assert reader.reload_if_changed()
+    assert (reader.version, reader.index.ntotal) == (4, 4)